@@ -0,0 +1,113 @@
+# benchmarks/access_filter_benchmark.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from components.file_component import FileComponent
+from components.metadata_store import JsonMetadataStore, SQLiteMetadataStore
+from components.policy_compiler import attribute_mask, compile_policy
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "access_filter_results.json")
+SIZES = [10000, 100000, 300000]
+QUERIES_PER_CASE = 50
+# weights skew the catalog so some users can open most files and others very few
+POLICIES = [
+    ("role:student", 40), ("role:prof", 25), ("role:prof and dept:cs", 15), ("dept:math or dept:eng", 10),
+    ("(role:prof and dept:eng) or role:admin", 6), ("role:admin", 3), ("role:student and dept:math", 1),
+]
+USERS = {
+    "student": ["role:student", "dept:cs"],
+    "prof_cs": ["role:prof", "dept:cs"],
+    "math_student": ["role:student", "dept:math"],
+    "admin": ["role:admin"],
+    "nobody": ["dept:cs"],
+}
+
+
+def make_records(n):
+    base = datetime(2024, 1, 1)
+    names, weights = zip(*POLICIES)
+    for i, policy in enumerate(random.choices(names, weights, k=n)):
+        yield {
+            "id": str(uuid.uuid4()),
+            "display_name": f"file_{i}",
+            "uploader": f"user{i % 50}",
+            "orig_filename": f"file_{i}.pdf",
+            "policy": policy,
+            "created": (base + timedelta(seconds=i * 11)).isoformat(),
+            "context_policy": {},
+        }
+
+
+def time_calls(fn):
+    start = time.perf_counter()
+    for _ in range(QUERIES_PER_CASE):
+        fn()
+    return round((time.perf_counter() - start) / QUERIES_PER_CASE * 1000.0, 3)
+
+
+def naive_page(store, attributes, limit=50):
+    # previous behaviour pushed into the listing: walk pages, compile every file's policy
+    mask, rows, after = attribute_mask(attributes), [], None
+    while len(rows) < limit:
+        page = store.query_files(after=after, limit=500)
+        if not page:
+            break
+        for rec in page:
+            compiled = compile_policy(rec["policy"])
+            if compiled and compiled.satisfied_by(mask):
+                rows.append(rec)
+        after = (page[-1]["created"], page[-1]["id"])
+    return rows[:limit]
+
+
+def benchmark_store(store, n):
+    store.put_files(list(make_records(n)))
+    comp = FileComponent(store)
+    latency = {}
+    for name, attrs in USERS.items():
+        latency[f"filtered_{name}"] = time_calls(lambda: comp.query_files(accessible_to=attrs, limit=50))
+    latency["naive_math_student"] = time_calls(lambda: naive_page(store, USERS["math_student"]))
+    latency["unfiltered"] = time_calls(lambda: comp.query_files(limit=50))
+    return latency
+
+
+def run(sizes=SIZES):
+    results = []
+    for n in sizes:
+        for name, factory in (("json", JsonMetadataStore), ("sqlite", lambda: SQLiteMetadataStore(import_from=None))):
+            workdir = tempfile.mkdtemp()
+            cwd = os.getcwd()
+            os.chdir(workdir)
+            try:
+                store = factory()
+                latency = benchmark_store(store, n)
+                store.close()
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(workdir, ignore_errors=True)
+            results.append({"backend": name, "records": n, "latency_ms": latency})
+            print(f"{name:6s} n={n:7d} " + " ".join(f"{k}={v}ms" for k, v in latency.items()))
+    return results
+
+
+if __name__ == "__main__":
+    print("🚀 Running accessibility filter benchmark...")
+    sizes = [int(a) for a in sys.argv[1:]] or SIZES
+    results = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "queries_per_case": QUERIES_PER_CASE,
+        "results": run(sizes),
+    }
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📊 Results saved to {RESULTS_FILE}")
@@ -0,0 +1,108 @@
+# benchmarks/context_policy_benchmark.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import random
+import time
+
+from components.context_component import ContextComponent
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "context_policy_results.json")
+SIZES = [10000, 100000, 1000000]
+CHECKS_PER_CASE = 200000
+LOCATIONS = [f"city{i}" for i in range(200)]
+DEVICES = [f"device{i}" for i in range(5000)]
+# files share rule sets (a department's locations, a team's devices), as they do in practice
+LOCATION_SETS = [random.sample(LOCATIONS, random.randint(5, 40)) for _ in range(2000)]
+DEVICE_SETS = [random.sample(DEVICES, random.randint(1, 20)) for _ in range(20000)]
+
+
+def make_policy(i):
+    # copies, as json.loads from the store would hand them over
+    policy = {"allowed_locations": list(random.choice(LOCATION_SETS))}
+    if i % 3 == 0:
+        policy["allowed_devices"] = list(random.choice(DEVICE_SETS))
+    if i % 5 == 0:
+        policy["time_window"] = [0, 4102444800]
+    return policy
+
+
+def legacy_check(policies, file_id, context):
+    # the previous check_access: list membership on the raw policy dict
+    pol = policies.get(file_id)
+    if not pol:
+        return True
+    if "allowed_locations" in pol and context.get("location") not in pol["allowed_locations"]:
+        return False
+    if "time_window" in pol and isinstance(pol["time_window"], (list, tuple)) and len(pol["time_window"]) == 2:
+        start, end = pol["time_window"]
+        if not (start <= context.get("time", time.time()) <= end):
+            return False
+    if "allowed_devices" in pol and context.get("device_id") not in pol["allowed_devices"]:
+        return False
+    return True
+
+
+def batch_costs(comp, file_ids):
+    """ms for one context's "accessible now" view: whole catalog and a 500-file page, batch vs per file."""
+    context = {"location": random.choice(LOCATIONS), "device_id": random.choice(DEVICES), "time": 1700000000}
+    page = random.sample(file_ids, 500)
+    costs = {}
+    for name, ids, runs in (("catalog", file_ids, 3), ("page", page, 200)):
+        start = time.perf_counter()
+        for _ in range(runs):
+            batch = comp.check_access_many(ids, context)
+        costs[f"{name}_batch_ms"] = round((time.perf_counter() - start) / runs * 1000.0, 3)
+        start = time.perf_counter()
+        for _ in range(runs):
+            single = {fid for fid in ids if comp.check_access(fid, context)}
+        costs[f"{name}_per_file_ms"] = round((time.perf_counter() - start) / runs * 1000.0, 3)
+        assert batch == single
+    return costs
+
+
+def run(sizes=SIZES):
+    results = []
+    for n in sizes:
+        policies = {f"file{i}": make_policy(i) for i in range(n)}
+        comp = ContextComponent()
+        start = time.perf_counter()
+        comp.load(policies)
+        load_s = round(time.perf_counter() - start, 3)
+        # every candidate context allowed by the policy's first location, so all rules are evaluated
+        probes = []
+        for _ in range(CHECKS_PER_CASE):
+            fid = f"file{random.randrange(n)}"
+            pol = policies[fid]
+            probes.append((fid, {"location": random.choice(pol["allowed_locations"]),
+                                 "device_id": random.choice(pol.get("allowed_devices") or DEVICES),
+                                 "time": 1700000000}))
+        start = time.perf_counter()
+        allowed = sum(comp.check_access(fid, ctx) for fid, ctx in probes)
+        compiled_s = time.perf_counter() - start
+        start = time.perf_counter()
+        legacy_allowed = sum(legacy_check(policies, fid, ctx) for fid, ctx in probes)
+        legacy_s = time.perf_counter() - start
+        assert allowed == legacy_allowed
+        row = {"policies": n, "load_s": load_s, "compiled_forms": len(comp._interned),
+               "checks_per_s": int(CHECKS_PER_CASE / compiled_s), "legacy_checks_per_s": int(CHECKS_PER_CASE / legacy_s)}
+        row.update(batch_costs(comp, list(policies)))
+        results.append(row)
+        print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return results
+
+
+if __name__ == "__main__":
+    print("🚀 Running context policy benchmark...")
+    sizes = [int(a) for a in sys.argv[1:]] or SIZES
+    results = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "checks_per_case": CHECKS_PER_CASE,
+        "results": run(sizes),
+    }
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📊 Results saved to {RESULTS_FILE}")
@@ -0,0 +1,110 @@
+# benchmarks/context_rule_benchmark.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ipaddress
+import json
+import random
+import time
+
+from components.context_component import ContextComponent
+from components.context_policy import compile_rule
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "context_rule_results.json")
+SIZES = [10000, 100000]
+CHECKS_PER_CASE = 100000
+DEPARTMENTS = [f"dept{i}" for i in range(50)]
+NETWORKS = [f"10.{i}.0.0/16" for i in range(64)] + [f"192.168.{i}.0/24" for i in range(64)]
+# a few hundred distinct rules shared by the catalog, as department / office policies are
+RULES = [
+    {"all": [
+        {"cidr": {"networks": random.sample(NETWORKS, 16)}},
+        {"schedule": {"days": ["mon", "tue", "wed", "thu", "fri"], "from": "08:00", "to": "20:00", "utc_offset": 330}},
+        {"any": [{"in": {"field": "department", "values": random.sample(DEPARTMENTS, 5)}},
+                 {"in": {"field": "role", "values": ["admin"]}}]},
+        {"not": {"in": {"field": "location", "values": ["blocked"]}}},
+    ]}
+    for _ in range(300)
+]
+
+
+def naive_eval(node, ctx, now):
+    # the rule interpreted as written: tree walk, operands in stored order, networks parsed per check
+    op, args = next(iter(node.items()))
+    if op == "all":
+        return all(naive_eval(c, ctx, now) for c in args)
+    if op == "any":
+        return any(naive_eval(c, ctx, now) for c in args)
+    if op == "not":
+        return not naive_eval(args, ctx, now)
+    if op == "in":
+        return ctx.get(args["field"]) in args["values"]
+    if op == "cidr":
+        addr = ipaddress.ip_address(ctx.get(args.get("field", "ip")))
+        return any(addr in ipaddress.ip_network(n) for n in args["networks"])
+    if op == "schedule":
+        local = now + args.get("utc_offset", 0) * 60
+        day = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")[(int(local // 86400) + 3) % 7]
+        h, m = (int(x) for x in args["from"].split(":"))
+        h2, m2 = (int(x) for x in args["to"].split(":"))
+        return day in args["days"] and h * 3600 + m * 60 <= local % 86400 < h2 * 3600 + m2 * 60
+    raise ValueError(op)
+
+
+def make_context():
+    net = ipaddress.ip_network(random.choice(NETWORKS))
+    return {"department": random.choice(DEPARTMENTS), "location": "office",
+            "ip": str(net[random.randrange(net.num_addresses)]),
+            "time": 1717400000 + random.randrange(7 * 86400)}
+
+
+def run(sizes=SIZES):
+    results = []
+    compiled = [compile_rule(r) for r in RULES]
+    probes = [(random.randrange(len(RULES)), make_context()) for _ in range(CHECKS_PER_CASE)]
+    start = time.perf_counter()
+    fast = [compiled[i](ctx, ctx["time"]) for i, ctx in probes]
+    compiled_s = time.perf_counter() - start
+    start = time.perf_counter()
+    slow = [naive_eval(RULES[i], ctx, ctx["time"]) for i, ctx in probes]
+    naive_s = time.perf_counter() - start
+    assert fast == slow
+    single = {"rules": len(RULES), "allowed_pct": round(100.0 * sum(fast) / len(fast), 1),
+              "compiled_checks_per_s": int(CHECKS_PER_CASE / compiled_s),
+              "naive_checks_per_s": int(CHECKS_PER_CASE / naive_s)}
+    print(" ".join(f"{k}={v}" for k, v in single.items()))
+
+    for n in sizes:
+        policies = {f"file{i}": {"rule": random.choice(RULES)} for i in range(n)}
+        comp = ContextComponent()
+        start = time.perf_counter()
+        comp.load(policies)
+        load_s = round(time.perf_counter() - start, 3)
+        ctx = make_context()
+        start = time.perf_counter()
+        batch = comp.check_access_many(policies, ctx)
+        batch_ms = round((time.perf_counter() - start) * 1000.0, 3)
+        start = time.perf_counter()
+        naive = {fid for fid, pol in policies.items() if naive_eval(pol["rule"], ctx, ctx["time"])}
+        naive_ms = round((time.perf_counter() - start) * 1000.0, 3)
+        assert batch == naive
+        row = {"policies": n, "load_s": load_s, "compiled_forms": len(comp._interned),
+               "catalog_batch_ms": batch_ms, "catalog_naive_ms": naive_ms}
+        results.append(row)
+        print(" ".join(f"{k}={v}" for k, v in row.items()))
+    return {"single_checks": single, "catalog": results}
+
+
+if __name__ == "__main__":
+    print("🚀 Running context rule benchmark...")
+    sizes = [int(a) for a in sys.argv[1:]] or SIZES
+    results = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "checks_per_case": CHECKS_PER_CASE,
+        "results": run(sizes),
+    }
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📊 Results saved to {RESULTS_FILE}")
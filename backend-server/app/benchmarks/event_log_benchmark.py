@@ -0,0 +1,85 @@
+# benchmarks/event_log_benchmark.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import shutil
+import tempfile
+import time
+
+from components.event_logger import EventLog
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "event_log_results.json")
+HISTORY_SIZES = [0, 10000, 50000]
+EVENTS_PER_CASE = 200
+
+
+def legacy_log_event(path, user, action, details):
+    # the previous log_event: load the whole array, prepend, rewrite
+    with open(path, "r+") as f:
+        events = json.load(f)
+        events.insert(0, {"id": len(events) + 1, "user": user, "action": action,
+                          "timestamp": "2024-01-01T00:00:00Z", "details": details})
+        f.seek(0)
+        json.dump(events, f, indent=4)
+
+
+def legacy_get_events(path, limit=50):
+    # the previous get_events: parse the whole array for one page
+    with open(path, "r") as f:
+        return json.load(f)[:limit]
+
+
+def time_appends(fn):
+    start = time.perf_counter()
+    for i in range(EVENTS_PER_CASE):
+        fn(i)
+    return round((time.perf_counter() - start) / EVENTS_PER_CASE * 1000.0, 4)
+
+
+def run(sizes=HISTORY_SIZES):
+    results = []
+    for n in sizes:
+        workdir = tempfile.mkdtemp()
+        try:
+            legacy = os.path.join(workdir, "security_events.json")
+            with open(legacy, "w") as f:
+                json.dump([{"id": i, "user": "u", "action": "LOGIN_SUCCESS", "timestamp": "2024-01-01T00:00:00Z",
+                            "details": {}} for i in range(n, 0, -1)], f)
+            legacy_ms = time_appends(lambda i: legacy_log_event(legacy, "u", "DOWNLOAD_SUCCESS", {"i": i}))
+            legacy_read_ms = time_appends(lambda i: legacy_get_events(legacy))
+
+            log = EventLog(os.path.join(workdir, "log"), fsync="never", legacy_file=None)
+            log.append_many([{"user": "u", "action": "LOGIN_SUCCESS"} for _ in range(n)])
+            jsonl_ms = time_appends(lambda i: log.append("u", "DOWNLOAD_SUCCESS", {"i": i}))
+            log.fsync = "always"
+            fsync_ms = time_appends(lambda i: log.append("u", "DOWNLOAD_SUCCESS", {"i": i}))
+            # first reads catch the ring up and build the offset index once
+            log.recent(1)
+            log.recent(1, before=max(2, n // 2))
+            recent_ms = time_appends(lambda i: log.recent(50))
+            # a page far older than the ring, served through the offset index
+            page_ms = time_appends(lambda i: log.recent(50, before=max(2, n // 2)))
+            log.close()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        results.append({"history": n, "legacy_ms": legacy_ms, "jsonl_ms": jsonl_ms, "jsonl_fsync_ms": fsync_ms,
+                        "legacy_read_ms": legacy_read_ms, "recent_ms": recent_ms, "old_page_ms": page_ms})
+        print(f"history={n:7d} legacy={legacy_ms}ms jsonl={jsonl_ms}ms jsonl_fsync={fsync_ms}ms "
+              f"legacy_read={legacy_read_ms}ms recent={recent_ms}ms old_page={page_ms}ms")
+    return results
+
+
+if __name__ == "__main__":
+    print("🚀 Running event log benchmark...")
+    sizes = [int(a) for a in sys.argv[1:]] or HISTORY_SIZES
+    results = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "events_per_case": EVENTS_PER_CASE,
+        "results": run(sizes),
+    }
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📊 Results saved to {RESULTS_FILE}")
@@ -0,0 +1,112 @@
+# benchmarks/event_query_benchmark.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import collections
+import json
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from components.event_logger import EventLog, parse_ts
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "event_query_results.json")
+SIZES = [100000, 500000]
+QUERIES_PER_CASE = 20
+SEGMENT_BYTES = 4 * 1024 * 1024
+ACTIONS = [("LOGIN_SUCCESS", 40), ("DOWNLOAD_SUCCESS", 40), ("UPLOAD_SUCCESS", 12), ("LOGIN_FAIL", 6),
+           ("DOWNLOAD_FLAGGED", 1), ("DOWNLOAD_DENIED_POLICY", 1)]
+USERS = [f"user{i}" for i in range(500)]
+LOCATIONS = ["chennai", "mumbai", "delhi", "unknown"]
+BASE = datetime(2024, 1, 1)
+SPACING = 20  # seconds between events
+
+
+def fill(log, n):
+    names, weights = zip(*ACTIONS)
+    for start in range(0, n, 5000):
+        count = min(5000, n - start)
+        log.append_many([{
+            "user": random.choice(USERS), "action": action,
+            "timestamp": (BASE + timedelta(seconds=(start + i) * SPACING)).isoformat() + "Z",
+            "details": {"file_id": f"file{random.randrange(2000)}", "location": random.choice(LOCATIONS)},
+        } for i, action in enumerate(random.choices(names, weights, k=count))])
+
+
+def naive_query(log, user, action, since, until, limit=50):
+    # what an investigation costs without the index: parse the whole log
+    rows = []
+    for event in log.iter_reverse():
+        ts = parse_ts(event["timestamp"])
+        if event["user"] == user and event["action"] == action and since <= ts < until:
+            rows.append(event)
+            if len(rows) >= limit:
+                break
+    return rows
+
+
+def naive_aggregate(log, action):
+    counts = collections.Counter()
+    for event in log.iter_reverse():
+        if event["action"] == action:
+            counts[(event["timestamp"][:13], event["details"].get("location"))] += 1
+    return counts
+
+
+def time_calls(fn, runs=QUERIES_PER_CASE):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return round((time.perf_counter() - start) / runs * 1000.0, 3)
+
+
+def run(sizes=SIZES):
+    results = []
+    for n in sizes:
+        workdir = tempfile.mkdtemp()
+        try:
+            log = EventLog(os.path.join(workdir, "log"), max_bytes=SEGMENT_BYTES, fsync="never", legacy_file=None)
+            fill(log, n)
+            # "all DOWNLOAD_FLAGGED for user X last week", the week ending at the newest event
+            until = parse_ts((BASE + timedelta(seconds=n * SPACING)).isoformat())
+            since = until - 7 * 86400
+            user = random.choice(USERS)
+            start = time.perf_counter()
+            log.query({"user": [user], "action": ["DOWNLOAD_FLAGGED"]}, since, until)
+            index_build_ms = round((time.perf_counter() - start) * 1000.0, 1)
+            latency = {
+                "flagged_user_week": time_calls(
+                    lambda: log.query({"user": [user], "action": ["DOWNLOAD_FLAGGED"]}, since, until)),
+                "naive_flagged_user_week": time_calls(
+                    lambda: naive_query(log, user, "DOWNLOAD_FLAGGED", since, until), runs=2),
+                "user_page": time_calls(lambda: log.query({"user": [user]}, limit=50)),
+                "failed_logins_hour_location": time_calls(
+                    lambda: log.aggregate(["hour", "details.location"], {"action": ["LOGIN_FAIL"]}), runs=3),
+                "naive_failed_logins_hour_location": time_calls(
+                    lambda: naive_aggregate(log, "LOGIN_FAIL"), runs=2),
+            }
+            segments = len(log.rotated_files()) + 1
+            log.close()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        results.append({"events": n, "segments": segments, "index_build_ms": index_build_ms, "latency_ms": latency})
+        print(f"events={n:7d} segments={segments} index_build={index_build_ms}ms " +
+              " ".join(f"{k}={v}ms" for k, v in latency.items()))
+    return results
+
+
+if __name__ == "__main__":
+    print("🚀 Running event query benchmark...")
+    sizes = [int(a) for a in sys.argv[1:]] or SIZES
+    results = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "queries_per_case": QUERIES_PER_CASE,
+        "results": run(sizes),
+    }
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📊 Results saved to {RESULTS_FILE}")
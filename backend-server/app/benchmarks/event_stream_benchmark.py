@@ -0,0 +1,74 @@
+# benchmarks/event_stream_benchmark.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import shutil
+import tempfile
+import time
+
+from components.event_hub import EventHub
+from components.event_logger import EventLog
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "event_stream_results.json")
+SUBSCRIBERS = [1, 10, 100]
+EVENTS_PER_CASE = 1000
+HISTORY = 10000
+
+
+def event(i):
+    return {"id": i, "user": f"user{i % 50}", "action": "DOWNLOAD_SUCCESS", "timestamp": "2024-01-01T00:00:00Z",
+            "details": {"file_id": f"file{i}"}, "is_anomaly": False}
+
+
+def push_cost(n):
+    # one publish per event, every subscriber draining as it goes
+    hub = EventHub(max_buffer=EVENTS_PER_CASE + 1, max_subscribers=n)
+    subs = [hub.subscribe() for _ in range(n)]
+    start = time.perf_counter()
+    for i in range(1, EVENTS_PER_CASE + 1):
+        hub.publish([event(i)])
+        for sub in subs:
+            sub.get(0)
+    return round((time.perf_counter() - start) / EVENTS_PER_CASE * 1000.0, 4)
+
+
+def poll_cost(log, n):
+    # every dashboard re-reading and re-serializing the recent page once per new event
+    start = time.perf_counter()
+    for i in range(EVENTS_PER_CASE // 10):
+        log.append("u", "DOWNLOAD_SUCCESS", {"i": i})
+        for _ in range(n):
+            json.dumps({"success": True, "events": log.recent(50)})
+    return round((time.perf_counter() - start) / (EVENTS_PER_CASE // 10) * 1000.0, 4)
+
+
+def run(subscribers=SUBSCRIBERS):
+    results = []
+    workdir = tempfile.mkdtemp()
+    try:
+        log = EventLog(os.path.join(workdir, "log"), fsync="never", legacy_file=None)
+        log.append_many([{"user": "u", "action": "LOGIN_SUCCESS"} for _ in range(HISTORY)])
+        for n in subscribers:
+            push_ms, poll_ms = push_cost(n), poll_cost(log, n)
+            results.append({"subscribers": n, "push_ms_per_event": push_ms, "poll_ms_per_event": poll_ms})
+            print(f"subscribers={n:4d} push={push_ms}ms/event poll={poll_ms}ms/event")
+        log.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    print("🚀 Running event stream benchmark...")
+    subscribers = [int(a) for a in sys.argv[1:]] or SUBSCRIBERS
+    results = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "events_per_case": EVENTS_PER_CASE,
+        "results": run(subscribers),
+    }
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📊 Results saved to {RESULTS_FILE}")
@@ -0,0 +1,94 @@
+# benchmarks/metadata_index_benchmark.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from components.metadata_store import JsonMetadataStore, SQLiteMetadataStore
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "metadata_index_results.json")
+SIZES = [1000, 10000, 100000]
+QUERIES_PER_CASE = 200
+UPLOADERS = [f"user{i}" for i in range(50)]
+POLICIES = ["role:prof", "role:student and dept:cs", "role:admin", "dept:math or dept:eng", "role:prof and dept:eng"]
+
+
+def make_records(n):
+    base = datetime(2024, 1, 1)
+    records = []
+    for i in range(n):
+        fid = str(uuid.uuid4())
+        records.append({
+            "id": fid,
+            "display_name": f"report_{i}",
+            "uploader": random.choice(UPLOADERS),
+            "orig_filename": f"report_{i}.pdf",
+            "abe_ct": "x" * 512,
+            "policy": random.choice(POLICIES),
+            "created": (base + timedelta(seconds=i * 37)).isoformat(),
+            "context_policy": {},
+        })
+    return records
+
+
+def time_queries(fn):
+    start = time.perf_counter()
+    for _ in range(QUERIES_PER_CASE):
+        fn()
+    return (time.perf_counter() - start) / QUERIES_PER_CASE * 1000.0
+
+
+def benchmark_store(store, records):
+    store.put_files(records)
+    middle = records[len(records) // 2]["created"]
+    cases = {
+        "by_uploader": lambda: store.query_files(uploader=random.choice(UPLOADERS), limit=50),
+        "by_attribute": lambda: store.query_files(attributes=["dept:cs"], limit=50),
+        "recent": lambda: store.query_files(limit=50),
+        "created_range": lambda: store.query_files(created_from=middle, limit=50),
+        # what every query cost before the indexes: materialize and filter all records
+        "full_scan_by_uploader": lambda: [r for r in store.list_files() if r["uploader"] == "user1"][:50],
+    }
+    return {name: round(time_queries(fn), 3) for name, fn in cases.items()}
+
+
+def run(sizes=SIZES):
+    results = []
+    for n in sizes:
+        records = make_records(n)
+        for name, factory in (("json", JsonMetadataStore), ("sqlite", lambda: SQLiteMetadataStore(import_from=None))):
+            workdir = tempfile.mkdtemp()
+            cwd = os.getcwd()
+            os.chdir(workdir)
+            try:
+                store = factory()
+                latency = benchmark_store(store, records)
+                if hasattr(store, "close"):
+                    store.close()
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(workdir, ignore_errors=True)
+            results.append({"backend": name, "records": n, "latency_ms": latency})
+            print(f"{name:6s} n={n:7d} " + " ".join(f"{k}={v}ms" for k, v in latency.items()))
+    return results
+
+
+if __name__ == "__main__":
+    print("🚀 Running metadata index benchmark...")
+    sizes = [int(a) for a in sys.argv[1:]] or SIZES
+    results = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "queries_per_case": QUERIES_PER_CASE,
+        "results": run(sizes),
+    }
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📊 Results saved to {RESULTS_FILE}")
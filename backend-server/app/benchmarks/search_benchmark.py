@@ -0,0 +1,110 @@
+# benchmarks/search_benchmark.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from components.file_component import FileComponent
+from components.metadata_store import SQLiteMetadataStore
+from components.search_index import SearchIndex
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "search_results.json")
+SIZES = [10000, 100000, 1000000]
+REBUILD_SIZES = [20000, 60000, 180000]
+QUERIES_PER_CASE = 200
+WORDS = ["report", "budget", "lecture", "notes", "exam", "thesis", "draft", "final", "grades", "syllabus",
+         "invoice", "review", "minutes", "proposal", "dataset", "slides", "paper", "summary", "plan", "memo"]
+POLICIES = ["role:prof", "role:student and dept:cs", "role:admin", "dept:math or dept:eng", "role:prof and dept:eng"]
+
+
+def make_records(n):
+    base = datetime(2024, 1, 1)
+    for i in range(n):
+        name = "_".join(random.sample(WORDS, 3)) + f"_{i}"
+        yield {
+            "id": f"f{i}",
+            "display_name": name,
+            "orig_filename": name + ".pdf",
+            "uploader": f"user{random.randrange(500)}",
+            "policy": random.choice(POLICIES),
+            "tags": random.sample(WORDS, 2),
+            "created": (base + timedelta(seconds=i * 13)).isoformat(),
+        }
+
+
+def time_queries(index, queries):
+    start = time.perf_counter()
+    for i in range(QUERIES_PER_CASE):
+        index.search(queries[i % len(queries)], limit=20)
+    return round((time.perf_counter() - start) / QUERIES_PER_CASE * 1000.0, 3)
+
+
+def time_rebuild(n):
+    """The server's full resync: every record paged out of a SQLite store, then one bulk build."""
+    workdir = tempfile.mkdtemp()
+    try:
+        store = SQLiteMetadataStore(os.path.join(workdir, "metadata.db"), import_from=None)
+        records = list(make_records(n))
+        for i in range(0, n, 5000):
+            store.put_files(records[i:i + 5000])
+        files = FileComponent(store)
+        fields = ("id", "display_name", "orig_filename", "uploader", "policy", "created", "tags")
+        start = time.perf_counter()
+        index = SearchIndex()
+        index.build(files.iter_files(fields))
+        rebuild_sec = time.perf_counter() - start
+        store.close()
+        assert len(index) == n
+        return round(rebuild_sec, 2)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run(sizes=SIZES):
+    results = []
+    for n in sizes:
+        index = SearchIndex()
+        start = time.perf_counter()
+        index.build(make_records(n))
+        build_sec = time.perf_counter() - start
+        cases = {
+            "single_term": ["report", "thesis", "memo"],
+            "prefix": ["rep", "the", "sylla"],
+            "two_terms": ["budget final", "exam notes", "lecture slides"],
+            "uploader_and_term": ["user42 report", "user7 draft"],
+            "selective_id": [f"{random.randrange(n)}" for _ in range(20)],
+        }
+        latency = {name: time_queries(index, qs) for name, qs in cases.items()}
+        results.append({"records": n, "build_sec": round(build_sec, 2), "latency_ms": latency})
+        print(f"n={n:8d} build={build_sec:.1f}s " + " ".join(f"{k}={v}ms" for k, v in latency.items()))
+    return results
+
+
+def run_rebuild(sizes=REBUILD_SIZES):
+    results = []
+    for n in sizes:
+        rebuild_sec = time_rebuild(n)
+        results.append({"records": n, "rebuild_from_store_sec": rebuild_sec})
+        print(f"n={n:8d} rebuild_from_store={rebuild_sec}s")
+    return results
+
+
+if __name__ == "__main__":
+    print("🚀 Running search index benchmark...")
+    sizes = [int(a) for a in sys.argv[1:]] or SIZES
+    results = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "queries_per_case": QUERIES_PER_CASE,
+        "results": run(sizes),
+        "rebuild": run_rebuild(),
+    }
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📊 Results saved to {RESULTS_FILE}")
@@ -0,0 +1,97 @@
+# benchmarks/security_counters_benchmark.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import collections
+import json
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from components.event_logger import EventLog, parse_ts, is_anomaly
+from components.security_counters import SecurityCounters
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "security_counters_results.json")
+SIZES = [10000, 100000]
+QUERIES_PER_CASE = 50
+ACTIONS = [("LOGIN_SUCCESS", 50), ("DOWNLOAD_SUCCESS", 40), ("LOGIN_FAIL", 8), ("DOWNLOAD_FLAGGED", 2)]
+USERS = [f"user{i}" for i in range(1000)]
+LOCATIONS = ["chennai", "mumbai", "delhi", "unknown"]
+SPACING = 0.5  # seconds between events; 100k events span ~14 hours
+
+
+def make_events(n, end):
+    names, weights = zip(*ACTIONS)
+    start = end - n * SPACING
+    for i, action in enumerate(random.choices(names, weights, k=n)):
+        yield {"user": random.choice(USERS), "action": action,
+               "timestamp": datetime.utcfromtimestamp(start + i * SPACING).isoformat() + "Z",
+               "details": {"ip": f"10.0.{random.randrange(50)}.{random.randrange(250)}",
+                           "location": random.choice(LOCATIONS)}}
+
+
+def naive_top(log, action, window, now, k=10):
+    # what the same answer costs from the log: read the window back and count
+    counts = collections.Counter()
+    for event in log.iter_reverse():
+        ts = parse_ts(event["timestamp"])
+        if ts < now - window:
+            break
+        if event["action"] == action:
+            counts[event["user"]] += 1
+    return counts.most_common(k)
+
+
+def time_calls(fn, runs=QUERIES_PER_CASE):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return round((time.perf_counter() - start) / runs * 1000.0, 4)
+
+
+def run(sizes=SIZES):
+    results = []
+    for n in sizes:
+        now = time.time()
+        events = list(make_events(n, now))
+        for event in events:
+            event["is_anomaly"] = is_anomaly(event)
+        counters = SecurityCounters()
+        start = time.perf_counter()
+        counters.record_many(events)
+        record_us = round((time.perf_counter() - start) / n * 1e6, 2)
+        workdir = tempfile.mkdtemp()
+        try:
+            log = EventLog(os.path.join(workdir, "log"), fsync="never", legacy_file=None)
+            log.append_many(events)
+            latency = {
+                "counts_one_user": time_calls(lambda: counters.counts("user", random.choice(USERS), now)),
+                "top_failed_logins_1h": time_calls(lambda: counters.top("user", "LOGIN_FAIL", 3600, 10, now)),
+                "top_anomalous_ips_24h": time_calls(lambda: counters.top("ip", "anomaly", 86400, 10, now)),
+                "naive_top_failed_logins_1h": time_calls(lambda: naive_top(log, "LOGIN_FAIL", 3600, now), runs=3),
+            }
+            log.close()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        results.append({"events": n, "record_us_per_event": record_us, "keys": counters.stats()["keys"],
+                        "latency_ms": latency})
+        print(f"events={n:7d} record={record_us}us/event keys={counters.stats()['keys']} " +
+              " ".join(f"{k}={v}ms" for k, v in latency.items()))
+    return results
+
+
+if __name__ == "__main__":
+    print("🚀 Running security counters benchmark...")
+    sizes = [int(a) for a in sys.argv[1:]] or SIZES
+    results = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "queries_per_case": QUERIES_PER_CASE,
+        "results": run(sizes),
+    }
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📊 Results saved to {RESULTS_FILE}")
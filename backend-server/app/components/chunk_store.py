@@ -0,0 +1,293 @@
+# backend/components/chunk_store.py
+"""
+Content-defined chunking with policy-scoped convergent encryption.
+
+Files are split on content-defined boundaries (gear rolling hash), so an edit
+in the middle of a file only changes the chunks around it. Every chunk is
+encrypted with a key derived from its own hash *and* the file's ABE policy:
+the same plaintext chunk uploaded under the same policy maps to the same
+stored object (stored once), while identical content under different policies
+produces unrelated keys and object names, so dedupe never links files across
+policies.
+
+A dedupe hit reuses an object the garbage collector may be deleting, so
+put_chunk() holds a ChunkLock shared from the lookup until the object is
+stored, and the collector re-checks and deletes a chunk holding it exclusively.
+"""
+
+import contextlib
+import hashlib
+import hmac
+import os
+import struct
+
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+KEYS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "keys"))
+DEDUP_SECRET_FILE = os.path.join(KEYS_DIR, "dedup_secret.bin")
+CHUNK_LOCK_FILE = os.path.join(KEYS_DIR, "chunks.lock")
+
+CHUNK_PREFIX = "chunks/"
+
+# Chunk size bounds (bytes). AVG must be a power of two.
+MIN_CHUNK = 16 * 1024
+AVG_CHUNK = 64 * 1024
+MAX_CHUNK = 256 * 1024
+READ_BLOCK = 4 * 1024 * 1024
+
+_MASK32 = 0xFFFFFFFF
+
+# Fixed gear table so chunk boundaries are stable across processes and restarts.
+GEAR = [
+    struct.unpack(">I", hashlib.sha256(b"gear%d" % i).digest()[:4])[0]
+    for i in range(256)
+]
+
+
+def _cut_mask(avg_size):
+    bits = avg_size.bit_length() - 1
+    # Use the high bits of the 32-bit hash: they depend on the last 32 bytes.
+    return ((1 << bits) - 1) << (32 - bits)
+
+
+def _gear_hashes_py(buf):
+    """Rolling gear hash at every position of buf (pure Python fallback)."""
+    out = [0] * len(buf)
+    h = 0
+    gear = GEAR
+    for i, b in enumerate(buf):
+        h = ((h << 1) + gear[b]) & _MASK32
+        out[i] = h
+    return out
+
+
+def _candidates(buf, mask):
+    """Positions i where the gear hash ending at buf[i] matches the cut mask."""
+    if np is not None:
+        g = np.array(GEAR, dtype=np.uint32)[np.frombuffer(buf, dtype=np.uint8)]
+        h = np.zeros(len(buf), dtype=np.uint32)
+        # The 32-bit gear hash only remembers the last 32 bytes, so it can be
+        # computed as a sum of 32 shifted copies instead of a sequential loop.
+        for k in range(min(32, len(buf))):
+            h[k:] += g[: len(buf) - k] << np.uint32(k)
+        return np.flatnonzero((h & np.uint32(mask)) == 0).tolist()
+    return [i for i, h in enumerate(_gear_hashes_py(buf)) if not (h & mask)]
+
+
+def _cut_points(buf, final, min_size, avg_size, max_size):
+    """Chunk end offsets within buf; the tail after the last cut is left over
+    unless final is set."""
+    cands = _candidates(buf, _cut_mask(avg_size))
+    cuts = []
+    start = 0
+    ci = 0
+    n = len(buf)
+    while n - start >= max_size or (final and start < n):
+        lo = start + min_size - 1
+        hi = min(start + max_size, n) - 1
+        while ci < len(cands) and cands[ci] < lo:
+            ci += 1
+        if ci < len(cands) and cands[ci] <= hi:
+            end = cands[ci] + 1
+        else:
+            end = hi + 1
+        cuts.append(end)
+        start = end
+    return cuts
+
+
+def iter_chunks(fileobj, min_size=MIN_CHUNK, avg_size=AVG_CHUNK, max_size=MAX_CHUNK,
+                read_block=READ_BLOCK):
+    """Yield content-defined chunks (bytes) from a binary file object."""
+    pending = b""
+    eof = False
+    while not eof:
+        block = fileobj.read(read_block)
+        eof = not block
+        buf = pending + block
+        if not buf:
+            break
+        start = 0
+        for end in _cut_points(buf, eof, min_size, avg_size, max_size):
+            yield buf[start:end]
+            start = end
+        pending = buf[start:]
+
+
+def merkle_root(leaf_digests):
+    """
+    Merkle root (hex) over raw SHA-256 digests of ordered parts.
+    leaf = H(0x00 || digest), node = H(0x01 || left || right); an odd node is
+    carried up unchanged.
+    """
+    level = [hashlib.sha256(b"\x00" + d).digest() for d in leaf_digests]
+    if not level:
+        return hashlib.sha256(b"").hexdigest()
+    while len(level) > 1:
+        nxt = [hashlib.sha256(b"\x01" + level[i] + level[i + 1]).digest()
+               for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            nxt.append(level[-1])
+        level = nxt
+    return level[0].hex()
+
+
+def _load_dedup_secret(path=DEDUP_SECRET_FILE):
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    secret = get_random_bytes(32)
+    with open(path, "wb") as f:
+        f.write(secret)
+    return secret
+
+
+class ChunkLock:
+    """Readers-writer flock shared by every worker process: uploads shared, the GC exclusive."""
+
+    def __init__(self, path=CHUNK_LOCK_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @contextlib.contextmanager
+    def _held(self, exclusive):
+        # a descriptor per holder, so threads of one process exclude each other too
+        with open(self.path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def shared(self):
+        return self._held(False)
+
+    def exclusive(self):
+        return self._held(True)
+
+
+class ChunkStore:
+    """
+    Stores files as deduplicated encrypted chunks.
+    storage: S3Component-like object (put_bytes/get_bytes).
+    index:   FileComponent (has_chunk/add_chunks) used as the chunk catalog.
+    """
+
+    def __init__(self, storage, index, secret_path=DEDUP_SECRET_FILE, lock=None):
+        self.storage = storage
+        self.index = index
+        self.lock = lock or ChunkLock()
+        self._secret = _load_dedup_secret(secret_path)
+
+    def _policy_scope(self, policy):
+        return hmac.new(self._secret, policy.strip().encode("utf-8"), hashlib.sha256).digest()
+
+    @staticmethod
+    def _derive(scope, label, digest):
+        return hmac.new(scope, label + digest, hashlib.sha256).digest()
+
+    @staticmethod
+    def object_key(chunk_id):
+        return CHUNK_PREFIX + chunk_id
+
+    @staticmethod
+    def encrypt_chunk(data, key):
+        # Each key encrypts exactly one plaintext, so a derived nonce is safe
+        # and keeps the stored object deterministic for dedupe.
+        nonce = hashlib.sha256(b"nonce" + key).digest()[:16]
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        ct, tag = cipher.encrypt_and_digest(data)
+        return nonce + tag + ct
+
+    @staticmethod
+    def decrypt_chunk(blob, key):
+        cipher = AES.new(key, AES.MODE_GCM, nonce=blob[:16])
+        return cipher.decrypt_and_verify(blob[32:], blob[16:32])
+
+    def chunk_entry(self, data, policy):
+        """Return (chunk_id, key) for a plaintext chunk under a policy."""
+        return self.chunk_entry_for_digest(hashlib.sha256(data).digest(), policy)
+
+    def chunk_entry_for_digest(self, digest, policy):
+        """Same as chunk_entry, from the chunk's SHA-256 digest."""
+        scope = self._policy_scope(policy)
+        chunk_id = self._derive(scope, b"id", digest).hex()
+        key = self._derive(scope, b"key", digest)
+        return chunk_id, key
+
+    def put_chunk(self, data, policy, seen=()):
+        """Encrypt and store one chunk unless it already exists (in the index
+        or in seen). Returns (manifest_entry, stored_bytes)."""
+        chunk_id, key = self.chunk_entry(data, policy)
+        stored = 0
+        if chunk_id not in seen:
+            # until the hit is recorded (has_chunk) or the object rewritten, the GC must not delete it
+            with self.lock.shared():
+                if not self.index.has_chunk(chunk_id):
+                    blob = self.encrypt_chunk(data, key)
+                    if not self.storage.put_bytes(self.object_key(chunk_id), blob):
+                        raise IOError(f"storage write failed for chunk {chunk_id}")
+                    stored = len(blob)
+        return [chunk_id, len(data), key.hex()], stored
+
+    def store_file(self, path, policy):
+        """
+        Chunk, encrypt and store a local file.
+        Returns (manifest, stats). The manifest holds the chunk keys and must
+        itself be kept encrypted (see CryptoComponent.encrypt_manifest_hybrid).
+        """
+        entries = []
+        new_ids = {}
+        file_hash = hashlib.sha256()
+        stats = {"size": 0, "chunks": 0, "new_chunks": 0, "stored_bytes": 0}
+        with open(path, "rb") as f:
+            for data in iter_chunks(f):
+                file_hash.update(data)
+                entry, stored = self.put_chunk(data, policy, new_ids)
+                entries.append(entry)
+                stats["size"] += len(data)
+                stats["chunks"] += 1
+                if stored:
+                    new_ids[entry[0]] = stored
+                    stats["new_chunks"] += 1
+                    stats["stored_bytes"] += stored
+        manifest = {
+            "version": 1,
+            "size": stats["size"],
+            "sha256": file_hash.hexdigest(),
+            "chunks": entries,
+        }
+        self.index.add_chunks([e[0] for e in entries], new_ids)
+        return manifest, stats
+
+    def restore_file(self, manifest, out_path):
+        """Fetch, decrypt and reassemble the chunks listed in a manifest."""
+        file_hash = hashlib.sha256()
+        leaves = []
+        with open(out_path, "wb") as out:
+            for chunk_id, size, key_hex in manifest["chunks"]:
+                blob = self.storage.get_bytes(self.object_key(chunk_id))
+                if blob is None:
+                    raise IOError(f"missing chunk {chunk_id}")
+                data = self.decrypt_chunk(blob, bytes.fromhex(key_hex))
+                file_hash.update(data)
+                leaves.append(hashlib.sha256(data).digest())
+                out.write(data)
+        # Whole-file hash for server-chunked uploads, Merkle root for resumable ones
+        if "sha256" in manifest:
+            ok = file_hash.hexdigest() == manifest["sha256"]
+        else:
+            ok = merkle_root(leaves) == manifest["merkle_root"]
+        if not ok:
+            raise ValueError("reassembled file does not match manifest hash")
+        return out_path
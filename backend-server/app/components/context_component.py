@@ -1,18 +1,253 @@
 # backend/components/context_component.py
+import threading
 import time
 
+from .context_policy import compile_rule, policy_digest
+
+
+# batches smaller than 1/BATCH_MIN_RATIO of the distinct rules are checked file by file
+BATCH_MIN_RATIO = 4
+DENIED_CACHE_SIZE = 1024
+
+
+class CompiledContextPolicy:
+    """
+    A context policy compiled once: location / device whitelists as frozensets
+    and the time window as a numeric interval, so each rule is one O(1) check,
+    then the declarative "rule" (see context_policy) as one predicate.
+    key / refs: the interned form's _policy_key and how many files share it.
+    """
+    __slots__ = ("locations", "devices", "window", "rule", "key", "refs")
+
+    def __init__(self, policy):
+        self.key = None
+        self.refs = 0
+        self.locations = _value_set(policy["allowed_locations"]) if "allowed_locations" in policy else None
+        self.devices = _value_set(policy["allowed_devices"]) if "allowed_devices" in policy else None
+        self.window = None
+        tw = policy.get("time_window")
+        if isinstance(tw, (list, tuple)) and len(tw) == 2:
+            try:
+                self.window = (float(tw[0]), float(tw[1]))
+            except (TypeError, ValueError):
+                self.window = (float("inf"), float("-inf"))  # unreadable window: nothing is inside it
+        self.rule = None
+        if "rule" in policy:
+            try:
+                self.rule = compile_rule(policy["rule"])
+            except ValueError as e:
+                print(f"Invalid context policy rule, denying all access: {e}")
+                self.rule = _deny
+
+    def allows(self, context):
+        if self.locations is not None and context.get("location") not in self.locations:
+            return False
+        if self.devices is not None and context.get("device_id") not in self.devices:
+            return False
+        if self.window is not None or self.rule is not None:
+            t = context.get("time", time.time())
+            if self.window is not None and not (self.window[0] <= t <= self.window[1]):
+                return False
+            if self.rule is not None and not self.rule(context, t):
+                return False
+        return True
+
+
+def _deny(context, now):
+    return False
+
+
+def _policy_key(policy):
+    """Hashable form of a policy's rules, to share one compiled form between identical policies."""
+    if "rule" in policy:
+        return policy_digest(policy)
+    def values(name):
+        if name not in policy:
+            return None
+        v = policy[name]
+        return (v,) if isinstance(v, str) else tuple(v or ())
+    tw = policy.get("time_window")
+    return (values("allowed_locations"), values("allowed_devices"),
+            tuple(tw) if isinstance(tw, (list, tuple)) and len(tw) == 2 else None)
+
+
+def _value_set(values):
+    if isinstance(values, str):
+        return frozenset([values])
+    try:
+        return frozenset(values or ())
+    except TypeError:
+        return frozenset(v for v in values if not isinstance(v, (list, dict, set)))
+
+
+class _WhitelistIndex:
+    """Files per distinct whitelist (frozenset), and the whitelists allowing each value."""
+
+    def __init__(self):
+        self.files = {}
+        self.allowing = {}
+
+    def add(self, values, fid):
+        files = self.files.get(values)
+        if files is None:
+            files = self.files[values] = set()
+            for v in values:
+                self.allowing.setdefault(v, set()).add(values)
+        files.add(fid)
+
+    def discard(self, values, fid):
+        files = self.files.get(values)
+        if files is None:
+            return
+        files.discard(fid)
+        if not files:
+            del self.files[values]
+            for v in values:
+                allowing = self.allowing[v]
+                allowing.discard(values)
+                if not allowing:
+                    del self.allowing[v]
+
+    def denying(self, value):
+        """File sets of every whitelist that doesn't contain value."""
+        try:
+            allowed = self.allowing.get(value, ())
+        except TypeError:
+            allowed = ()
+        return [self.files[values] for values in self.files.keys() - allowed]
+
+
+class _PolicyIndex:
+    """
+    Inverted indexes over a set of compiled policies: whitelists per location /
+    device, files per time window and per compiled rule, and a cache of the
+    whitelist files denying a (location, device) pair.
+    """
+
+    def __init__(self):
+        self.locations = _WhitelistIndex()
+        self.devices = _WhitelistIndex()
+        self.windows = {}  # (start, end) -> file ids
+        self.rules = {}  # compiled rule -> file ids
+        self.denied = {}  # (location, device_id) -> file sets whose whitelists deny it
+
+    def size(self):
+        return len(self.locations.files) + len(self.devices.files) + len(self.windows) + len(self.rules)
+
+    def whitelists_denying(self, location, device):
+        key = (location, device)
+        try:
+            denied = self.denied.get(key)
+        except TypeError:
+            key, denied = None, None
+        if denied is None:
+            denied = self.locations.denying(location) + self.devices.denying(device)
+            if key is not None:
+                if len(self.denied) >= DENIED_CACHE_SIZE:
+                    self.denied.clear()
+                self.denied[key] = denied
+        return denied
+
+    def add(self, fid, pol):
+        self.denied.clear()
+        if pol.locations is not None:
+            self.locations.add(pol.locations, fid)
+        if pol.devices is not None:
+            self.devices.add(pol.devices, fid)
+        if pol.window is not None:
+            self.windows.setdefault(pol.window, set()).add(fid)
+        if pol.rule is not None:
+            self.rules.setdefault(pol.rule, set()).add(fid)
+
+    def discard(self, fid, pol):
+        self.denied.clear()
+        if pol.locations is not None:
+            self.locations.discard(pol.locations, fid)
+        if pol.devices is not None:
+            self.devices.discard(pol.devices, fid)
+        for table, key in ((self.windows, pol.window), (self.rules, pol.rule)):
+            if key is None:
+                continue
+            files = table.get(key)
+            if files is not None:
+                files.discard(fid)
+                if not files:
+                    del table[key]
+
+
 class ContextComponent:
     """
     Very lightweight context-aware engine.
     You can expand rules to include time windows, geo-IP, device fingerprint, etc.
+
+    Policies are compiled when added; identical policies share one compiled
+    form, so a catalog where many files carry the same rules stays small.
+    Inverted indexes from each location / device to the whitelists allowing
+    it (and files per time window and per compiled rule) let
+    check_access_many() evaluate a whole set of files against one context
+    with set operations.
+
+    Updates and batch checks hold one lock, so a batch never sees an index
+    half way through a change; load() builds its state aside and swaps it in.
     """
     def __init__(self):
-        # sample context policies store (in real system use policy language)
+        # file_id -> CompiledContextPolicy
         self.policies = {}
+        self._interned = {}  # _policy_key -> CompiledContextPolicy in use, rebuilt by load()
+        self._indexes = _PolicyIndex()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _compile(policy, interned):
+        try:
+            key = _policy_key(policy)
+            compiled = interned.get(key)
+        except TypeError:
+            return CompiledContextPolicy(policy)  # unhashable rule values: compile unshared
+        if compiled is None:
+            compiled = interned[key] = CompiledContextPolicy(policy)
+            compiled.key = key
+        compiled.refs += 1
+        return compiled
+
+    def _release(self, pol):
+        """Drop one file's use of pol, evicting it from _interned with the last."""
+        if pol.key is None:
+            return
+        pol.refs -= 1
+        if not pol.refs and self._interned.get(pol.key) is pol:
+            del self._interned[pol.key]
 
     def add_policy(self, file_id, policy):
         # policy: dict with possible keys like allowed_locations, allowed_times, allowed_devices
-        self.policies[file_id] = policy
+        with self._lock:
+            old = self.policies.pop(file_id, None)
+            if old is not None:
+                self._indexes.discard(file_id, old)
+            if policy:
+                pol = self.policies[file_id] = self._compile(policy, self._interned)
+                self._indexes.add(file_id, pol)
+            if old is not None:
+                # released after compiling, so re-adding the same rules reuses the interned form
+                self._release(old)
+
+    def remove_policy(self, file_id):
+        with self._lock:
+            pol = self.policies.pop(file_id, None)
+            if pol is not None:
+                self._indexes.discard(file_id, pol)
+                self._release(pol)
+
+    def load(self, policies):
+        """Replace every policy with {file_id: policy} (e.g. the metadata store's, at startup)."""
+        interned, indexes, compiled = {}, _PolicyIndex(), {}
+        for fid, policy in policies.items():
+            if policy:
+                pol = compiled[fid] = self._compile(policy, interned)
+                indexes.add(fid, pol)
+        with self._lock:
+            self.policies, self._interned, self._indexes = compiled, interned, indexes
+        return len(compiled)
 
     def check_access(self, file_id, context):
         """
@@ -23,24 +258,47 @@ class ContextComponent:
         - if time_range -> check
         """
         pol = self.policies.get(file_id)
-        if not pol:
+        if pol is None:
             return True
+        try:
+            return pol.allows(context)
+        except TypeError:
+            return False  # unhashable location / device or non-numeric time can't match
 
-        # location
-        if "allowed_locations" in pol:
-            if context.get("location") not in pol["allowed_locations"]:
-                return False
-
-        # time restrict (start, end) epoch
-        if "time_window" in pol and isinstance(pol["time_window"], (list, tuple)) and len(pol["time_window"]) == 2:
-            start, end = pol["time_window"]
-            t = context.get("time", time.time())
-            if not (start <= t <= end):
-                return False
-
-        # device whitelist
-        if "allowed_devices" in pol:
-            if context.get("device_id") not in pol["allowed_devices"]:
-                return False
+    def check_access_many(self, file_ids, context):
+        """
+        The subset of file_ids whose context policies allow context (same rules
+        as check_access). The whitelists and time windows the context fails are
+        found once through the indexes, then their files are removed from the
+        request with set operations instead of checking file by file.
+        """
+        ids = set(file_ids)
+        with self._lock:
+            indexes = self._indexes
+            if len(ids) * BATCH_MIN_RATIO < indexes.size():
+                # a handful of files against many distinct rules: direct checks are cheaper
+                return {fid for fid in ids if self.check_access(fid, context)}
+            return self._allowed(ids, context, indexes)
 
-        return True
+    @staticmethod
+    def _allowed(ids, context, indexes):
+        t = context.get("time", time.time())
+        denied = list(indexes.whitelists_denying(context.get("location"), context.get("device_id")))
+        for (start, end), files in indexes.windows.items():
+            try:
+                inside = start <= t <= end
+            except TypeError:
+                inside = False
+            if not inside:
+                denied.append(files)
+        # a rule's outcome depends only on the context: once per distinct rule
+        for rule, files in indexes.rules.items():
+            try:
+                passed = rule(context, t)
+            except TypeError:
+                passed = False
+            if not passed:
+                denied.append(files)
+        for files in denied:
+            ids -= files if len(files) < len(ids) else ids & files
+        return ids
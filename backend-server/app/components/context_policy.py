@@ -0,0 +1,224 @@
+# backend/components/context_policy.py
+"""
+Declarative context-policy rules, compiled once into predicates.
+
+A context policy may carry a "rule" next to the classic allowed_locations /
+allowed_devices / time_window keys. A rule is a JSON expression:
+
+    {"all": [expr, ...]}   every sub-rule holds
+    {"any": [expr, ...]}   at least one holds
+    {"not": expr}
+    {"in": {"field": "department", "values": ["cs", "ee"]}}
+    {"cidr": {"field": "ip", "networks": ["10.0.0.0/8", "2001:db8::/32"]}}
+    {"between": {"from": 1700000000, "to": 1710000000}}            epoch seconds, inclusive
+    {"time_of_day": {"from": "09:00", "to": "17:30", "utc_offset": 330}}
+    {"schedule": {"days": ["mon", "tue", "wed", "thu", "fri"],
+                  "from": "09:00", "to": "18:00", "utc_offset": 330}}
+
+Context fields are whatever the request context carries (location,
+device_id, department, ip, ...); "time" (epoch seconds, default now) drives
+the time predicates. A time_of_day / schedule window whose "from" is after
+its "to" wraps past midnight; a schedule's day is the local day of the
+instant checked.
+
+compile_rule() validates the expression (ValueError on a bad one), flattens
+nested all / any, and orders every all / any so the cheapest predicates run
+first and evaluation stops at the first decisive one.
+"""
+
+import bisect
+import hashlib
+import ipaddress
+import json
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+MAX_RULE_NODES = 256
+# relative evaluation cost per predicate, used to order all / any
+COST_SET, COST_INTERVAL, COST_CLOCK, COST_SCHEDULE, COST_CIDR = 1, 1, 2, 3, 5
+
+
+def policy_digest(policy):
+    """Stable hash of a context policy (canonical JSON), the compiled-form cache key."""
+    return hashlib.sha256(json.dumps(policy, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def _clock(value):
+    """Seconds since midnight of an "HH:MM" / "HH:MM:SS" string."""
+    try:
+        parts = [int(p) for p in str(value).split(":")]
+    except ValueError:
+        parts = []
+    if not 2 <= len(parts) <= 3 or not 0 <= parts[0] <= 24 or not all(0 <= p < 60 for p in parts[1:]):
+        raise ValueError(f"invalid time of day {value!r} (expected HH:MM)")
+    seconds = parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) == 3 else 0)
+    if seconds > 86400:
+        raise ValueError(f"invalid time of day {value!r}")
+    return seconds
+
+
+def _offset(args):
+    try:
+        return int(args.get("utc_offset", 0)) * 60
+    except (TypeError, ValueError):
+        raise ValueError("utc_offset must be minutes")
+
+
+def _clock_window(args):
+    """(start, end) seconds of day; None when the rule has no from / to (whole day)."""
+    if "from" not in args and "to" not in args:
+        return None
+    return _clock(args.get("from", "00:00")), _clock(args.get("to", "24:00"))
+
+
+def _within(second, window):
+    start, end = window
+    return start <= second < end if start <= end else second >= start or second < end
+
+
+def _args(node, op, kind=dict):
+    args = node[op]
+    if not isinstance(args, kind):
+        raise ValueError(f"'{op}' takes a {'JSON object' if kind is dict else 'list'}")
+    return args
+
+
+def _field(args, op, default=None):
+    field = args.get("field", default)
+    if not isinstance(field, str) or not field:
+        raise ValueError(f"'{op}' needs a context field name")
+    return field
+
+
+def _compile(node, budget):
+    """(cost, predicate(context, now)) for one rule node."""
+    budget[0] -= 1
+    if budget[0] < 0:
+        raise ValueError(f"rule has more than {MAX_RULE_NODES} nodes")
+    if not isinstance(node, dict) or len(node) != 1:
+        raise ValueError(f"each rule must be an object with exactly one operator, got {node!r}")
+    op = next(iter(node))
+
+    if op in ("all", "any"):
+        children = []
+        for child in _args(node, op, list):
+            cost, pred = _compile(child, budget)
+            # flatten all(all(a, b), c) -> all(a, b, c)
+            children.extend(getattr(pred, "flat", [(cost, pred)]) if getattr(pred, "op", None) == op else [(cost, pred)])
+        if not children:
+            raise ValueError(f"'{op}' needs at least one rule")
+        if len(children) == 1:
+            return children[0]
+        children.sort(key=lambda c: c[0])
+        preds = tuple(p for _, p in children)
+        if op == "all":
+            def pred(ctx, now):
+                for p in preds:
+                    if not p(ctx, now):
+                        return False
+                return True
+        else:
+            def pred(ctx, now):
+                for p in preds:
+                    if p(ctx, now):
+                        return True
+                return False
+        pred.op, pred.flat = op, children
+        return sum(c for c, _ in children), pred
+
+    if op == "not":
+        cost, inner = _compile(node[op], budget)
+        return cost, lambda ctx, now: not inner(ctx, now)
+
+    if op == "in":
+        args = _args(node, op)
+        field = _field(args, op)
+        values = args.get("values")
+        if isinstance(values, str) or not isinstance(values, list):
+            raise ValueError("'in' needs a list of values")
+        try:
+            allowed = frozenset(values)
+        except TypeError:
+            raise ValueError("'in' values must be strings or numbers")
+        return COST_SET, lambda ctx, now: ctx.get(field) in allowed
+
+    if op == "cidr":
+        args = _args(node, op)
+        field = _field(args, op, "ip")
+        networks = args.get("networks")
+        if isinstance(networks, str):
+            networks = [networks]
+        if not isinstance(networks, list) or not networks:
+            raise ValueError("'cidr' needs a list of networks")
+        try:
+            nets = [ipaddress.ip_network(n, strict=False) for n in networks]
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"invalid network in 'cidr': {e}")
+        # merged [first, last] address ranges per IP version, searched with bisect
+        ranges = {}
+        for version in (4, 6):
+            merged = ipaddress.collapse_addresses(n for n in nets if n.version == version)
+            spans = [(int(n.network_address), int(n.broadcast_address)) for n in merged]
+            ranges[version] = ([s for s, _ in spans], [e for _, e in spans])
+
+        def pred(ctx, now):
+            try:
+                addr = ipaddress.ip_address(ctx.get(field))
+            except ValueError:
+                return False
+            starts, ends = ranges[addr.version]
+            value = int(addr)
+            i = bisect.bisect_right(starts, value) - 1
+            return i >= 0 and value <= ends[i]
+        return COST_CIDR, pred
+
+    if op == "between":
+        args = _args(node, op)
+        try:
+            start, end = float(args["from"]), float(args["to"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("'between' needs numeric from and to (epoch seconds)")
+        return COST_INTERVAL, lambda ctx, now: start <= now <= end
+
+    if op == "time_of_day":
+        args = _args(node, op)
+        window, offset = _clock_window(args), _offset(args)
+        if window is None:
+            raise ValueError("'time_of_day' needs from and/or to")
+        return COST_CLOCK, lambda ctx, now: _within((now + offset) % 86400, window)
+
+    if op == "schedule":
+        args = _args(node, op)
+        window, offset = _clock_window(args), _offset(args)
+        names = args.get("days", list(DAYS))
+        if isinstance(names, str) or not isinstance(names, list):
+            raise ValueError("'schedule' days must be a list like [\"mon\", \"fri\"]")
+        try:
+            days = frozenset(DAYS.index(str(d).lower()[:3]) for d in names)
+        except ValueError:
+            raise ValueError(f"invalid day in {names!r} (use mon..sun)")
+
+        def pred(ctx, now):
+            local = now + offset
+            # 1970-01-01 was a Thursday (index 3)
+            if (int(local // 86400) + 3) % 7 not in days:
+                return False
+            return window is None or _within(local % 86400, window)
+        return COST_SCHEDULE, pred
+
+    raise ValueError(f"unknown rule operator {op!r}")
+
+
+def compile_rule(rule):
+    """
+    Compile a rule expression into predicate(context, now) -> bool, where now
+    is the context's epoch time. Raises ValueError for an invalid rule.
+    """
+    return _compile(rule, [MAX_RULE_NODES])[1]
+
+
+def validate_policy(policy):
+    """Raise ValueError unless policy is a context policy whose rule (if any) compiles."""
+    if not isinstance(policy, dict):
+        raise ValueError("context policy must be a JSON object")
+    if "rule" in policy:
+        compile_rule(policy["rule"])
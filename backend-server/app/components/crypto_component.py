@@ -4,6 +4,9 @@ from typing import Any, Dict
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 import json
+import re
+
+from .policy_compiler import normalize_attributes, normalize_policy
 
 try:
     from charm.toolbox.pairinggroup import PairingGroup, GT
@@ -34,6 +37,17 @@ def _aes_decrypt_file(input_path: str, output_path: str, key: bytes):
     with open(output_path, "wb") as f:
         f.write(plaintext)
 
+def _aes_encrypt_bytes(data: bytes, key: bytes) -> bytes:
+    """Encrypt bytes with AES-GCM (same nonce|tag|ciphertext layout as files)."""
+    cipher = AES.new(key, AES.MODE_GCM)
+    ciphertext, tag = cipher.encrypt_and_digest(data)
+    return cipher.nonce + tag + ciphertext
+
+def _aes_decrypt_bytes(blob: bytes, key: bytes) -> bytes:
+    """Decrypt bytes produced by _aes_encrypt_bytes."""
+    cipher = AES.new(key, AES.MODE_GCM, nonce=blob[:16])
+    return cipher.decrypt_and_verify(blob[32:], blob[16:32])
+
 # -------------------- Crypto Component --------------------
 class CryptoComponent:
     """Wrapper for Charm CP-ABE (Waters11) with hybrid AES file encryption."""
@@ -72,41 +86,13 @@ class CryptoComponent:
     # ---------- WATERS11-COMPATIBLE NORMALIZATION ----------
     def _normalize_attributes(self, attributes: list[str]) -> list[str]:
         """Normalize attributes to numeric format for Waters11."""
-        attr_map = {
-            'role:prof': '1', 'role:student': '2', 'role:admin': '3',
-            'dept:cs': '10', 'dept:math': '11', 'dept:eng': '12'
-        }
-        
-        normalized = []
-        for attr in attributes:
-            if attr in attr_map:
-                normalized.append(attr_map[attr])
-            else:
-                # Hash unknown attributes to numbers
-                normalized.append(str(abs(hash(attr)) % 50 + 1))
-        
+        normalized = normalize_attributes(attributes)
         print(f"Normalized attributes: {normalized}")
         return normalized
 
     def _normalize_policy(self, policy: str) -> str:
         """Convert policy to Waters11-compatible format."""
-        if not policy or not policy.strip():
-            raise ValueError("Policy cannot be empty")
-        
-        # Map policy terms to numeric format
-        attr_map = {
-            'role:prof': '1', 'ROLE_PROF': '1', 'prof': '1',
-            'role:student': '2', 'ROLE_STUDENT': '2', 'student': '2', 
-            'role:admin': '3', 'ROLE_ADMIN': '3', 'admin': '3',
-            'dept:cs': '10', 'DEPT_CS': '10', 'cs': '10',
-            'dept:math': '11', 'DEPT_MATH': '11', 'math': '11',
-            'dept:eng': '12', 'DEPT_ENG': '12', 'eng': '12'
-        }
-        
-        normalized = policy.strip()
-        for key, value in attr_map.items():
-            normalized = normalized.replace(key, value)
-        
+        normalized = normalize_policy(policy)
         print(f"Normalized policy: {normalized}")
         return normalized
 
@@ -162,6 +148,20 @@ class CryptoComponent:
             print(f"Waters11 key generation failed: {e}")
             raise
 
+    def generate_policy_secret(self, policy: str) -> str:
+        """
+        Service key holding every attribute named in a policy, so it satisfies that
+        policy. Used by server-side maintenance (ciphertext format migration) that
+        must re-encode objects without a user's key.
+        """
+        pk, msk = self._get_pk_msk()
+        normalized = self._normalize_policy(policy)
+        attrs = sorted({t for t in re.findall(r"[A-Za-z0-9_:]+", normalized) if t.lower() not in ("and", "or")})
+        sk = self.cpabe.keygen(pk, msk, attrs)
+        if sk is None:
+            raise ValueError("Failed to generate policy secret key")
+        return self._b64_obj(sk)
+
     # ✅ FIXED: Serialize only group elements, handle policy separately
     def _serialize_ciphertext(self, ct: dict) -> dict:
         """Serialize each GROUP ELEMENT in the ciphertext dict to base64 string."""
@@ -277,10 +277,13 @@ class CryptoComponent:
             "policy": policy,
         }
 
+    def unwrap_file_key(self, meta: Dict[str, Any], user_sk_b64: str) -> bytes:
+        """Recover the AES content key of a single-object file with the user's ABE SK."""
+        return bytes.fromhex(self.abe_decrypt_str(meta["abe_ct"], user_sk_b64))
+
     def decrypt_file_hybrid(self, meta: Dict[str, Any], user_sk_b64: str, out_plain_path: str = None) -> str:
         """Decrypt file using Waters11 ABE SK to recover AES key, then AES-decrypt file."""
-        aes_key_hex = self.abe_decrypt_str(meta["abe_ct"], user_sk_b64)
-        aes_key = bytes.fromhex(aes_key_hex)
+        aes_key = self.unwrap_file_key(meta, user_sk_b64)
 
         if not out_plain_path:
             out_plain_path = os.path.join(
@@ -290,6 +293,32 @@ class CryptoComponent:
         _aes_decrypt_file(meta["enc_file_path"], out_plain_path, aes_key)
         return out_plain_path
 
+    # ---------------- Deduplicated (chunked) Files ----------------
+    def encrypt_manifest_hybrid(self, manifest: Dict[str, Any], orig_filename: str, policy: str) -> Dict[str, Any]:
+        """Encrypt a chunk manifest (which holds the chunk keys) with a fresh AES key
+        and protect that key with Waters11 CP-ABE, like encrypt_file_hybrid."""
+        aes_key = get_random_bytes(32)
+        manifest_ct = _aes_encrypt_bytes(json.dumps(manifest).encode("utf-8"), aes_key)
+        abe_ct_json = self.abe_encrypt_str(policy, aes_key.hex())
+
+        return {
+            "format": "cdc",
+            "orig_filename": os.path.basename(orig_filename),
+            "enc_file_path": None,
+            "abe_ct": abe_ct_json,
+            "policy": policy,
+            "manifest_ct": base64.b64encode(manifest_ct).decode("utf-8"),
+            # chunk ids are policy-scoped HMACs, safe to keep in clear for GC/refcounts
+            "chunks": [entry[0] for entry in manifest["chunks"]],
+            "size": manifest["size"],
+        }
+
+    def decrypt_manifest_hybrid(self, meta: Dict[str, Any], user_sk_b64: str) -> Dict[str, Any]:
+        """Recover the chunk manifest of a deduplicated file with the user's ABE SK."""
+        aes_key = bytes.fromhex(self.abe_decrypt_str(meta["abe_ct"], user_sk_b64))
+        manifest_ct = base64.b64decode(meta["manifest_ct"].encode("utf-8"))
+        return json.loads(_aes_decrypt_bytes(manifest_ct, aes_key).decode("utf-8"))
+
 if __name__ == "__main__":
     cc = CryptoComponent()
     cc.setup(force=True)
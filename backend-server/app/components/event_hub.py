@@ -0,0 +1,108 @@
+# backend/components/event_hub.py
+"""
+In-process fan-out of newly written security events to live subscribers
+(the /api/events/stream SSE endpoint).
+
+Each batch of events read from the log tail (event_logger.follow_events)
+is published once; it is encoded to SSE frames once and appended to every
+subscriber's bounded buffer, so an event costs O(subscribers) and no
+further file reads. A subscriber whose buffer would exceed
+EVENT_STREAM_BUFFER frames is dropped (its stream ends with a "dropped" event
+and the browser reconnects, resuming from Last-Event-ID) rather than holding
+memory for a client that isn't reading.
+
+Each worker follows the shared log, so a stream carries every worker's events
+whichever worker it is connected to; resumes are served from the same ring.
+"""
+
+import collections
+import json
+import os
+import threading
+
+EVENT_STREAM_BUFFER = int(os.environ.get("EVENT_STREAM_BUFFER", "1000"))
+EVENT_STREAM_MAX_SUBSCRIBERS = int(os.environ.get("EVENT_STREAM_MAX_SUBSCRIBERS", "200"))
+
+
+def sse_frame(event, name=None):
+    """One server-sent event carrying a JSON event (its id becomes the SSE id)."""
+    head = f"event: {name}\n" if name else ""
+    if isinstance(event, dict) and "id" in event:
+        head += f"id: {event['id']}\n"
+    return f"{head}data: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+
+class Subscriber:
+    def __init__(self, max_buffer):
+        self.max_buffer = max_buffer
+        self.frames = collections.deque()
+        self.dropped = False
+        self._cond = threading.Condition()
+
+    def _push(self, frames):
+        """Buffer frames; False if that would overflow (the subscriber is then dropped)."""
+        with self._cond:
+            if self.dropped:
+                return False
+            if len(self.frames) + len(frames) > self.max_buffer:
+                self.dropped = True
+                self.frames.clear()
+                self._cond.notify()
+                return False
+            self.frames.extend(frames)
+            self._cond.notify()
+            return True
+
+    def get(self, timeout):
+        """Buffered [(id, frame)] (waiting up to timeout; [] if none came), or None once dropped."""
+        with self._cond:
+            if not self.frames and not self.dropped:
+                self._cond.wait(timeout)
+            if self.dropped:
+                return None
+            frames = list(self.frames)
+            self.frames.clear()
+            return frames
+
+
+class EventHub:
+    def __init__(self, max_buffer=EVENT_STREAM_BUFFER, max_subscribers=EVENT_STREAM_MAX_SUBSCRIBERS):
+        self.max_buffer = max_buffer
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self.counters = {"published": 0, "subscribed": 0, "dropped": 0}
+
+    def subscribe(self):
+        """A new Subscriber, or None when max_subscribers are already connected."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            sub = Subscriber(self.max_buffer)
+            self._subscribers.add(sub)
+            self.counters["subscribed"] += 1
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def publish(self, events):
+        """Fan a batch of written events out to every subscriber."""
+        if not events:
+            return
+        frames = [(event["id"], sse_frame(event)) for event in events]
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.counters["published"] += len(events)
+        slow = [sub for sub in subscribers if not sub._push(frames)]
+        if slow:
+            with self._lock:
+                for sub in slow:
+                    if sub in self._subscribers:
+                        self._subscribers.discard(sub)
+                        self.counters["dropped"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "subscribers": len(self._subscribers), "buffer": self.max_buffer}
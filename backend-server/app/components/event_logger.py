@@ -1,35 +1,914 @@
+# backend/components/event_logger.py
+"""
+Append-only security event log (JSON lines).
+
+Each event is one line appended to <EVENT_LOG_DIR>/events.jsonl, so logging
+costs O(event) however long the history is. The active file is rotated to
+events-<first id>.jsonl once it grows past EVENT_LOG_MAX_BYTES or its first
+event is older than EVENT_LOG_MAX_AGE seconds; the newest EVENT_LOG_KEEP
+rotated files are kept (0 keeps all).
+
+Events are tagged is_anomaly when written (ANOMALY_ACTIONS), so readers
+never re-derive it.
+
+Event ids are a monotonic sequence recovered from the last line on startup.
+Appends hold an exclusive flock on events.lock, and a process that finds the
+active file grown or rotated under it re-reads the last id first, so prefork
+workers sharing the log never hand out the same id.
+
+EVENT_LOG_FSYNC: "always" (fsync every append), "interval" (at most every
+EVENT_LOG_FSYNC_INTERVAL seconds) or "never" (leave it to the OS).
+
+log_event() doesn't write itself: it timestamps the event and hands it to an
+EventWriter thread through a bounded queue, which appends batches of up to
+EVENT_BATCH_MAX events (or whatever arrived within EVENT_FLUSH_INTERVAL).
+When the queue is full, EVENT_QUEUE_POLICY decides: "block" (wait up to
+EVENT_QUEUE_BLOCK_TIMEOUT, then drop the new event), "drop_new" or
+"drop_oldest". The queue is drained on shutdown.
+
+Reads never parse the whole log. The newest EVENT_RING_SIZE events live in a
+ring buffer, seeded at startup from the log tail and kept current by reading
+whatever the active file grew by (any process's writes, followed across
+rotation). follow_events() listeners get each event as it is followed, so a
+process sees every worker's writes, in id order (the live stream's hub and
+the security counters are fed this way). Pages older than the ring are found
+through a sparse offset index (id -> byte offset every INDEX_STRIDE events,
+per file; kept next to rotated files as events-<first id>.idx) and read
+backwards from there, so a page costs O(limit) however long the history is.
+
+Each file is also a time partition (rotation by age bounds its span), and its
+index records the min/max timestamp of every block and which blocks hold each
+user, action and file_id. query() / aggregate() skip whole files outside the
+time range and read only the blocks the postings allow.
+"""
+
+import atexit
+import bisect
+import collections
+import itertools
 import json
 import os
-from datetime import datetime
+import queue
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+EVENT_LOG_DIR = os.environ.get("EVENT_LOG_DIR", os.path.join(APP_DIR, "security_events"))
+EVENT_LOG_MAX_BYTES = int(os.environ.get("EVENT_LOG_MAX_BYTES", str(16 * 1024 * 1024)))
+EVENT_LOG_MAX_AGE = float(os.environ.get("EVENT_LOG_MAX_AGE", str(24 * 3600)))
+EVENT_LOG_KEEP = int(os.environ.get("EVENT_LOG_KEEP", "30"))
+EVENT_LOG_FSYNC = os.environ.get("EVENT_LOG_FSYNC", "interval")
+EVENT_LOG_FSYNC_INTERVAL = float(os.environ.get("EVENT_LOG_FSYNC_INTERVAL", "1"))
+EVENT_QUEUE_MAX = int(os.environ.get("EVENT_QUEUE_MAX", "10000"))
+EVENT_QUEUE_POLICY = os.environ.get("EVENT_QUEUE_POLICY", "block")
+EVENT_QUEUE_BLOCK_TIMEOUT = float(os.environ.get("EVENT_QUEUE_BLOCK_TIMEOUT", "0.5"))
+EVENT_BATCH_MAX = int(os.environ.get("EVENT_BATCH_MAX", "256"))
+EVENT_FLUSH_INTERVAL = float(os.environ.get("EVENT_FLUSH_INTERVAL_MS", "50")) / 1000.0
+EVENT_RING_SIZE = int(os.environ.get("EVENT_RING_SIZE", "5000"))
+# how often follow_events() re-reads the log tail for other processes' writes
+EVENT_FOLLOW_INTERVAL = float(os.environ.get("EVENT_FOLLOW_INTERVAL_MS", "200")) / 1000.0
+INDEX_STRIDE = 64
+# actions tagged is_anomaly when written
+ANOMALY_ACTIONS = set(os.environ.get("EVENT_ANOMALY_ACTIONS", "LOGIN_FAIL,DOWNLOAD_FLAGGED").split(","))
+INDEX_VERSION = 2
+# fields with block postings in the index; other filters are checked per event
+INDEXED_FIELDS = ("user", "action", "file_id")
+# the old single-array log, imported once into the JSONL log
+LEGACY_LOG_FILE = os.path.join(APP_DIR, 'security_events.json')
+
+ACTIVE_FILE = "events.jsonl"
+_ROTATED = re.compile(r"^events-(\d+)\.jsonl$")
+TAIL_BLOCK = 64 * 1024
+
+
+def _now_iso():
+    return datetime.utcnow().isoformat() + 'Z'
+
+
+def parse_ts(ts):
+    """Epoch seconds of an event timestamp (UTC ISO-8601), or None."""
+    try:
+        return datetime.fromisoformat(ts.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def read_lines_reverse(path, end=None, block=TAIL_BLOCK):
+    """Lines of a file before byte offset end (default EOF), last first, reading backwards in blocks."""
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END) if end is None else end
+        rest = b""
+        while pos > 0:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + rest
+            lines = buf.split(b"\n")
+            rest = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line
+        if rest.strip():
+            yield rest
+
+
+def _parse_event(line):
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None  # torn tail from a crash mid-append
+    return event if isinstance(event, dict) and "id" in event else None
+
+
+_LEADING_ID = re.compile(rb'^\{"id":\s*(\d+)')
+
+
+def _event_id(line):
+    """Id of an event line without a full parse (events are written id first)."""
+    m = _LEADING_ID.match(line)
+    if m:
+        return int(m.group(1))
+    event = _parse_event(line)
+    return int(event["id"]) if event else None
+
+
+def _first_event(path):
+    with open(path, "rb") as f:
+        return _parse_event(f.readline())
+
+
+def _last_event(path):
+    for line in read_lines_reverse(path):
+        event = _parse_event(line)
+        if event:
+            return event
+    return None
+
+
+def is_anomaly(event):
+    """Write-time anomaly rule (stored on the event as is_anomaly)."""
+    return event.get("action") in ANOMALY_ACTIONS
+
+
+def _index_path(path):
+    return path[:-len(".jsonl")] + ".idx"
+
+
+def _new_index():
+    return {"version": INDEX_VERSION, "entries": [], "end": 0, "count": 0, "ts_lo": None, "ts_hi": None,
+            "ts_min": [], "ts_max": [], "user": {}, "action": {}, "file_id": {}}
+
+
+def _post(postings, value, block):
+    if value is None:
+        return
+    blocks = postings.setdefault(str(value), [])
+    if not blocks or blocks[-1] != block:
+        blocks.append(block)
+
+
+def _extend_index(idx, f):
+    """Index the complete lines of f from its current position (idx["end"])."""
+    pos = idx["end"]
+    for line in f:
+        if not line.endswith(b"\n"):
+            break  # partial append in progress
+        event = _parse_event(line)
+        if event is not None:
+            block = idx["count"] // INDEX_STRIDE
+            if idx["count"] % INDEX_STRIDE == 0:
+                idx["entries"].append((int(event["id"]), pos))
+                idx["ts_min"].append(None)
+                idx["ts_max"].append(None)
+            ts = parse_ts(event.get("timestamp"))
+            if ts is not None:
+                if idx["ts_min"][block] is None or ts < idx["ts_min"][block]:
+                    idx["ts_min"][block] = ts
+                if idx["ts_max"][block] is None or ts > idx["ts_max"][block]:
+                    idx["ts_max"][block] = ts
+                idx["ts_lo"] = ts if idx["ts_lo"] is None else min(idx["ts_lo"], ts)
+                idx["ts_hi"] = ts if idx["ts_hi"] is None else max(idx["ts_hi"], ts)
+            _post(idx["user"], event.get("user"), block)
+            _post(idx["action"], event.get("action"), block)
+            _post(idx["file_id"], _field(event, "file_id"), block)
+            idx["count"] += 1
+        pos += len(line)
+    idx["end"] = pos
+
+
+def _field(event, name):
+    """Value of a filter / group-by field: user, action, file_id, hour, day or details.<key>."""
+    if name in ("user", "action"):
+        return event.get(name)
+    if name == "hour":
+        return (event.get("timestamp") or "")[:13] or None
+    if name == "day":
+        return (event.get("timestamp") or "")[:10] or None
+    details = event.get("details")
+    if not isinstance(details, dict):
+        return None
+    return details.get(name[len("details."):] if name.startswith("details.") else name)
+
+
+def _grep_lines(data, needles):
+    """Lines of data holding a needle from every group, last first (all lines without needles)."""
+    if not needles:
+        return reversed(data.splitlines())
+    spans = set()
+    for needle in needles[0]:
+        pos = data.find(needle)
+        while pos >= 0:
+            start = data.rfind(b"\n", 0, pos) + 1
+            end = data.find(b"\n", pos)
+            end = len(data) if end < 0 else end
+            spans.add((start, end))
+            pos = data.find(needle, end + 1)
+    lines = [data[start:end] for start, end in sorted(spans, reverse=True)]
+    return [line for line in lines if all(any(n in line for n in group) for group in needles[1:])]
+
+
+def _overlaps(lo, hi, since, until):
+    """Whether [lo, hi] may hold a timestamp in [since, until) (unknown bounds always may)."""
+    return not ((since is not None and hi is not None and hi < since) or
+                (until is not None and lo is not None and lo >= until))
+
+
+class RingBuffer:
+    """The newest `capacity` events, oldest first, with O(1) indexing."""
+
+    def __init__(self, capacity):
+        self.capacity = max(1, capacity)
+        self._items = []
+        self._start = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, i):
+        return self._items[(self._start + i) % len(self._items)]
+
+    def append(self, event):
+        if len(self._items) < self.capacity:
+            self._items.append(event)
+        else:
+            self._items[self._start] = event
+            self._start = (self._start + 1) % self.capacity
+
+    def after(self, event_id):
+        """Events with id > event_id, oldest first."""
+        lo, hi = 0, len(self._items)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid]["id"] <= event_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return [self[i] for i in range(lo, len(self._items))]
+
+    def newest(self, limit, before=None):
+        """Up to limit events with id < before (default: any), newest first."""
+        hi = len(self._items)
+        if before is not None:
+            lo = 0
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self[mid]["id"] < before:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        return [self[i] for i in range(hi - 1, max(hi - limit, 0) - 1, -1)]
+
+
+class EventLog:
+    def __init__(self, log_dir=EVENT_LOG_DIR, max_bytes=EVENT_LOG_MAX_BYTES, max_age=EVENT_LOG_MAX_AGE,
+                 keep=EVENT_LOG_KEEP, fsync=EVENT_LOG_FSYNC, fsync_interval=EVENT_LOG_FSYNC_INTERVAL,
+                 legacy_file=LEGACY_LOG_FILE, ring_size=EVENT_RING_SIZE):
+        self.dir = log_dir
+        self.path = os.path.join(log_dir, ACTIVE_FILE)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep = keep
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._file = None
+        self._last_sync = 0.0
+        self._ring = RingBuffer(ring_size)
+        self._ring_lock = threading.Lock()
+        self._followers = []
+        self._followed_id = 0
+        self._indexes = {}  # inode -> {"entries": [(id, offset)], "end": offset, "count": events}
+        self._index_lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+        self._lockfile = open(os.path.join(log_dir, "events.lock"), "a")
+        with self._lock:
+            self._flock(True)
+            try:
+                self._import_legacy(legacy_file)
+                self._open()
+                self._seed_ring()
+            finally:
+                self._flock(False)
+
+    def _flock(self, held):
+        if fcntl is not None:
+            fcntl.flock(self._lockfile.fileno(), fcntl.LOCK_EX if held else fcntl.LOCK_UN)
+
+    # ---------- Files ----------
+    def rotated_files(self):
+        """[(first id, path)] of rotated files, oldest first."""
+        found = []
+        for name in os.listdir(self.dir):
+            m = _ROTATED.match(name)
+            if m:
+                found.append((int(m.group(1)), os.path.join(self.dir, name)))
+        return sorted(found)
+
+    def _open(self):
+        if self._file:
+            self._file.close()
+        self._file = open(self.path, "ab")
+        st = os.fstat(self._file.fileno())
+        self._ino = st.st_ino
+        self._end = None  # unknown until _catch_up reads the tail
+        first = _first_event(self.path) if st.st_size else None
+        self._started = (first and parse_ts(first.get("timestamp"))) or time.time()
+
+    def _catch_up(self):
+        """Under the flock: follow a rotation by another process and re-read the last id if the file moved."""
+        try:
+            ino = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            ino = None
+        if ino != self._ino:
+            self._open()
+        size = os.fstat(self._file.fileno()).st_size
+        if size != self._end:
+            last = _last_event(self.path) if size else None
+            if last is None:
+                rotated = self.rotated_files()
+                last = _last_event(rotated[-1][1]) if rotated else None
+            self._seq = int(last["id"]) if last else 0
+            self._end = size
+
+    def _rotate(self):
+        first = _first_event(self.path)
+        self._file.close()
+        self._file = None
+        first_id = int(first["id"]) if first else self._seq + 1
+        os.replace(self.path, os.path.join(self.dir, f"events-{first_id:012d}.jsonl"))
+        if self.keep > 0:
+            for _, path in self.rotated_files()[:-self.keep]:
+                os.remove(path)
+                if os.path.exists(_index_path(path)):
+                    os.remove(_index_path(path))
+        self._open()
+        self._end = 0
+
+    def _import_legacy(self, legacy_file):
+        # the old log was one JSON array, newest first; keep its ids
+        if not legacy_file or not os.path.exists(legacy_file) or os.path.exists(self.path):
+            return
+        try:
+            with open(legacy_file, "r") as f:
+                events = json.load(f)
+        except ValueError as e:
+            print(f"Skipping unreadable legacy event log {legacy_file}: {e}")
+            return
+        events = sorted((e for e in events if isinstance(e, dict) and "id" in e), key=lambda e: e["id"])
+        with open(self.path, "w") as f:
+            for event in events:
+                f.write(json.dumps(event, separators=(",", ":")) + "\n")
+        os.replace(legacy_file, legacy_file + ".migrated")
+        print(f"Imported {len(events)} events from {legacy_file}")
+
+    # ---------- Writes ----------
+    def append_many(self, entries):
+        """
+        Append events given as dicts with user / action / timestamp / details
+        (and optionally is_anomaly, else is_anomaly() decides); each gets the
+        next id. One write (and at most one fsync) per call.
+        Returns the stored events.
+        """
+        if not entries:
+            return []
+        with self._lock:
+            self._flock(True)
+            try:
+                self._catch_up()
+                if self._end and (self._end >= self.max_bytes or time.time() - self._started >= self.max_age):
+                    self._rotate()
+                events, lines = [], []
+                for entry in entries:
+                    self._seq += 1
+                    event = {"id": self._seq, "user": entry.get("user"), "action": entry.get("action"),
+                             "timestamp": entry.get("timestamp") or _now_iso(), "details": entry.get("details") or {},
+                             "is_anomaly": bool(entry["is_anomaly"]) if "is_anomaly" in entry else is_anomaly(entry)}
+                    events.append(event)
+                    lines.append(json.dumps(event, separators=(",", ":")))
+                data = ("\n".join(lines) + "\n").encode("utf-8")
+                if not self._end:
+                    self._started = time.time()
+                self._file.write(data)
+                self._file.flush()
+                self._end += len(data)
+                now = time.monotonic()
+                if self.fsync == "always" or (self.fsync == "interval" and now - self._last_sync >= self.fsync_interval):
+                    os.fsync(self._file.fileno())
+                    self._last_sync = now
+            finally:
+                self._flock(False)
+        return events
+
+    def append(self, user, action, details=None):
+        return self.append_many([{"user": user, "action": action, "details": details}])[0]
+
+    # ---------- Reads ----------
+    def iter_reverse(self):
+        """Every event, newest first (active file, then rotated files)."""
+        paths = [self.path] + [p for _, p in reversed(self.rotated_files())]
+        for path in paths:
+            try:
+                for line in read_lines_reverse(path):
+                    event = _parse_event(line)
+                    if event:
+                        yield event
+            except FileNotFoundError:
+                continue  # rotated away or pruned while reading
+
+    def _seed_ring(self):
+        """Fill the ring from the log tail and start following the active file at its end."""
+        newest = []
+        for event in self.iter_reverse():
+            if len(newest) >= self._ring.capacity:
+                break
+            newest.append(event)
+        for event in reversed(newest):
+            self._ring.append(event)
+        self._followed_id = newest[0]["id"] if newest else 0
+        self._reader = open(self.path, "rb")
+        self._reader_ino = os.fstat(self._reader.fileno()).st_ino
+        self._read_pos = os.fstat(self._reader.fileno()).st_size
+
+    def _follow(self):
+        """Move whatever the log grew by into the ring and on to the followers (under _ring_lock)."""
+        followed = []
+        while True:
+            try:
+                rotated = os.stat(self.path).st_ino != self._reader_ino
+            except FileNotFoundError:
+                rotated = False  # mid-rotation; the next read picks it up
+            # once rotated the old file is final, so reading it to EOF loses nothing
+            self._reader.seek(self._read_pos)
+            data = self._reader.read()
+            complete = data[:data.rfind(b"\n") + 1]
+            for line in complete.splitlines():
+                event = _parse_event(line)
+                if event:
+                    self._ring.append(event)
+                    followed.append(event)
+            self._read_pos += len(complete)
+            if not rotated:
+                break
+            self._reader.close()
+            self._reader = open(self.path, "rb")
+            self._reader_ino = os.fstat(self._reader.fileno()).st_ino
+            self._read_pos = 0
+        if followed:
+            self._followed_id = followed[-1]["id"]
+            for listener in self._followers:
+                try:
+                    listener(followed)
+                except Exception as e:
+                    print(f"Event follower failed: {e}")
+
+    def add_follower(self, listener):
+        """
+        Call listener(events) with every event read from the log from now on,
+        whichever process wrote it, oldest first (on the reading thread, under
+        the ring lock, so it must not read the log itself). Returns the id of
+        the last event read before it was added.
+        """
+        with self._ring_lock:
+            self._follow()
+            self._followers.append(listener)
+            return self._followed_id
+
+    def poll(self):
+        """Read whatever the log grew by (followers hear about it)."""
+        with self._ring_lock:
+            self._follow()
+
+    def _segments(self):
+        """[(first id, path)] of every log file, oldest first."""
+        segments = self.rotated_files()
+        try:
+            first = _first_event(self.path)
+        except FileNotFoundError:
+            first = None
+        if first:
+            segments.append((int(first["id"]), self.path))
+        return segments
+
+    def _offset_index(self, path):
+        """
+        Index of a log file, extended over any new tail: a sparse (id, offset)
+        entry per block of INDEX_STRIDE events, each block's min/max timestamp,
+        and block postings per user, action and file_id.
+        """
+        size = os.path.getsize(path)
+        rotated = path != self.path
+        with open(path, "rb") as f:
+            key = os.fstat(f.fileno()).st_ino
+            with self._index_lock:
+                idx = self._indexes.get(key)
+                saved = idx is not None
+                if idx is None and rotated and os.path.exists(_index_path(path)):
+                    try:
+                        with open(_index_path(path), "r") as fi:
+                            idx = json.load(fi)
+                        idx["entries"] = [tuple(e) for e in idx["entries"]]
+                        saved = True
+                    except ValueError:
+                        idx = None
+                if idx is None or idx.get("version") != INDEX_VERSION:
+                    idx = _new_index()
+                    saved = False
+                if idx["end"] < size:
+                    f.seek(idx["end"])
+                    _extend_index(idx, f)
+                    saved = False
+                if rotated and not saved:
+                    tmp = _index_path(path) + ".tmp"
+                    with open(tmp, "w") as fo:
+                        json.dump(idx, fo)
+                    os.replace(tmp, _index_path(path))
+                self._indexes[key] = idx
+                return idx
+
+    def since(self, event_id):
+        """
+        Events with id > event_id, oldest first, or None if some of them have
+        already left the ring (the caller should start over from recent()).
+        """
+        with self._ring_lock:
+            self._follow()
+            if len(self._ring) and self._ring[0]["id"] > event_id + 1:
+                return None
+            return self._ring.after(event_id)
+
+    def _older(self, before, limit):
+        """Up to limit events with id < before, newest first, read through the offset index."""
+        segments = self._segments()
+        i = bisect.bisect_left([first for first, _ in segments], before) - 1
+        events = []
+        while i >= 0 and len(events) < limit:
+            path = segments[i][1]
+            try:
+                idx = self._offset_index(path)
+                j = bisect.bisect_left(idx["entries"], (before,)) - 1
+                end = idx["entries"][j][1] if j >= 0 else 0
+                # at most INDEX_STRIDE lines forward to the first id >= before
+                with open(path, "rb") as f:
+                    f.seek(end)
+                    for line in f:
+                        event_id = _event_id(line)
+                        if event_id is not None and event_id >= before:
+                            break
+                        end += len(line)
+                for line in read_lines_reverse(path, end=end, block=8192):
+                    event = _parse_event(line)
+                    if event and event["id"] < before:
+                        events.append(event)
+                        if len(events) >= limit:
+                            break
+            except FileNotFoundError:
+                pass  # pruned while paging
+            i -= 1
+        return events
+
+    def recent(self, limit=50, before=None):
+        """
+        Up to limit events, newest first; with before, only ids < before (the
+        id of the last event of the previous page).
+        """
+        with self._ring_lock:
+            self._follow()
+            events = self._ring.newest(limit, before)
+            oldest = self._ring[0]["id"] if len(self._ring) else None
+        if len(events) < limit and oldest is not None:
+            # ring exhausted: continue below the oldest event it holds
+            below = events[-1]["id"] if events else min(before, oldest) if before is not None else oldest
+            events += self._older(below, limit - len(events))
+        return events
+
+    def _candidate_blocks(self, idx, filters, since, until, before):
+        """Blocks of an index that may hold matching events, newest first."""
+        blocks = None
+        for name, values in filters.items():
+            if name not in INDEXED_FIELDS:
+                continue
+            posted = set()
+            for value in values:
+                posted.update(idx[name].get(value, ()))
+            blocks = posted if blocks is None else blocks & posted
+            if not blocks:
+                return []
+        blocks = sorted(blocks, reverse=True) if blocks is not None else range(len(idx["entries"]) - 1, -1, -1)
+        return [b for b in blocks
+                if (before is None or idx["entries"][b][0] < before)
+                and _overlaps(idx["ts_min"][b], idx["ts_max"][b], since, until)]
+
+    def scan(self, filters=None, since=None, until=None, before=None):
+        """
+        Events matching every filter, newest first. filters maps a field
+        (see _field) to a collection of accepted values; since / until bound
+        the timestamp in epoch seconds ([since, until)); before bounds the id.
+        Only segments and blocks whose index says they may match are read.
+        """
+        filters = {name: {str(v) for v in values} for name, values in (filters or {}).items()}
+        # a matching line contains one of each indexed filter's values as written by
+        # json.dumps, so most lines in a candidate block are skipped without parsing
+        needles = [[json.dumps(v)[1:-1].encode("utf-8") for v in values]
+                   for name, values in filters.items() if name in INDEXED_FIELDS]
+        for first, path in reversed(self._segments()):
+            if before is not None and first >= before:
+                continue
+            try:
+                idx = self._offset_index(path)
+                if not _overlaps(idx["ts_lo"], idx["ts_hi"], since, until):
+                    continue
+                blocks = self._candidate_blocks(idx, filters, since, until, before)
+                if not blocks:
+                    continue
+                with open(path, "rb") as f:
+                    for b in blocks:
+                        start = idx["entries"][b][1]
+                        end = idx["entries"][b + 1][1] if b + 1 < len(idx["entries"]) else idx["end"]
+                        f.seek(start)
+                        for line in _grep_lines(f.read(end - start), needles):
+                            event = _parse_event(line)
+                            if event and self._matches(event, filters, since, until, before):
+                                yield event
+            except FileNotFoundError:
+                continue  # pruned while scanning
+
+    @staticmethod
+    def _matches(event, filters, since, until, before):
+        if before is not None and event["id"] >= before:
+            return False
+        for name, values in filters.items():
+            value = _field(event, name)
+            if value is None or str(value) not in values:
+                return False
+        if since is not None or until is not None:
+            ts = parse_ts(event.get("timestamp"))
+            if ts is None or (since is not None and ts < since) or (until is not None and ts >= until):
+                return False
+        return True
+
+    def query(self, filters=None, since=None, until=None, limit=50, before=None):
+        """Up to limit matching events (see scan), newest first."""
+        return list(itertools.islice(self.scan(filters, since, until, before), limit))
+
+    def aggregate(self, group_by, filters=None, since=None, until=None, max_groups=1000):
+        """
+        Counts of matching events per distinct value of the group_by fields
+        (e.g. ["hour", "details.location"]), largest first, at most
+        max_groups rows: [{"key": {field: value}, "count": n}].
+        """
+        counts = collections.Counter()
+        for event in self.scan(filters, since, until):
+            counts[tuple(_field(event, name) for name in group_by)] += 1
+        return [{"key": dict(zip(group_by, key)), "count": n} for key, n in counts.most_common(max_groups)]
+
+    def flush(self):
+        with self._lock:
+            if self._file:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+            self._lockfile.close()
+        with self._ring_lock:
+            self._reader.close()
+
+
+class EventWriter:
+    """Background thread appending queued events to an EventLog in batches."""
+
+    def __init__(self, log, max_queue=EVENT_QUEUE_MAX, policy=EVENT_QUEUE_POLICY,
+                 block_timeout=EVENT_QUEUE_BLOCK_TIMEOUT, batch_size=EVENT_BATCH_MAX,
+                 flush_interval=EVENT_FLUSH_INTERVAL):
+        if policy not in ("block", "drop_new", "drop_oldest"):
+            raise ValueError(f"unknown event queue policy {policy!r}")
+        self.log = log
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self.counters = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0, "max_depth": 0}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._count_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self._thread.start()
+
+    def _count(self, name, n=1):
+        with self._count_lock:
+            self.counters[name] += n
+
+    def submit(self, entry):
+        """Queue one event; returns False if the overflow policy dropped it."""
+        if self._closed:
+            self._write([entry])  # after shutdown, write through
+            return True
+        try:
+            if self.policy == "block":
+                self._queue.put(entry, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(entry)
+        except queue.Full:
+            if self.policy != "drop_oldest":
+                self._count("dropped")
+                return False
+            while True:
+                try:
+                    self._queue.get_nowait()
+                    self._count("dropped")
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait(entry)
+                    break
+                except queue.Full:
+                    continue
+        depth = self._queue.qsize()
+        with self._count_lock:
+            self.counters["enqueued"] += 1
+            if depth > self.counters["max_depth"]:
+                self.counters["max_depth"] = depth
+        return True
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            self.log.append_many(batch)
+            self._count("written", len(batch))
+            self._count("batches")
+        except Exception as e:
+            print(f"Event log write failed, {len(batch)} events lost: {e}")
+            self._count("failed", len(batch))
+            return
+        _follow_wake.set()
+
+    def _run(self):
+        batch = []
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval if batch else None)
+            except queue.Empty:
+                self._write(batch)
+                batch = []
+                continue
+            if isinstance(item, threading.Event):
+                # flush() / close() marker: everything queued before it is written now
+                self._write(batch)
+                batch = []
+                item.set()
+                if self._closed and self._queue.empty():
+                    return
+                continue
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+
+    def flush(self, timeout=5.0):
+        """Wait until every event queued so far has been written."""
+        if not self._thread.is_alive():
+            return True
+        marker = threading.Event()
+        self._queue.put(marker)
+        return marker.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """Stop accepting queued events and drain the queue."""
+        if self._closed:
+            return
+        self._closed = True
+        self.flush(timeout)
+        self._thread.join(timeout)
+        # anything that slipped in behind the final marker
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if not isinstance(item, threading.Event):
+                leftover.append(item)
+        self._write(leftover)
+
+    def stats(self):
+        with self._count_lock:
+            return {**self.counters, "depth": self._queue.qsize(), "capacity": self._queue.maxsize,
+                    "policy": self.policy}
+
+
+_log = None
+_writer = None
+_log_lock = threading.Lock()
+_follower = None
+_follow_wake = threading.Event()
+
+
+def event_log():
+    """Process-wide EventLog, opened on first use (and again in a forked worker,
+    since an inherited descriptor would share the parent's flock)."""
+    global _log
+    if _log is None or _log.pid != os.getpid():
+        with _log_lock:
+            if _log is None or _log.pid != os.getpid():
+                _log = EventLog()
+    return _log
+
+
+def event_writer():
+    """Process-wide EventWriter; a forked worker starts its own."""
+    global _writer
+    if _writer is None or _writer.pid != os.getpid():
+        log = event_log()
+        with _log_lock:
+            if _writer is None or _writer.pid != os.getpid():
+                _writer = EventWriter(log)
+                atexit.register(_writer.close)
+    return _writer
+
+
+def _follow_loop(interval):
+    while True:
+        _follow_wake.wait(interval)
+        _follow_wake.clear()
+        try:
+            event_log().poll()
+        except Exception as e:
+            print(f"Event log follow failed: {e}")
+
+
+def follow_events(listener, interval=EVENT_FOLLOW_INTERVAL):
+    """
+    Call listener(events) with every event any process appends from now on,
+    in id order, from a background thread reading the log tail (within
+    interval, at once for this process's own writes). Returns the id of the
+    last event already read; listener gets every one after it.
+    """
+    global _follower
+    last = event_log().add_follower(listener)
+    with _log_lock:
+        if _follower is None or _follower.pid != os.getpid():
+            _follower = threading.Thread(target=_follow_loop, args=(interval,), name="event-follower", daemon=True)
+            _follower.pid = os.getpid()
+            _follower.start()
+    return last
 
-LOG_FILE = os.path.join(os.path.dirname(__file__), '..', 'security_events.json')
 
 def log_event(user, action, details=None):
-    """Logs a security event to a JSON file."""
-    if not os.path.exists(LOG_FILE):
-        with open(LOG_FILE, 'w') as f:
-            json.dump([], f)
-
-    with open(LOG_FILE, 'r+') as f:
-        events = json.load(f)
-        
-        new_event = {
-            "id": len(events) + 1,
-            "user": user,
-            "action": action,
-            "timestamp": datetime.utcnow().isoformat() + 'Z',
-            "details": details or {}
-        }
-        
-        events.insert(0, new_event) # Add new events to the top
-        f.seek(0)
-        json.dump(events, f, indent=4)
-
-def get_events(limit=50):
-    """Retrieves the most recent security events."""
-    if not os.path.exists(LOG_FILE):
-        return []
-        
-    with open(LOG_FILE, 'r') as f:
-        events = json.load(f)
-        return events[:limit]
\ No newline at end of file
+    """Queues a security event for the background writer."""
+    event_writer().submit({"user": user, "action": action, "timestamp": _now_iso(), "details": details or {}})
+
+
+def get_events(limit=50, before=None):
+    """Retrieves the most recent security events (ids < before), newest first."""
+    return event_log().recent(limit, before)
+
+
+def query_events(filters=None, since=None, until=None, limit=50, before=None):
+    """Security events matching filters / time range, newest first."""
+    return event_log().query(filters, since, until, limit, before)
+
+
+def events_since(event_id):
+    """Events with id > event_id, oldest first; None if they are no longer all in the ring."""
+    return event_log().since(event_id)
+
+
+def aggregate_events(group_by, filters=None, since=None, until=None, max_groups=1000):
+    """Counts of matching security events per group_by key, largest first."""
+    return event_log().aggregate(group_by, filters, since, until, max_groups)
@@ -2,15 +2,51 @@
 import uuid
 import os
 import json
+import time
+import base64
 from datetime import datetime
-from .user_component import load_db, save_db
+from .metadata_store import open_metadata_store, CRYPTO_FIELDS
+from .policy_compiler import PolicyCache, attribute_mask
 from werkzeug.utils import secure_filename
 
+# Optional metadata fields carried over from non-legacy ciphertext formats.
+FORMAT_FIELDS = ("format", "manifest_ct", "chunks", "size")
+# Fields returned by listings unless the caller asks for others; keeps
+# ciphertexts and storage locations out of list responses.
+LIST_FIELDS = ("id", "display_name", "user_friendly_id", "uploader", "orig_filename",
+               "policy", "created", "format", "size", "tags", "context_policy")
+MAX_PAGE_SIZE = 500
+# A dedupe hit is persisted at most this often per chunk and process; well
+# under the garbage collector's min_object_age, so a chunk an upload just
+# matched always looks recently used to the collector in every worker.
+CHUNK_TOUCH_INTERVAL = 3600
+
+
+def encode_cursor(record):
+    raw = json.dumps([record.get("created") or "", record["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(created, id) from an opaque cursor; raises ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created, fid = json.loads(raw)
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(created, str) or not isinstance(fid, str):
+        raise ValueError("invalid cursor")
+    return created, fid
+
+
 class FileComponent:
-    def __init__(self):
-        self.db = load_db()
+    def __init__(self, store=None):
+        self.store = store or open_metadata_store()
+        self.policies = PolicyCache()
+        # chunk id -> last dedupe hit this process persisted (see CHUNK_TOUCH_INTERVAL)
+        self._chunk_touched = {}
 
-    def register_encrypted_file(self, uploader, metadata, s3_key=None):
+    def register_encrypted_file(self, uploader, metadata, s3_key=None, tags=None):
         # Internal UUID for security
         fid = str(uuid.uuid4())
         
@@ -19,7 +55,7 @@ class FileComponent:
         base_name = os.path.splitext(original_filename)[0]
         display_name = secure_filename(base_name)
         
-        self.db["files"][fid] = {
+        record = {
             "id": fid,
             "display_name": display_name,  # ✅ Add this for user interface
             "user_friendly_id": display_name,  # ✅ For CLI display
@@ -31,26 +67,118 @@ class FileComponent:
             "s3_key": s3_key,
             "created": datetime.utcnow().isoformat(),
             "context_policy": {},
+            "tags": list(tags or []),
         }
-        save_db(self.db)
+        for key in FORMAT_FIELDS:
+            if key in metadata:
+                record[key] = metadata[key]
+        self.store.put_file(fid, record)
         return fid
 
     def get_file(self, fid):
-        return self.db["files"].get(fid)
+        return self.store.get_file(fid)
 
     def list_files(self):
-        return list(self.db["files"].values())
+        return self.store.list_files()
+
+    def query_files(self, uploader=None, created_from=None, created_to=None, name_prefix=None,
+                    attributes=(), cursor=None, limit=50, fields=None, accessible_to=None):
+        """
+        One page of files, newest first. Returns (records, next_cursor); records
+        only carry `fields` (default LIST_FIELDS). next_cursor is None on the
+        last page. uploader, attributes (policy attributes, all required) and
+        the created range are answered from the store's secondary indexes.
+        accessible_to (a user's attribute list) keeps only files whose policy
+        that user's key can satisfy.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        fields = tuple(fields or LIST_FIELDS)
+        after = decode_cursor(cursor) if cursor else None
+        policies = None
+        if accessible_to is not None:
+            policies = self.accessible_policies(accessible_to)
+            if policies is not None and not policies:
+                return [], None
+        rows = self.store.query_files(
+            uploader=uploader, created_from=created_from, created_to=created_to,
+            name_prefix=name_prefix, attributes=attributes or (), after=after, limit=limit + 1,
+            include_crypto=any(f in CRYPTO_FIELDS for f in fields), policies=policies,
+        )
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return [{k: r[k] for k in fields if k in r} for r in rows[:limit]], next_cursor
+
+    def iter_files(self, fields=None, page_size=MAX_PAGE_SIZE):
+        """Every file record (only `fields`), newest first, read one page at a time."""
+        cursor = None
+        while True:
+            page, cursor = self.query_files(cursor=cursor, limit=page_size, fields=fields)
+            yield from page
+            if not cursor:
+                return
+
+    def accessible_policies(self, attributes):
+        """
+        Distinct stored policies a key for these attributes may satisfy. Each
+        distinct policy is compiled once (cached) and checked against the
+        attribute bitmask; policies that can't be compiled are kept. None
+        (no filtering) if the attributes have no mask.
+        """
+        mask = attribute_mask(attributes)
+        if mask is None:
+            return None
+        return [p for p in self.store.list_policies() if self.policies.check(p, mask) is not False]
+
+    def can_decrypt(self, attributes, record):
+        """
+        Whether a key for these attributes satisfies the record's ABE policy:
+        True / False, or None when the policy can't be compiled exactly or
+        the attributes have no mask.
+        """
+        return self.policies.check(record.get("policy"), attribute_mask(attributes))
+
+    def index_stats(self):
+        """File counts per uploader and per policy attribute."""
+        return self.store.file_index_stats()
 
     def set_s3_key(self, fid, s3_key):
-        if fid not in self.db["files"]:
-            return False
-        self.db["files"][fid]["s3_key"] = s3_key
-        save_db(self.db)
-        return True
+        return self.store.update_file(fid, {"s3_key": s3_key})
+
+    def swap_storage(self, fid, expected_s3_key, fields):
+        """
+        Replace a record's storage fields in one step, only if its s3_key is still
+        expected_s3_key (compare-and-swap for background re-encoding). Readers see
+        either the old or the new record, never a mix.
+        """
+        return self.store.update_file(fid, fields, expect={"s3_key": expected_s3_key})
 
     def set_context_policy(self, fid, policy):
-        if fid not in self.db["files"]:
-            return False
-        self.db["files"][fid]["context_policy"] = policy
-        save_db(self.db)
-        return True
+        return self.store.set_context_policy(fid, policy)
+
+    # ---------- Dedup chunk catalog ----------
+    def has_chunk(self, chunk_id):
+        """Dedupe lookup. A hit also marks the chunk as recently used, in the store, for the garbage collector."""
+        found = self.store.has_chunk(chunk_id)
+        if found:
+            now = time.time()
+            if now - self._chunk_touched.get(chunk_id, 0) >= CHUNK_TOUCH_INTERVAL:
+                self.store.touch_chunks([chunk_id], now)
+                self._chunk_touched[chunk_id] = now
+        return found
+
+    def chunk_last_seen(self, chunk_id):
+        """When an upload last referenced or deduplicated against the chunk (epoch, 0 if never)."""
+        return self.store.chunk_last_seen(chunk_id)
+
+    def drop_chunks(self, chunk_ids):
+        """Forget chunks whose objects were garbage-collected."""
+        self.store.drop_chunks(chunk_ids)
+        for cid in chunk_ids:
+            self._chunk_touched.pop(cid, None)
+
+    def add_chunks(self, chunk_ids, new_chunks=None):
+        """
+        Catalog a stored file's chunks: new_chunks maps id -> stored size, and
+        every listed chunk is marked seen now. Liveness is not counted here;
+        the garbage collector finds unreferenced chunks from the file records.
+        """
+        self.store.add_chunks(chunk_ids, new_chunks)
@@ -0,0 +1,235 @@
+# backend/components/garbage_collector.py
+"""
+Reclaims storage the request paths leave behind.
+
+- Storage reconciler: lists our prefixes of the bucket (enc/ and chunks/)
+  page by page and deletes objects no file record references (failed
+  uploads, abandoned chunks). Only objects older than min_object_age are
+  touched, so in-flight uploads and resumable sessions are never raced;
+  chunks an upload deduplicated against within that age (last_seen in the
+  metadata store) and objects a migration replaced but still holds for its
+  delete grace period are left alone too. The referenced keys are spilled
+  page by page into a temporary SQLite set, so memory stays bounded however
+  large the catalog. A chunk is re-checked and deleted under the ChunkLock
+  uploads hold around their dedupe lookup, so no upload can reuse it midway.
+- Migration sweep: deletes the objects a migration replaced once their
+  grace period has passed, if the run stopped before it got to them.
+- Temp sweeper: removes stale dec_* plaintexts in keys/ and dl_*/mig_*/upload
+  temp files in uploads/.
+
+Both work on bounded pages and pace deletions to max_deletes_per_sec. Every
+run returns a report with the bytes reclaimed. With lock_path set, only one
+worker process runs a pass at a time.
+"""
+
+import contextlib
+import fnmatch
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from .chunk_store import CHUNK_PREFIX
+from .migration import pending_deletes, sweep_pending_deletes
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MIN_OBJECT_AGE = 24 * 3600
+TEMP_FILE_TTL = 3600
+PAGE_SIZE = 1000
+MAX_DELETES_PER_SEC = 50
+ENCRYPTED_PREFIX = "enc/"
+STORAGE_PREFIXES = (ENCRYPTED_PREFIX, CHUNK_PREFIX)
+
+
+class GarbageCollector:
+    def __init__(self, file_comp, storage, temp_rules, min_object_age=MIN_OBJECT_AGE,
+                 temp_ttl=TEMP_FILE_TTL, page_size=PAGE_SIZE, max_deletes_per_sec=MAX_DELETES_PER_SEC,
+                 upload_sessions=None, lock_path=None, migration_checkpoint=None, prefixes=STORAGE_PREFIXES,
+                 chunk_lock=None):
+        self.file_comp = file_comp
+        self.storage = storage
+        self.temp_rules = temp_rules
+        self.min_object_age = min_object_age
+        self.temp_ttl = temp_ttl
+        self.page_size = page_size
+        self.max_deletes_per_sec = max_deletes_per_sec
+        self.upload_sessions = upload_sessions
+        self.lock_path = lock_path
+        self.migration_checkpoint = migration_checkpoint
+        self.prefixes = prefixes
+        self.chunk_lock = chunk_lock
+        self.last_report = None
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _pace(self, started, deletes):
+        # keep deletions at or below max_deletes_per_sec
+        if self.max_deletes_per_sec:
+            ahead = deletes / self.max_deletes_per_sec - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def _collect_referenced(self, db):
+        """Fill db's refs table with the storage keys of every file record, a page of records at a time."""
+        db.execute("CREATE TABLE refs (key TEXT PRIMARY KEY) WITHOUT ROWID")
+        cursor = None
+        while True:
+            page, cursor = self.file_comp.query_files(cursor=cursor, limit=self.page_size, fields=("s3_key", "chunks"))
+            keys = []
+            for rec in page:
+                if rec.get("s3_key"):
+                    keys.append(rec["s3_key"])
+                keys.extend(CHUNK_PREFIX + cid for cid in rec.get("chunks") or ())
+            db.executemany("INSERT OR IGNORE INTO refs VALUES (?)", [(k,) for k in keys])
+            if not cursor:
+                break
+        # the migration deletes the objects it replaced itself, after its grace period
+        if self.migration_checkpoint:
+            db.executemany("INSERT OR IGNORE INTO refs VALUES (?)",
+                           [(k,) for k in pending_deletes(self.migration_checkpoint)])
+
+    @staticmethod
+    def _referenced_in(db, keys):
+        found = set()
+        for i in range(0, len(keys), 500):  # stay under SQLite's bound-parameter limit
+            batch = keys[i:i + 500]
+            found.update(k for (k,) in db.execute(
+                f"SELECT key FROM refs WHERE key IN ({','.join('?' * len(batch))})", batch))
+        return found
+
+    def _delete_chunk(self, key, chunk_id, cutoff):
+        """
+        Delete an orphaned chunk unless an upload has touched or rewritten it
+        since it was listed. Its catalog entry goes first, so no later upload
+        dedupes against it. None if it was left alone, else whether it was deleted.
+        """
+        with self.chunk_lock.exclusive() if self.chunk_lock else contextlib.nullcontext():
+            if self.file_comp.chunk_last_seen(chunk_id) > cutoff:
+                return None
+            stat = self.storage.stat_object(key)
+            if stat is None or stat[1] > cutoff:
+                return None
+            self.file_comp.drop_chunks([chunk_id])
+            return self.storage.delete_file(key)
+
+    def _pages(self):
+        for prefix in self.prefixes:
+            yield from self.storage.list_objects(prefix, self.page_size)
+
+    def reconcile_storage(self, dry_run=False):
+        report = {"scanned": 0, "orphans": 0, "deleted": 0, "reclaimed_bytes": 0, "errors": 0}
+        fd, db_path = tempfile.mkstemp(prefix="gc_refs_", suffix=".db")
+        os.close(fd)
+        db = sqlite3.connect(db_path)
+        try:
+            self._collect_referenced(db)
+            cutoff = time.time() - self.min_object_age
+            started = time.monotonic()
+            for page in self._pages():
+                referenced = self._referenced_in(db, [key for key, _, mtime in page if mtime <= cutoff])
+                for key, size, mtime in page:
+                    report["scanned"] += 1
+                    if key in referenced or mtime > cutoff:
+                        continue
+                    chunk_id = key[len(CHUNK_PREFIX):] if key.startswith(CHUNK_PREFIX) else None
+                    if chunk_id and self.file_comp.chunk_last_seen(chunk_id) > cutoff:
+                        continue
+                    report["orphans"] += 1
+                    if dry_run:
+                        report["reclaimed_bytes"] += size
+                        continue
+                    deleted = self._delete_chunk(key, chunk_id, cutoff) if chunk_id else self.storage.delete_file(key)
+                    if deleted is None:
+                        report["orphans"] -= 1  # reused since it was listed
+                        continue
+                    if deleted:
+                        report["deleted"] += 1
+                        report["reclaimed_bytes"] += size
+                    else:
+                        report["errors"] += 1
+                    self._pace(started, report["deleted"] + report["errors"])
+                    if self._stop.is_set():
+                        break
+                if self._stop.is_set():
+                    break
+        finally:
+            db.close()
+            os.remove(db_path)
+        return report
+
+    def sweep_temp(self, dry_run=False):
+        report = {"scanned": 0, "deleted": 0, "reclaimed_bytes": 0, "errors": 0}
+        cutoff = time.time() - self.temp_ttl
+        started = time.monotonic()
+        for directory, patterns in self.temp_rules:
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    report["scanned"] += 1
+                    if not any(fnmatch.fnmatch(entry.name, p) for p in patterns):
+                        continue
+                    try:
+                        st = entry.stat()
+                        if st.st_mtime > cutoff:
+                            continue
+                        if not dry_run:
+                            os.remove(entry.path)
+                        report["deleted"] += 1
+                        report["reclaimed_bytes"] += st.st_size
+                    except OSError:
+                        report["errors"] += 1
+                    self._pace(started, report["deleted"] + report["errors"])
+        if self.upload_sessions and not dry_run:
+            report["expired_sessions"] = self.upload_sessions.purge_expired()
+        return report
+
+    def run_once(self, dry_run=False):
+        """One reconcile + sweep pass. Returns the report (None if a run is in progress)."""
+        if not self._run_lock.acquire(blocking=False):
+            return None
+        lock_file = None
+        try:
+            if self.lock_path and fcntl is not None:
+                lock_file = open(self.lock_path, "a")
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None  # another worker process is collecting
+            report = {"started": time.time(), "dry_run": dry_run}
+            if self.migration_checkpoint and not dry_run:
+                report["migration_deletes"] = sweep_pending_deletes(self.migration_checkpoint, self.storage)
+            report["storage"] = self.reconcile_storage(dry_run)
+            report["temp"] = self.sweep_temp(dry_run)
+            report["reclaimed_bytes"] = report["storage"]["reclaimed_bytes"] + report["temp"]["reclaimed_bytes"]
+            report["finished"] = time.time()
+            self.last_report = report
+            return report
+        finally:
+            if lock_file:
+                lock_file.close()
+            self._run_lock.release()
+
+    def start(self, interval):
+        """Run every interval seconds in a daemon thread."""
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    report = self.run_once()
+                    if report:
+                        print(f"GC reclaimed {report['reclaimed_bytes']} bytes")
+                except Exception as e:
+                    print("GC run failed:", e)
+        self._thread = threading.Thread(target=loop, name="garbage-collector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
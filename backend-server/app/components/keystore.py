@@ -0,0 +1,145 @@
+# backend/components/keystore.py
+"""
+Append-only binary keystore for users' Waters11 secret keys.
+
+User records only hold a reference (the record offset); keys are read on
+demand through an mmap of the store file, so they are neither loaded for
+every user at startup nor rewritten with the metadata store.
+
+Record layout (little-endian):
+    magic(2) | kind(1) | owner_len(1) | payload_len(4) | crc32(4) | owner | payload
+
+CryptoComponent serializes keys as base64(objectToBytes(sk)) and objectToBytes
+is itself base64 text, so the payload is normally the doubly-decoded bytes
+(kind 2), about 56% of the stored string. Keys that don't round-trip that way
+are kept as-is (kind 1 / 0).
+
+Several worker processes may append to the same file: appends hold an flock
+and take their reference from the file's real end, not the handle's position.
+"""
+
+import base64
+import binascii
+import mmap
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+KEYS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "keys"))
+KEYSTORE_FILE = os.path.join(KEYS_DIR, "user_keys.bin")
+
+MAGIC = b"\xab\x5c"
+HEADER = struct.Struct("<2sBBII")
+
+
+class KeyStoreError(Exception):
+    pass
+
+
+def _pack_key(sk_b64):
+    """(kind, payload) for a base64 key string, undoing as many base64 layers as round-trip exactly."""
+    try:
+        once = base64.b64decode(sk_b64, validate=True)
+    except (binascii.Error, ValueError):
+        return 0, sk_b64.encode("utf-8")
+    if base64.b64encode(once).decode("ascii") != sk_b64:
+        return 0, sk_b64.encode("utf-8")
+    try:
+        twice = base64.b64decode(once, validate=True)
+        if base64.b64encode(twice) == once:
+            return 2, twice
+    except (binascii.Error, ValueError):
+        pass
+    return 1, once
+
+
+def _unpack_key(kind, payload):
+    if kind == 2:
+        payload = base64.b64encode(payload)
+    if kind >= 1:
+        payload = base64.b64encode(payload)
+    return payload.decode("ascii" if kind else "utf-8")
+
+
+class KeyStore:
+    def __init__(self, path=KEYSTORE_FILE, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._held = 0  # locked() nesting depth in this process
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "ab")
+        self._map = None
+
+    @contextmanager
+    def locked(self):
+        """Hold the store exclusively, against other threads and other processes appending to it."""
+        with self._lock:
+            self._held += 1
+            if self._held == 1 and fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self._held -= 1
+                if self._held == 0 and fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def put(self, owner, sk_b64):
+        """Append a key for owner (a user id); returns its reference."""
+        owner_b = owner.encode("utf-8")
+        kind, payload = _pack_key(sk_b64)
+        header = HEADER.pack(MAGIC, kind, len(owner_b), len(payload), zlib.crc32(payload))
+        with self.locked():
+            # the end as other processes left it; our handle's position may be stale
+            ref = os.fstat(self._file.fileno()).st_size
+            self._file.write(header + owner_b + payload)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        return ref
+
+    def _mapped(self, end):
+        # remap only when the record lies beyond the current mapping (the file only
+        # grows); a replaced map stays valid for readers still holding it
+        with self._lock:
+            if self._map is None or len(self._map) < end:
+                if os.path.getsize(self.path) < end:
+                    raise KeyStoreError("key reference out of range")
+                with open(self.path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map
+
+    def get(self, ref, owner):
+        """Key stored at ref; raises KeyStoreError if the record is missing, corrupt or someone else's."""
+        ref = int(ref)
+        if ref < 0:
+            raise KeyStoreError("key reference out of range")
+        m = self._mapped(ref + HEADER.size)
+        magic, kind, owner_len, size, crc = HEADER.unpack_from(m, ref)
+        if magic != MAGIC:
+            raise KeyStoreError("bad key record")
+        start = ref + HEADER.size
+        m = self._mapped(start + owner_len + size)
+        if m[start:start + owner_len] != owner.encode("utf-8"):
+            raise KeyStoreError("key record belongs to another user")
+        payload = m[start + owner_len:start + owner_len + size]
+        if zlib.crc32(payload) != crc:
+            raise KeyStoreError("key record checksum mismatch")
+        return _unpack_key(kind, payload)
+
+    def size(self):
+        with self._lock:
+            return os.fstat(self._file.fileno()).st_size
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._map = None
@@ -0,0 +1,151 @@
+# backend/components/local_storage_component.py
+"""
+Local-disk stand-in for S3Component.
+
+Same method surface as S3Component, plus presigned GET URLs signed with an
+HMAC secret so the direct-download flow can be exercised offline. The server
+verifies those URLs on its /storage route (see verify_signature).
+"""
+
+import hashlib
+import hmac
+import os
+import shutil
+import time
+from urllib.parse import quote
+
+from Crypto.Random import get_random_bytes
+
+KEYS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "keys"))
+URL_SECRET_FILE = os.path.join(KEYS_DIR, "storage_url_secret.bin")
+
+
+def _load_secret(path):
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    secret = get_random_bytes(32)
+    with open(path, "wb") as f:
+        f.write(secret)
+    return secret
+
+
+class LocalStorageComponent:
+    def __init__(self, root_dir, secret_path=URL_SECRET_FILE, url_prefix="/storage"):
+        self.root = os.path.abspath(root_dir)
+        self.url_prefix = url_prefix
+        self._secret = _load_secret(secret_path)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"invalid storage key: {key}")
+        return path
+
+    def upload_file(self, local_path, key):
+        try:
+            dest = self._path(key)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(local_path, dest + ".part")
+            os.replace(dest + ".part", dest)
+            return True
+        except (OSError, ValueError) as e:
+            print("Local storage upload error:", e)
+            return False
+
+    def download_file(self, key, local_path):
+        try:
+            shutil.copyfile(self._path(key), local_path)
+            return True
+        except (OSError, ValueError) as e:
+            print("Local storage download error:", e)
+            return False
+
+    def delete_file(self, key):
+        try:
+            os.remove(self._path(key))
+            return True
+        except (OSError, ValueError) as e:
+            print("Local storage delete error:", e)
+            return False
+
+    def put_bytes(self, key, data):
+        try:
+            dest = self._path(key)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest + ".part", "wb") as f:
+                f.write(data)
+            os.replace(dest + ".part", dest)
+            return True
+        except (OSError, ValueError) as e:
+            print("Local storage put error:", e)
+            return False
+
+    def get_bytes(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except (OSError, ValueError) as e:
+            print("Local storage get error:", e)
+            return None
+
+    def stat_object(self, key):
+        """(size, last_modified_epoch) of an object, or None if it doesn't exist."""
+        try:
+            st = os.stat(self._path(key))
+            return st.st_size, st.st_mtime
+        except (OSError, ValueError):
+            return None
+
+    def list_objects(self, prefix="", page_size=1000):
+        """Yield pages of (key, size, last_modified_epoch) tuples, like S3Component."""
+        page = []
+        # start at the deepest directory the prefix names rather than walking the whole root
+        stack = [os.path.join(self.root, *prefix.split("/")[:-1])]
+        if not os.path.isdir(stack[0]):
+            return
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    key = os.path.relpath(entry.path, self.root).replace(os.sep, "/")
+                    if not key.startswith(prefix):
+                        continue
+                    st = entry.stat()
+                    page.append((key, st.st_size, st.st_mtime))
+                    if len(page) >= page_size:
+                        yield page
+                        page = []
+        if page:
+            yield page
+
+    # ---------- Signed URLs ----------
+    def _sign(self, key, expires):
+        msg = f"{key}\n{expires}".encode("utf-8")
+        return hmac.new(self._secret, msg, hashlib.sha256).hexdigest()
+
+    def presign_get(self, key, expires_in=300):
+        """Return a relative URL valid for expires_in seconds."""
+        expires = int(time.time()) + int(expires_in)
+        return f"{self.url_prefix}/{quote(key)}?expires={expires}&sig={self._sign(key, expires)}"
+
+    def verify_signature(self, key, expires, sig):
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._sign(key, expires), sig or "")
+
+    def local_path(self, key):
+        """Filesystem path of an object, or None if it does not exist."""
+        try:
+            path = self._path(key)
+        except ValueError:
+            return None
+        return path if os.path.isfile(path) else None
@@ -0,0 +1,1104 @@
+# backend/components/metadata_store.py
+"""
+Metadata stores behind UserComponent / FileComponent.
+
+- JsonMetadataStore:   the original db.json document plus an append-only
+                       journal, with in-memory secondary indexes on files.
+- SQLiteMetadataStore: transactional SQLite (WAL) with indexed tables for
+                       users, files, context policies and dedupe chunks; each
+                       mutation touches only its own rows.
+
+Both expose the same record-level API and return plain dicts shaped like the
+old db.json entries, so callers don't care which one is configured
+(METADATA_BACKEND=sqlite|json).
+"""
+
+import bisect
+import collections
+import heapq
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .policy_compiler import POLICY_ATTRIBUTE_ALIASES, policy_attributes
+
+DB_PATH = "db.json"
+SQLITE_PATH = "metadata.db"
+# Serializes mutate+save across request and background threads
+DB_LOCK = threading.RLock()
+# Group commit: how long the writer waits to fill a batch, and its max size
+GROUP_COMMIT_WINDOW = float(os.environ.get("METADATA_COMMIT_WINDOW_MS", "2")) / 1000.0
+GROUP_COMMIT_MAX = 256
+# Commit durability: fsync per commit ("commit": the JSON journal is fsynced,
+# SQLite runs synchronous=FULL) or leave it to the OS ("none"), and the JSON
+# journal size that triggers compaction into a new db.json snapshot
+JOURNAL_FSYNC = os.environ.get("METADATA_FSYNC", "commit")
+JOURNAL_MAX_BYTES = int(os.environ.get("METADATA_JOURNAL_MAX_BYTES", str(8 * 1024 * 1024)))
+# Cross-process coordination (prefork workers): how long a writer waits for the
+# database lock, and how many change-feed entries are kept for incremental refresh
+LOCK_TIMEOUT = float(os.environ.get("METADATA_LOCK_TIMEOUT", "30"))
+CHANGE_LOG_KEEP = 10000
+
+
+def load_db():
+    if not os.path.exists(DB_PATH):
+        with open(DB_PATH, "w") as f:
+            json.dump({"users": {}, "files": {}}, f)
+    with open(DB_PATH, "r") as f:
+        return json.load(f)
+
+
+class GroupCommitter:
+    """
+    Writer thread that batches mutations from concurrent callers into one
+    commit (group commit). submit() blocks until the batch holding the
+    mutation is committed (durable, with METADATA_FSYNC=commit), then returns
+    the mutation's result or raises its error.
+    """
+
+    def __init__(self, apply_batch, window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX):
+        self.apply_batch = apply_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.commits = 0
+        self.mutations = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="metadata-group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn):
+        fut = Future()
+        self._queue.put((fn, fut))
+        return fut.result()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    nxt = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._queue.put(None)
+                    break
+                batch.append(nxt)
+            try:
+                outcomes = self.apply_batch([fn for fn, _ in batch])
+            except BaseException as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            self.commits += 1
+            self.mutations += len(batch)
+            for (_, fut), outcome in zip(batch, outcomes):
+                if outcome.exception() is not None:
+                    fut.set_exception(outcome.exception())
+                else:
+                    fut.set_result(outcome.result())
+
+    def stats(self):
+        return {"commits": self.commits, "mutations": self.mutations,
+                "avg_batch": round(self.mutations / self.commits, 2) if self.commits else 0.0}
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+def _run_mutation(fn, *args):
+    """Run one mutation, capturing its result or exception in a resolved Future."""
+    out = Future()
+    try:
+        out.set_result(fn(*args))
+    except Exception as e:
+        out.set_exception(e)
+    return out
+
+
+def _journal_path(gen):
+    return f"{DB_PATH}.journal.{gen}"
+
+
+def _journal_line(op):
+    body = json.dumps(op, separators=(",", ":"))
+    return f"{zlib.crc32(body.encode('utf-8')):08x} {body}\n"
+
+
+def _apply_op(db, op):
+    section = db.setdefault(op["s"], {})
+    if op.get("d"):
+        section.pop(op["k"], None)
+    else:
+        section[op["k"]] = op["v"]
+
+
+def _parse_journal_line(raw):
+    """The op in one raw journal line, or None if it is torn or corrupt."""
+    line = raw.decode("utf-8", "replace")
+    crc, _, body = line.rstrip("\n").partition(" ")
+    if not raw.endswith(b"\n") or not body or f"{zlib.crc32(body.encode('utf-8')):08x}" != crc:
+        return None
+    return json.loads(body)
+
+
+def replay_journal(db, path):
+    """Apply every intact journal entry in path to db. A torn or corrupt tail
+    (crash mid-append) is cut off. Returns the number of entries applied."""
+    if not os.path.exists(path):
+        return 0
+    applied = 0
+    good_end = 0
+    with open(path, "rb") as f:
+        for raw in f:
+            op = _parse_journal_line(raw)
+            if op is None:
+                break
+            _apply_op(db, op)
+            applied += 1
+            good_end += len(raw)
+    if good_end < os.path.getsize(path):
+        print(f"Journal {path}: dropping corrupt tail after {applied} entries")
+        with open(path, "r+b") as f:
+            f.truncate(good_end)
+    return applied
+
+
+def _journal_gens():
+    prefix = os.path.basename(DB_PATH) + ".journal."
+    folder = os.path.dirname(os.path.abspath(DB_PATH))
+    return sorted(int(n[len(prefix):]) for n in os.listdir(folder)
+                  if n.startswith(prefix) and n[len(prefix):].isdigit())
+
+
+@contextmanager
+def _file_lock(f, exclusive):
+    """flock on f across processes (no-op where fcntl is unavailable). Callers
+    must also hold DB_LOCK: flock is per open file, not per thread."""
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def load_json_state():
+    """db.json snapshot plus every journal generation not yet folded into it."""
+    db = load_db()
+    for section in ("users", "files", "chunks"):
+        db.setdefault(section, {})
+    base = db.get("journal_gen", 0)
+    for gen in _journal_gens():
+        if gen >= base:
+            replay_journal(db, _journal_path(gen))
+    return db
+
+
+def _sort_key(rec):
+    return (rec.get("created") or "", rec["id"])
+
+
+class FileIndex:
+    """
+    Secondary indexes over file records kept in memory by the JSON store:
+    uploader -> [(created, id)], policy attribute -> [(created, id)], exact
+    policy string -> [(created, id)] and a global [(created, id)] list, all
+    sorted so queries walk newest-first from a bisect position instead of
+    scanning every record.
+    """
+
+    def __init__(self, files=()):
+        self.lock = threading.RLock()
+        self.by_created = []
+        self.by_uploader = {}
+        self.by_attribute = {}
+        self.by_policy = {}
+        self._entries = {}
+        for rec in files:
+            self.add(rec)
+
+    def _postings(self, uploader, attrs, policy):
+        lists = [self.by_created]
+        if uploader is not None:
+            lists.append(self.by_uploader.setdefault(uploader, []))
+        lists.extend(self.by_attribute.setdefault(a, []) for a in attrs)
+        if policy is not None:
+            lists.append(self.by_policy.setdefault(policy, []))
+        return lists
+
+    def add(self, rec):
+        with self.lock:
+            self.remove(rec["id"])
+            key = _sort_key(rec)
+            attrs = policy_attributes(rec.get("policy"))
+            self._entries[rec["id"]] = (key, rec.get("uploader"), attrs, rec.get("policy"))
+            for lst in self._postings(rec.get("uploader"), attrs, rec.get("policy")):
+                bisect.insort(lst, key)
+
+    def remove(self, fid):
+        with self.lock:
+            entry = self._entries.pop(fid, None)
+            if not entry:
+                return
+            key, uploader, attrs, policy = entry
+            for lst in self._postings(uploader, attrs, policy):
+                i = bisect.bisect_left(lst, key)
+                if i < len(lst) and lst[i] == key:
+                    del lst[i]
+            if uploader is not None and not self.by_uploader[uploader]:
+                del self.by_uploader[uploader]
+            for a in attrs:
+                if not self.by_attribute[a]:
+                    del self.by_attribute[a]
+            if policy is not None and not self.by_policy[policy]:
+                del self.by_policy[policy]
+
+    def policies(self):
+        with self.lock:
+            return sorted(self.by_policy)
+
+    def walk(self, uploader=None, attributes=(), created_from=None, created_to=None, after=None,
+             policies=None, batch=256):
+        """
+        Yield (created, id) newest-first from the smallest applicable posting
+        list. Candidates still need the remaining filters applied by the caller.
+        The list is copied out in small batches, so writers are never blocked
+        for long and a page costs O(limit), not O(records).
+
+        policies (exact policy strings) competes as one candidate list of the
+        summed size; when it is the smallest, its lists are merged newest-first.
+        """
+        if policies is not None:
+            with self.lock:
+                others = [len(self.by_uploader.get(uploader, []))] if uploader is not None else []
+                others.extend(len(self.by_attribute.get(a, [])) for a in attributes)
+                size = sum(len(self.by_policy.get(p, [])) for p in policies)
+            if size < min(others, default=len(self.by_created)):
+                yield from heapq.merge(*(self._walk(lambda p=p: self.by_policy.get(p, []), created_from,
+                                                    created_to, after, batch) for p in policies), reverse=True)
+                return
+        def pick():
+            lists = []
+            if uploader is not None:
+                lists.append(self.by_uploader.get(uploader, []))
+            lists.extend(self.by_attribute.get(a, []) for a in attributes)
+            return min(lists, key=len) if lists else self.by_created
+        yield from self._walk(pick, created_from, created_to, after, batch)
+
+    def _walk(self, pick, created_from, created_to, after, batch):
+        bound = tuple(after) if after is not None else None
+        while True:
+            with self.lock:
+                lst = pick()
+                hi = bisect.bisect_left(lst, bound) if bound is not None else len(lst)
+                if created_to is not None:
+                    hi = min(hi, bisect.bisect_right(lst, (created_to, "\U0010ffff")))
+                start = bisect.bisect_left(lst, (created_from, "")) if created_from is not None else 0
+                lo = max(start, hi - batch)
+                chunk = lst[lo:hi]
+            yield from reversed(chunk)
+            if lo <= start or not chunk:
+                return
+            bound = chunk[0]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "files": len(self.by_created),
+                "uploaders": {u: len(v) for u, v in self.by_uploader.items()},
+                "attributes": {a: len(v) for a, v in self.by_attribute.items()},
+            }
+
+
+class JsonMetadataStore:
+    """
+    db.json snapshot + append-only, checksummed mutation journal.
+
+    Each commit batch appends one line per changed record to db.json.journal.<gen>
+    (O(record), not O(document)). On startup the snapshot is loaded and newer
+    journal generations are replayed. A background compactor folds the journal
+    into a fresh snapshot once it exceeds JOURNAL_MAX_BYTES, which bounds
+    recovery time.
+
+    Several processes may share the files: commits and compaction hold an
+    exclusive flock on db.json.lock and first apply whatever other processes
+    appended (tail-follow), so mutations always run against the latest state.
+    Reads check the journal size with one fstat and only catch up when it grew.
+    """
+
+    def __init__(self, fsync=JOURNAL_FSYNC, journal_max_bytes=JOURNAL_MAX_BYTES):
+        self.fsync = fsync
+        self.journal_max_bytes = journal_max_bytes
+        self._lockfile = open(DB_PATH + ".lock", "a")
+        self._journal = None
+        self._reader = None
+        self._changes = collections.deque(maxlen=CHANGE_LOG_KEEP)
+        self._change_seq = 0
+        self._resync_seq = 0
+        with DB_LOCK, _file_lock(self._lockfile, exclusive=False):
+            self._reload()
+        self._pending = []
+        self._compact_wanted = threading.Event()
+        self._closed = False
+        self._compactor = threading.Thread(target=self._compact_loop, name="metadata-compactor", daemon=True)
+        self._compactor.start()
+        self.committer = GroupCommitter(self._apply_batch)
+
+    # ---------- Cross-process view ----------
+    def _open_gen(self, gen, pos):
+        for f in (self._journal, self._reader):
+            if f:
+                f.close()
+        self.gen = gen
+        self._journal = open(_journal_path(gen), "ab")
+        self._reader = open(_journal_path(gen), "rb")
+        self._read_pos = pos
+
+    def _reload(self):
+        """Full load from disk (startup, or after missing a whole journal generation)."""
+        self.db = load_json_state()
+        self.index = FileIndex(self.db["files"].values())
+        gen = max(_journal_gens() + [self.db.get("journal_gen", 0)])
+        path = _journal_path(gen)
+        self._open_gen(gen, os.path.getsize(path) if os.path.exists(path) else 0)
+        self._change_seq += 1
+        self._resync_seq = self._change_seq
+
+    def _note_change(self, section, key):
+        if section in ("users", "files"):
+            self._change_seq += 1
+            self._changes.append((self._change_seq, section, key))
+
+    def _apply_remote(self, op):
+        _apply_op(self.db, op)
+        if op["s"] == "files":
+            if op.get("d"):
+                self.index.remove(op["k"])
+            else:
+                self.index.add(op["v"])
+        self._note_change(op["s"], op["k"])
+
+    def _stale(self):
+        try:
+            st = os.fstat(self._reader.fileno())
+        except (OSError, ValueError):
+            return True  # reader being swapped by the writer thread
+        # grew, or was compacted away (unlinked) by another process
+        return st.st_size != self._read_pos or st.st_nlink == 0
+
+    def _follow(self):
+        """Apply entries other processes appended since we last looked, moving
+        on to newer journal generations. Caller holds DB_LOCK and the flock."""
+        while True:
+            self._reader.seek(self._read_pos)
+            for raw in self._reader.read().splitlines(keepends=True):
+                op = _parse_journal_line(raw)
+                if op is None:
+                    break
+                self._apply_remote(op)
+                self._read_pos += len(raw)
+            if os.fstat(self._reader.fileno()).st_nlink:
+                return
+            if not os.path.exists(_journal_path(self.gen + 1)):
+                # the next generation was compacted away too; rebuild from the snapshot
+                self._reload()
+                return
+            self._open_gen(self.gen + 1, 0)
+
+    def _refresh(self):
+        if self._stale():
+            with DB_LOCK, _file_lock(self._lockfile, exclusive=False):
+                self._follow()
+
+    def changes_since(self, seq):
+        """
+        (head, changes) where changes lists the (section, key) of users/files
+        modified after seq, by this or any other process. changes is None when
+        seq is unknown or too old; the caller should then reload everything.
+        """
+        self._refresh()
+        with DB_LOCK:
+            head = self._change_seq
+            if seq == head:
+                return head, []
+            if seq is None or seq < self._resync_seq or not self._changes or seq < self._changes[0][0] - 1:
+                return head, None
+            return head, [(section, key) for n, section, key in self._changes if n > seq]
+
+    # ---------- Journal ----------
+    def _set(self, section, key, value):
+        self.db[section][key] = value
+        if section == "files":
+            self.index.add(value)
+        self._note_change(section, key)
+        self._pending.append({"s": section, "k": key, "v": value})
+
+    def _delete(self, section, key):
+        self.db[section].pop(key, None)
+        if section == "files":
+            self.index.remove(key)
+        self._note_change(section, key)
+        self._pending.append({"s": section, "k": key, "d": 1})
+
+    def _apply_batch(self, fns):
+        with DB_LOCK, _file_lock(self._lockfile, exclusive=True):
+            self._follow()
+            self._pending = []
+            outcomes = [_run_mutation(fn) for fn in fns]
+            if self._pending:
+                self._journal.write("".join(_journal_line(op) for op in self._pending).encode("utf-8"))
+                self._journal.flush()
+                if self.fsync == "commit":
+                    os.fsync(self._journal.fileno())
+                # our own entries are already applied
+                self._read_pos = self._journal.tell()
+                if self._read_pos >= self.journal_max_bytes:
+                    self._compact_wanted.set()
+        return outcomes
+
+    def _write(self, fn):
+        return self.committer.submit(fn)
+
+    def compact(self, force=True):
+        """Fold the current journal into a new db.json snapshot."""
+        with DB_LOCK, _file_lock(self._lockfile, exclusive=True):
+            self._follow()
+            if not force and self._read_pos < self.journal_max_bytes:
+                return  # another process compacted already
+            # switch to a fresh journal generation; the snapshot covers everything before it
+            old_gen = self.gen
+            self._open_gen(self.gen + 1, 0)
+            self.db["journal_gen"] = self.gen
+            snapshot = json.dumps(self.db)
+            tmp = DB_PATH + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, DB_PATH)
+            for gen in _journal_gens():
+                if gen <= old_gen and os.path.exists(_journal_path(gen)):
+                    os.remove(_journal_path(gen))
+
+    def _compact_loop(self):
+        while True:
+            self._compact_wanted.wait()
+            self._compact_wanted.clear()
+            if self._closed:
+                return
+            try:
+                self.compact(force=False)
+            except Exception as e:
+                print("Metadata journal compaction failed:", e)
+
+    # ---------- Users ----------
+    def create_user(self, username, record):
+        def mutate():
+            if username in self.db["users"]:
+                return False
+            self._set("users", username, record)
+            return True
+        return self._write(mutate)
+
+    def update_user(self, username, fields):
+        def mutate():
+            if username not in self.db["users"]:
+                return False
+            self._set("users", username, {**self.db["users"][username], **fields})
+            return True
+        return self._write(mutate)
+
+    def get_user(self, username):
+        self._refresh()
+        return self.db["users"].get(username)
+
+    def list_usernames(self):
+        self._refresh()
+        return list(self.db["users"].keys())
+
+    # ---------- Files ----------
+    def put_file(self, fid, record):
+        self._write(lambda: self._set("files", fid, record))
+
+    def put_files(self, records):
+        """Insert or replace many records in one commit."""
+        def mutate():
+            for rec in records:
+                self._set("files", rec["id"], rec)
+        self._write(mutate)
+
+    def update_file(self, fid, fields, expect=None):
+        """Merge fields into a record; with expect, only if those fields still match."""
+        def mutate():
+            rec = self.db["files"].get(fid)
+            if not rec:
+                return False
+            if expect and any(rec.get(k) != v for k, v in expect.items()):
+                return False
+            # swap in a new dict so readers see the old or new record, never a mix
+            self._set("files", fid, {**rec, **fields})
+            return True
+        return self._write(mutate)
+
+    def set_context_policy(self, fid, policy):
+        return self.update_file(fid, {"context_policy": policy})
+
+    def delete_file(self, fid):
+        def mutate():
+            if fid not in self.db["files"]:
+                return False
+            self._delete("files", fid)
+            return True
+        return self._write(mutate)
+
+    def get_file(self, fid):
+        self._refresh()
+        return self.db["files"].get(fid)
+
+    def list_files(self):
+        self._refresh()
+        return list(self.db["files"].values())
+
+    def list_context_policies(self):
+        self._refresh()
+        return {fid: rec["context_policy"] for fid, rec in list(self.db["files"].items())
+                if rec.get("context_policy")}
+
+    def list_policies(self):
+        self._refresh()
+        return self.index.policies()
+
+    def query_files(self, uploader=None, created_from=None, created_to=None, name_prefix=None,
+                    attributes=(), after=None, limit=50, include_crypto=False, policies=None):
+        """Newest-first page of matching files (see SQLiteMetadataStore.query_files)."""
+        self._refresh()
+        attributes = [POLICY_ATTRIBUTE_ALIASES.get(a.lower(), a.lower()) for a in attributes]
+        allowed = set(policies) if policies is not None else None
+        rows = []
+        for _, fid in self.index.walk(uploader, attributes, created_from, created_to, after, policies=allowed):
+            rec = self.db["files"].get(fid)
+            if not rec or not _match_file(rec, uploader, created_from, created_to, name_prefix):
+                continue
+            if allowed is not None and rec.get("policy") not in allowed:
+                continue
+            if attributes and not set(attributes) <= set(policy_attributes(rec.get("policy"))):
+                continue
+            rows.append(rec)
+            if len(rows) >= int(limit):
+                break
+        return rows
+
+    def file_index_stats(self):
+        self._refresh()
+        return self.index.stats()
+
+    # ---------- Dedupe chunks ----------
+    def has_chunk(self, chunk_id):
+        self._refresh()
+        return chunk_id in self.db["chunks"]
+
+    def add_chunks(self, chunk_ids, new_chunks=None):
+        now = time.time()
+        def mutate():
+            touched = {}
+            for cid, size in (new_chunks or {}).items():
+                if cid not in self.db["chunks"]:
+                    touched[cid] = {"size": size}
+            for cid in chunk_ids:
+                entry = touched.get(cid) or self.db["chunks"].get(cid)
+                if entry:
+                    touched[cid] = {"size": entry["size"], "seen": now}
+            for cid, entry in touched.items():
+                self._set("chunks", cid, entry)
+        self._write(mutate)
+
+    def touch_chunks(self, chunk_ids, at):
+        """Record a dedupe hit on chunks (their last_seen, read by the garbage collector)."""
+        def mutate():
+            for cid in chunk_ids:
+                entry = self.db["chunks"].get(cid)
+                if entry and entry.get("seen", 0) < at:
+                    self._set("chunks", cid, {**entry, "seen": at})
+        self._write(mutate)
+
+    def chunk_last_seen(self, chunk_id):
+        self._refresh()
+        return (self.db["chunks"].get(chunk_id) or {}).get("seen", 0)
+
+    def drop_chunks(self, chunk_ids):
+        def mutate():
+            for cid in chunk_ids:
+                self._delete("chunks", cid)
+        self._write(mutate)
+
+    def close(self):
+        self.committer.close()
+        self._closed = True
+        self._compact_wanted.set()
+        with DB_LOCK:
+            self._journal.close()
+            self._reader.close()
+            self._lockfile.close()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    id       TEXT NOT NULL,
+    created  TEXT,
+    data     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id           TEXT PRIMARY KEY,
+    uploader     TEXT,
+    display_name TEXT,
+    created      TEXT,
+    policy       TEXT,
+    s3_key       TEXT,
+    data         TEXT NOT NULL,
+    crypto       TEXT
+);
+CREATE INDEX IF NOT EXISTS files_uploader_created ON files(uploader, created, id);
+CREATE INDEX IF NOT EXISTS files_created ON files(created, id);
+CREATE INDEX IF NOT EXISTS files_s3_key ON files(s3_key);
+CREATE INDEX IF NOT EXISTS files_name ON files(display_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS files_policy_created ON files(policy, created, id);
+CREATE TABLE IF NOT EXISTS file_attributes (
+    attr    TEXT NOT NULL,
+    created TEXT NOT NULL,
+    file_id TEXT NOT NULL REFERENCES files(id),
+    PRIMARY KEY (attr, created, file_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS file_attributes_file ON file_attributes(file_id);
+CREATE TABLE IF NOT EXISTS context_policies (
+    file_id TEXT PRIMARY KEY REFERENCES files(id),
+    policy  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    id   TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_seen REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq     INTEGER PRIMARY KEY AUTOINCREMENT,
+    section TEXT NOT NULL,
+    key     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# record fields kept in their own columns (and indexed) besides the JSON body
+FILE_COLUMNS = ("uploader", "display_name", "created", "policy", "s3_key")
+# multi-KB crypto envelopes, stored apart so listings never have to parse them
+CRYPTO_FIELDS = ("abe_ct", "manifest_ct", "chunks")
+FILE_SELECT = "SELECT f.data, p.policy, f.crypto FROM files f LEFT JOIN context_policies p ON p.file_id = f.id "
+
+
+def _match_file(rec, uploader, created_from, created_to, name_prefix):
+    """Filter shared by in-memory file queries."""
+    if uploader is not None and rec.get("uploader") != uploader:
+        return False
+    created = rec.get("created") or ""
+    if created_from is not None and created < created_from:
+        return False
+    if created_to is not None and created > created_to:
+        return False
+    if name_prefix and not (rec.get("display_name") or "").lower().startswith(name_prefix.lower()):
+        return False
+    return True
+
+
+class SQLiteMetadataStore:
+    """
+    SQLite-backed store; WAL mode so readers never block the writer.
+    All writes go through one writer connection owned by a GroupCommitter;
+    reads use a separate connection and only ever see committed data.
+    """
+
+    def __init__(self, path=SQLITE_PATH, import_from=DB_PATH, fsync=JOURNAL_FSYNC):
+        self.path = path
+        self._lock = threading.RLock()
+        self.wconn = self._connect()
+        # WAL under NORMAL doesn't sync on commit; FULL makes a group commit the one fsync it amortizes
+        self.wconn.execute("PRAGMA synchronous=FULL" if fsync == "commit" else "PRAGMA synchronous=NORMAL")
+        self.wconn.executescript(SCHEMA)
+        self.conn = self._connect()
+        # change-feed cursor of the read connection (see changes_since)
+        self._data_version = None
+        self._head_seq = 0
+        self._batches = 0
+        self.committer = GroupCommitter(self._apply_batch)
+        if import_from and os.path.exists(import_from) and not self._meta("imported_from"):
+            import_json_db(import_from, self)
+
+    # ---------- Helpers ----------
+    def _meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _connect(self):
+        # timeout: wait for other worker processes' write transactions instead of failing
+        conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _apply_batch(self, fns):
+        """One transaction per batch; each mutation in its own savepoint so a
+        failing one is rolled back alone."""
+        conn = self.wconn
+        outcomes = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for fn in fns:
+                conn.execute("SAVEPOINT m")
+                out = _run_mutation(fn, conn)
+                if out.exception() is not None:
+                    conn.execute("ROLLBACK TO m")
+                conn.execute("RELEASE m")
+                outcomes.append(out)
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        self._batches += 1
+        if self._batches % 256 == 0:
+            conn.execute("DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?", (CHANGE_LOG_KEEP,))
+        return outcomes
+
+    @staticmethod
+    def _note_change(conn, section, key):
+        conn.execute("INSERT INTO changes (section, key) VALUES (?, ?)", (section, key))
+
+    def changes_since(self, seq):
+        """
+        (head, changes) where changes lists the (section, key) of users/files
+        modified after seq by any process sharing the database. changes is None
+        when seq is unknown or older than the retained log; the caller should
+        then reload everything. PRAGMA data_version makes the no-change case a
+        single cheap query.
+        """
+        with self._lock:
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version:
+                self._head_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+                self._data_version = version
+            head = self._head_seq
+            if seq == head:
+                return head, []
+            if seq is None or seq > head:
+                return head, None
+            rows = self.conn.execute("SELECT seq, section, key FROM changes WHERE seq > ? ORDER BY seq",
+                                     (seq,)).fetchall()
+            oldest = self.conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+        if oldest is None or oldest > seq + 1:
+            return head, None
+        return head, [(section, key) for _, section, key in rows if _ <= head]
+
+    def _write(self, fn):
+        """Run fn(conn) in the next group commit; returns once it is committed."""
+        return self.committer.submit(fn)
+
+    def _read(self, sql, args=()):
+        with self._lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    @staticmethod
+    def _file_row(record):
+        body = {k: v for k, v in record.items() if k != "context_policy" and k not in CRYPTO_FIELDS}
+        crypto = {k: record[k] for k in CRYPTO_FIELDS if k in record}
+        return tuple(record.get(c) for c in FILE_COLUMNS) + (json.dumps(body), json.dumps(crypto))
+
+    @staticmethod
+    def _file_from_row(data, policy, crypto=None):
+        rec = json.loads(data)
+        if crypto:
+            rec.update(json.loads(crypto))
+        rec["context_policy"] = json.loads(policy) if policy else {}
+        return rec
+
+    # ---------- Users ----------
+    def create_user(self, username, record):
+        def tx(conn):
+            try:
+                conn.execute("INSERT INTO users (username, id, created, data) VALUES (?, ?, ?, ?)",
+                             (username, record["id"], record.get("created"), json.dumps(record)))
+                self._note_change(conn, "users", username)
+                return True
+            except sqlite3.IntegrityError:
+                return False
+        return self._write(tx)
+
+    def update_user(self, username, fields):
+        def tx(conn):
+            row = conn.execute("SELECT data FROM users WHERE username = ?", (username,)).fetchone()
+            if not row:
+                return False
+            conn.execute("UPDATE users SET data = ? WHERE username = ?",
+                         (json.dumps({**json.loads(row[0]), **fields}), username))
+            self._note_change(conn, "users", username)
+            return True
+        return self._write(tx)
+
+    def get_user(self, username):
+        rows = self._read("SELECT data FROM users WHERE username = ?", (username,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def list_usernames(self):
+        return [r[0] for r in self._read("SELECT username FROM users ORDER BY username")]
+
+    # ---------- Files ----------
+    def _put_file(self, conn, fid, record):
+        conn.execute(
+            "INSERT INTO files (uploader, display_name, created, policy, s3_key, data, crypto, id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+            "uploader = excluded.uploader, display_name = excluded.display_name, created = excluded.created, "
+            "policy = excluded.policy, s3_key = excluded.s3_key, data = excluded.data, crypto = excluded.crypto",
+            self._file_row(record) + (fid,),
+        )
+        conn.execute("DELETE FROM file_attributes WHERE file_id = ?", (fid,))
+        conn.executemany("INSERT INTO file_attributes (attr, created, file_id) VALUES (?, ?, ?)",
+                         [(a, record.get("created") or "", fid) for a in policy_attributes(record.get("policy"))])
+        self._put_context_policy(conn, fid, record.get("context_policy"))
+        self._note_change(conn, "files", fid)
+
+    @staticmethod
+    def _put_context_policy(conn, fid, policy):
+        if policy:
+            conn.execute("INSERT OR REPLACE INTO context_policies (file_id, policy) VALUES (?, ?)",
+                         (fid, json.dumps(policy)))
+        else:
+            conn.execute("DELETE FROM context_policies WHERE file_id = ?", (fid,))
+
+    def put_file(self, fid, record):
+        self._write(lambda conn: self._put_file(conn, fid, record))
+
+    def put_files(self, records):
+        """Insert or replace many records in one transaction."""
+        def tx(conn):
+            for rec in records:
+                self._put_file(conn, rec["id"], rec)
+        self._write(tx)
+
+    def update_file(self, fid, fields, expect=None):
+        """Merge fields into a record; with expect, only if those fields still match."""
+        def tx(conn):
+            row = conn.execute(FILE_SELECT + "WHERE f.id = ?", (fid,)).fetchone()
+            if not row:
+                return False
+            rec = self._file_from_row(*row)
+            if expect and any(rec.get(k) != v for k, v in expect.items()):
+                return False
+            rec.update(fields)
+            self._put_file(conn, fid, rec)
+            return True
+        return self._write(tx)
+
+    def set_context_policy(self, fid, policy):
+        def tx(conn):
+            if not conn.execute("SELECT 1 FROM files WHERE id = ?", (fid,)).fetchone():
+                return False
+            self._put_context_policy(conn, fid, policy)
+            self._note_change(conn, "files", fid)
+            return True
+        return self._write(tx)
+
+    def delete_file(self, fid):
+        def tx(conn):
+            conn.execute("DELETE FROM file_attributes WHERE file_id = ?", (fid,))
+            conn.execute("DELETE FROM context_policies WHERE file_id = ?", (fid,))
+            if not conn.execute("DELETE FROM files WHERE id = ?", (fid,)).rowcount:
+                return False
+            self._note_change(conn, "files", fid)
+            return True
+        return self._write(tx)
+
+    def get_file(self, fid):
+        rows = self._read(FILE_SELECT + "WHERE f.id = ?", (fid,))
+        return self._file_from_row(*rows[0]) if rows else None
+
+    def list_files(self):
+        rows = self._read(FILE_SELECT + "ORDER BY f.created, f.id")
+        return [self._file_from_row(*r) for r in rows]
+
+    def list_context_policies(self):
+        return {fid: json.loads(policy) for fid, policy in self._read("SELECT file_id, policy FROM context_policies")}
+
+    def list_policies(self):
+        """Distinct file policies, one index seek each (files_policy_created)."""
+        policies, last = [], None
+        while True:
+            if last is None:
+                row = self._read("SELECT MIN(policy) FROM files")
+            else:
+                row = self._read("SELECT MIN(policy) FROM files WHERE policy > ?", (last,))
+            last = row[0][0]
+            if last is None:
+                return policies
+            policies.append(last)
+
+    def query_files(self, uploader=None, created_from=None, created_to=None, name_prefix=None,
+                    attributes=(), after=None, limit=50, include_crypto=False, policies=None):
+        """
+        Newest-first page of files matching the filters. after is the
+        (created, id) of the last row of the previous page (keyset pagination).
+        attributes restricts to files whose policy mentions all of them; the
+        first one drives the scan through file_attributes. policies restricts
+        to files whose policy string is one of the given ones.
+        """
+        if policies is not None and len(policies) != 1:
+            # one index-ordered scan per policy (files_policy_created), merged;
+            # a single IN (...) query would sort every matching row instead
+            pages = [self.query_files(uploader, created_from, created_to, name_prefix, attributes,
+                                      after, limit, include_crypto, policies=[p]) for p in policies]
+            return list(itertools.islice(heapq.merge(*pages, key=_sort_key, reverse=True), int(limit)))
+        attributes = [POLICY_ATTRIBUTE_ALIASES.get(a.lower(), a.lower()) for a in attributes]
+        columns = "f.data, p.policy" + (", f.crypto" if include_crypto else "")
+        if attributes:
+            source = ("FROM file_attributes a JOIN files f ON f.id = a.file_id "
+                      "LEFT JOIN context_policies p ON p.file_id = f.id ")
+            created, fid = "a.created", "a.file_id"
+            where, args = ["a.attr = ?"], [attributes[0]]
+            for attr in attributes[1:]:
+                where.append("EXISTS (SELECT 1 FROM file_attributes x WHERE x.attr = ? AND x.file_id = f.id)")
+                args.append(attr)
+        else:
+            source = "FROM files f LEFT JOIN context_policies p ON p.file_id = f.id "
+            created, fid = "f.created", "f.id"
+            where, args = [], []
+        if uploader is not None:
+            where.append("f.uploader = ?")
+            args.append(uploader)
+        if policies is not None:
+            where.append("f.policy = ?")
+            args.append(next(iter(policies)))
+        if created_from is not None:
+            where.append(f"{created} >= ?")
+            args.append(created_from)
+        if created_to is not None:
+            where.append(f"{created} <= ?")
+            args.append(created_to)
+        if name_prefix:
+            escaped = name_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            # the range lets SQLite walk files_name; LIKE keeps the match exact
+            where.append("f.display_name COLLATE NOCASE >= ? AND f.display_name COLLATE NOCASE < ? "
+                         "AND f.display_name LIKE ? ESCAPE '\\'")
+            args.extend([name_prefix, name_prefix + "\U0010ffff", escaped + "%"])
+        if after is not None:
+            where.append(f"({created}, {fid}) < (?, ?)")
+            args.extend(after)
+        sql = f"SELECT {columns} {source}"
+        if where:
+            sql += "WHERE " + " AND ".join(where) + " "
+        sql += f"ORDER BY {created} DESC, {fid} DESC LIMIT ?"
+        args.append(int(limit))
+        return [self._file_from_row(*r) for r in self._read(sql, args)]
+
+    def file_index_stats(self):
+        return {
+            "files": self._read("SELECT COUNT(*) FROM files")[0][0],
+            "uploaders": dict(self._read("SELECT uploader, COUNT(*) FROM files GROUP BY uploader")),
+            "attributes": dict(self._read("SELECT attr, COUNT(*) FROM file_attributes GROUP BY attr")),
+        }
+
+    # ---------- Dedupe chunks ----------
+    def has_chunk(self, chunk_id):
+        return bool(self._read("SELECT 1 FROM chunks WHERE id = ?", (chunk_id,)))
+
+    def add_chunks(self, chunk_ids, new_chunks=None):
+        now = time.time()
+        def tx(conn):
+            conn.executemany("INSERT OR IGNORE INTO chunks (id, size) VALUES (?, ?)",
+                             list((new_chunks or {}).items()))
+            conn.executemany("UPDATE chunks SET last_seen = ? WHERE id = ?",
+                             [(now, c) for c in chunk_ids])
+        self._write(tx)
+
+    def touch_chunks(self, chunk_ids, at):
+        """Record a dedupe hit on chunks (their last_seen, read by the garbage collector)."""
+        self._write(lambda conn: conn.executemany(
+            "UPDATE chunks SET last_seen = ? WHERE id = ? AND last_seen < ?", [(at, c, at) for c in chunk_ids]))
+
+    def chunk_last_seen(self, chunk_id):
+        rows = self._read("SELECT last_seen FROM chunks WHERE id = ?", (chunk_id,))
+        return rows[0][0] if rows else 0
+
+    def drop_chunks(self, chunk_ids):
+        self._write(lambda conn: conn.executemany("DELETE FROM chunks WHERE id = ?", [(c,) for c in chunk_ids]))
+
+    def close(self):
+        self.committer.close()
+        with self._lock:
+            self.conn.close()
+        self.wconn.close()
+
+
+def import_json_db(json_path, store):
+    """One-shot import of a db.json document (plus its journal) into a SQLite store."""
+    with open(json_path, "r") as f:
+        db = json.load(f)
+    base = db.get("journal_gen", 0)
+    for gen in _journal_gens():
+        if gen >= base:
+            replay_journal(db, _journal_path(gen))
+
+    def tx(conn):
+        for username, rec in db.get("users", {}).items():
+            conn.execute("INSERT OR IGNORE INTO users (username, id, created, data) VALUES (?, ?, ?, ?)",
+                         (username, rec["id"], rec.get("created"), json.dumps(rec)))
+        for fid, rec in db.get("files", {}).items():
+            store._put_file(conn, fid, rec)
+        for cid, c in db.get("chunks", {}).items():
+            conn.execute("INSERT OR REPLACE INTO chunks (id, size, last_seen) VALUES (?, ?, ?)",
+                         (cid, c["size"], c.get("seen", 0)))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_from', ?)",
+                     (os.path.abspath(json_path),))
+    store._write(tx)
+    print(f"Imported {len(db.get('users', {}))} users and {len(db.get('files', {}))} files from {json_path}")
+
+
+_shared_stores = {}
+_shared_lock = threading.Lock()
+
+
+def open_metadata_store(backend=None):
+    """
+    Process-wide shared store selected by METADATA_BACKEND (sqlite by default).
+    Every component gets the same instance, so there is one in-memory view and
+    one writer per process.
+    """
+    backend = backend or os.environ.get("METADATA_BACKEND", "sqlite")
+    with _shared_lock:
+        if backend not in _shared_stores:
+            if backend == "json":
+                _shared_stores[backend] = JsonMetadataStore()
+            elif backend == "sqlite":
+                _shared_stores[backend] = SQLiteMetadataStore(os.environ.get("METADATA_DB", SQLITE_PATH))
+            else:
+                raise ValueError(f"unknown metadata backend: {backend}")
+        return _shared_stores[backend]
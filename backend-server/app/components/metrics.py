@@ -0,0 +1,29 @@
+# backend/components/metrics.py
+"""
+In-process counters for the admin metrics endpoint.
+
+Names are dotted strings ("download.policy_rejected"); counters start at 0 on
+first use and are per process.
+"""
+
+import threading
+import time
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self.started = time.time()
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def get(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {"uptime_sec": round(time.time() - self.started, 1), "counters": dict(sorted(self._counters.items()))}
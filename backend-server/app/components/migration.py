@@ -0,0 +1,336 @@
+# backend/components/migration.py
+"""
+Background migration of stored objects between ciphertext formats.
+
+Walks file records and re-encodes legacy single-shot objects ("single":
+one AES-GCM blob under s3_key) into the deduplicated chunk format ("cdc"),
+with bounded concurrency and a shared bandwidth budget. Records are read a
+keyset page at a time (newest first, no crypto fields), and the checkpoint
+holds the (created, id) position every record before which is finished, so
+an interrupted run resumes where it stopped; failed ids are retried first.
+
+Each record is switched with a compare-and-swap on s3_key, so downloads in
+flight keep reading either the old or the new layout. Old objects are only
+deleted after a grace period, giving requests that already resolved the old
+s3_key time to finish. A run deletes the ones that are due at every
+checkpoint; sweep_pending_deletes() (called from the garbage collector)
+finishes the job for runs that stopped or crashed first.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .file_component import encode_cursor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CHECKPOINT_EVERY = 20
+CANDIDATE_PAGE = 500
+CANDIDATE_FIELDS = ("id", "created", "format", "s3_key")
+DELETE_GRACE_SECONDS = 300
+
+
+def file_format(record):
+    return record.get("format") or "single"
+
+
+def pending_deletes(checkpoint_path):
+    """Storage keys a migration replaced and will delete once their grace period passes."""
+    try:
+        with open(checkpoint_path, "r") as f:
+            return {key for key, _ in json.load(f).get("pending_delete", [])}
+    except (OSError, ValueError):
+        return set()
+
+
+def _lock_checkpoint(checkpoint_path, blocking=True):
+    """
+    Open and flock <checkpoint>.lock, held by a running migration; returns the
+    file (close it to unlock), or None if blocking is False and it is held.
+    """
+    lock_file = open(checkpoint_path + ".lock", "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            lock_file.close()
+            return None
+    return lock_file
+
+
+def sweep_pending_deletes(checkpoint_path, storage, delete_grace=DELETE_GRACE_SECONDS):
+    """
+    Delete the objects a checkpoint still holds for deletion once their grace
+    period (the migration's own, if it recorded one) has passed. Skipped while
+    a migration is running, which collects them itself. Returns how many were
+    deleted.
+    """
+    if not os.path.exists(checkpoint_path):
+        return 0
+    lock_file = _lock_checkpoint(checkpoint_path, blocking=False)
+    if lock_file is None:
+        return 0
+    try:
+        with open(checkpoint_path, "r") as f:
+            state = json.load(f)
+        grace = state.get("delete_grace", delete_grace)
+        now = time.time()
+        pending = state.get("pending_delete", [])
+        gone = {key for key, at in pending if now - at >= grace and storage.delete_file(key)}
+        if gone:
+            state["pending_delete"] = [p for p in pending if p[0] not in gone]
+            tmp = checkpoint_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, checkpoint_path)
+        return len(gone)
+    except (OSError, ValueError) as e:
+        print(f"Sweeping migration deletes failed: {e}")
+        return 0
+    finally:
+        lock_file.close()
+
+
+class TokenBucket:
+    """Byte-rate limiter shared by migration workers (None = unlimited)."""
+
+    def __init__(self, rate_bytes_per_sec):
+        self.rate = rate_bytes_per_sec
+        self.tokens = float(rate_bytes_per_sec or 0)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= n
+            deficit = -self.tokens
+        if deficit > 0:
+            time.sleep(deficit / self.rate)
+
+
+class MigrationEngine:
+    def __init__(self, file_comp, storage, crypto, chunk_store, checkpoint_path, work_dir,
+                 max_workers=4, bytes_per_sec=None, delete_grace=DELETE_GRACE_SECONDS):
+        self.file_comp = file_comp
+        self.storage = storage
+        self.crypto = crypto
+        self.chunk_store = chunk_store
+        self.checkpoint_path = checkpoint_path
+        self.work_dir = work_dir
+        self.max_workers = max(1, int(max_workers))
+        self.bucket = TokenBucket(bytes_per_sec)
+        self.delete_grace = delete_grace
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._policy_keys = {}
+        self.state = self._load_checkpoint()
+        self.status = {"running": False, "migrated": 0, "failed": 0, "skipped": 0, "bytes_in": 0, "bytes_out": 0}
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    # ---------- Checkpoint ----------
+    def _load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r") as f:
+                state = json.load(f)
+        else:
+            state = {}
+        state.pop("done", None)  # written by earlier versions; the cursor replaces it
+        state.setdefault("cursor", None)
+        state.setdefault("failed", {})
+        state.setdefault("pending_delete", [])
+        state["delete_grace"] = self.delete_grace
+        return state
+
+    def _save_checkpoint(self):
+        with self._lock:
+            data = json.dumps(self.state)
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.replace(tmp, self.checkpoint_path)
+
+    # ---------- Re-encoding ----------
+    def _policy_secret(self, policy):
+        # one service key per distinct policy, reused across records
+        with self._lock:
+            sk = self._policy_keys.get(policy)
+        if sk is None:
+            sk = self.crypto.generate_policy_secret(policy)
+            with self._lock:
+                self._policy_keys[policy] = sk
+        return sk
+
+    def _single_to_cdc(self, fid, record):
+        old_key = record["s3_key"]
+        enc_path = os.path.join(self.work_dir, f"mig_{uuid.uuid4()}.enc")
+        plain_path = os.path.join(self.work_dir, f"mig_{uuid.uuid4()}.plain")
+        try:
+            if not self.storage.download_file(old_key, enc_path):
+                raise IOError(f"download failed for {old_key}")
+            size_in = os.path.getsize(enc_path)
+            self.bucket.consume(size_in)
+
+            meta = {"orig_filename": record["orig_filename"], "enc_file_path": enc_path,
+                    "abe_ct": record["abe_ct"], "policy": record["policy"]}
+            self.crypto.decrypt_file_hybrid(meta, self._policy_secret(record["policy"]), plain_path)
+
+            manifest, stats = self.chunk_store.store_file(plain_path, record["policy"])
+            self.bucket.consume(stats["stored_bytes"])
+            new_meta = self.crypto.encrypt_manifest_hybrid(manifest, record["orig_filename"], record["policy"])
+        finally:
+            for p in (enc_path, plain_path):
+                if os.path.exists(p):
+                    os.remove(p)
+
+        fields = {k: new_meta[k] for k in ("format", "manifest_ct", "chunks", "size", "abe_ct")}
+        fields["s3_key"] = None
+        fields["enc_file_path"] = None
+        if not self.file_comp.swap_storage(fid, old_key, fields):
+            # record changed underneath us; leftover chunks are reconciled by GC
+            raise RuntimeError("record changed during migration")
+        with self._lock:
+            self.state["pending_delete"].append([old_key, time.time()])
+            self.status["bytes_in"] += size_in
+            self.status["bytes_out"] += stats["stored_bytes"]
+
+    def _migrate_one(self, fid):
+        record = self.file_comp.get_file(fid)
+        if not record or file_format(record) != "single" or not record.get("s3_key"):
+            return "skipped"
+        self._single_to_cdc(fid, record)
+        return "migrated"
+
+    # ---------- Old object cleanup ----------
+    def collect_garbage(self, force=False):
+        """Delete replaced objects whose grace period has passed."""
+        now = time.time()
+        with self._lock:
+            due = [p for p in self.state["pending_delete"] if force or now - p[1] >= self.delete_grace]
+        deleted = [p for p in due if self.storage.delete_file(p[0])]
+        with self._lock:
+            gone = {p[0] for p in deleted}
+            self.state["pending_delete"] = [p for p in self.state["pending_delete"] if p[0] not in gone]
+        return len(deleted)
+
+    # ---------- Run loop ----------
+    def _candidates(self):
+        """
+        (fid, position) of every record to migrate: ids that failed before
+        (position None), then single-format records from the checkpointed
+        cursor on, newest first, read a page at a time without crypto fields.
+        """
+        for fid in list(self.state["failed"]):
+            yield fid, None
+        position = self.state["cursor"]
+        cursor = encode_cursor({"created": position[0], "id": position[1]}) if position else None
+        while True:
+            page, cursor = self.file_comp.query_files(cursor=cursor, limit=CANDIDATE_PAGE, fields=CANDIDATE_FIELDS)
+            for rec in page:
+                if file_format(rec) == "single" and rec.get("s3_key"):
+                    yield rec["id"], [rec.get("created") or "", rec["id"]]
+            if not cursor:
+                return
+
+    def _record_result(self, fid, result, error=None):
+        with self._lock:
+            if error is not None:
+                self.state["failed"][fid] = error
+                self.status["failed"] += 1
+            else:
+                self.state["failed"].pop(fid, None)
+                self.status[result] += 1
+
+    def _advance(self, submitted, inflight):
+        """Move the cursor past the longest run of submitted records whose results are recorded."""
+        while submitted and submitted[0][0] not in inflight:
+            _, position = submitted.popleft()
+            if position:
+                with self._lock:
+                    self.state["cursor"] = position
+
+    def run(self):
+        """Migrate every eligible record (blocking). Returns the status dict."""
+        self.status["running"] = True
+        self.status["started"] = time.time()
+        completed = 0
+        lock_file = None
+        try:
+            # one migration at a time across workers; the GC's sweep keeps off the checkpoint meanwhile
+            lock_file = _lock_checkpoint(self.checkpoint_path)
+            loaded = self._load_checkpoint()
+            with self._lock:
+                self.state = loaded
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                inflight = {}
+                submitted = collections.deque()  # (future, position) in catalog order
+                for fid, position in self._candidates():
+                    if self._stop.is_set():
+                        break
+                    # bounded submission keeps memory flat for large catalogs
+                    while len(inflight) >= self.max_workers * 2:
+                        finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                        completed += self._drain(finished, inflight)
+                    fut = pool.submit(self._migrate_one, fid)
+                    inflight[fut] = fid
+                    submitted.append((fut, position))
+                    if completed >= CHECKPOINT_EVERY:
+                        self._advance(submitted, inflight)
+                        self.collect_garbage()
+                        self._save_checkpoint()
+                        completed = 0
+                self._drain(list(inflight), inflight)
+                self._advance(submitted, inflight)
+            if not self._stop.is_set():
+                with self._lock:
+                    self.state["cursor"] = None  # full pass done; the next run starts from the newest record
+            self.collect_garbage()
+        finally:
+            self._save_checkpoint()
+            if lock_file:
+                lock_file.close()
+            self.status["running"] = False
+            self.status["finished"] = time.time()
+        return self.status
+
+    def _drain(self, futures, inflight):
+        for fut in futures:
+            fid = inflight.pop(fut)
+            try:
+                self._record_result(fid, fut.result())
+            except Exception as e:
+                print(f"Migration of {fid} failed: {e}")
+                self._record_result(fid, None, str(e))
+        return len(futures)
+
+    def start(self):
+        """Run in a background thread; returns False if already running."""
+        if self._thread and self._thread.is_alive():
+            return False
+        self._stop.clear()
+        self.status["running"] = True
+        self._thread = threading.Thread(target=self.run, name="ciphertext-migration", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def progress(self):
+        with self._lock:
+            return {**self.status, "cursor": self.state["cursor"],
+                    "failed_ids": dict(self.state["failed"]),
+                    "pending_delete": len(self.state["pending_delete"])}
@@ -0,0 +1,220 @@
+# backend/components/policy_compiler.py
+"""
+ABE policies compiled for cheap satisfiability checks.
+
+The attribute tables CryptoComponent uses to map attribute names onto Waters11
+ids live here, so a policy is judged exactly the way it is encrypted: the
+policy string is normalized with the same substitutions, parsed into an
+and/or tree and flattened into DNF, one int bitmask per clause. A user's
+attributes become one mask, and "could this key decrypt it" is a few integer
+ops per file:
+
+    any(clause & mask == clause for clause in clauses)
+
+Policies that can't be compiled exactly (unbalanced parentheses, and/or mixed
+without parentheses, DNF too large) compile to None, which callers treat as
+"unknown" and leave to the real decryption.
+
+Keys minted for attributes missing from the table carry a hashed id that
+depends on the process's hash seed and may collide with a mapped one, so a
+user with such an attribute gets no mask (None), and a policy naming an id
+or attribute outside the table compiles to None: both are left to the real
+decryption.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+# attribute name -> Waters11 attribute id, as used for user keys
+ATTRIBUTE_IDS = {
+    "role:prof": "1", "role:student": "2", "role:admin": "3",
+    "dept:cs": "10", "dept:math": "11", "dept:eng": "12",
+}
+# spellings accepted in policies, substituted in this order before encryption
+POLICY_TERM_IDS = {
+    "role:prof": "1", "ROLE_PROF": "1", "prof": "1",
+    "role:student": "2", "ROLE_STUDENT": "2", "student": "2",
+    "role:admin": "3", "ROLE_ADMIN": "3", "admin": "3",
+    "dept:cs": "10", "DEPT_CS": "10", "cs": "10",
+    "dept:math": "11", "DEPT_MATH": "11", "math": "11",
+    "dept:eng": "12", "DEPT_ENG": "12", "eng": "12",
+}
+# policy spellings -> canonical attribute names, for indexes and filters
+POLICY_ATTRIBUTE_ALIASES = {
+    "role_prof": "role:prof", "prof": "role:prof",
+    "role_student": "role:student", "student": "role:student",
+    "role_admin": "role:admin", "admin": "role:admin",
+    "dept_cs": "dept:cs", "cs": "dept:cs",
+    "dept_math": "dept:math", "math": "dept:math",
+    "dept_eng": "dept:eng", "eng": "dept:eng",
+}
+
+MAX_CLAUSES = 256
+POLICY_CACHE_SIZE = 4096
+
+_POLICY_TOKEN = re.compile(r"[A-Za-z0-9_:.\-]+")
+_POLICY_KEYWORDS = {"and", "or", "not"}
+_SYNTAX = re.compile(r"\s*(\(|\)|[^\s()]+)")
+
+
+def policy_attributes(policy):
+    """Sorted canonical attributes mentioned by an ABE policy string."""
+    attrs = set()
+    for token in _POLICY_TOKEN.findall(policy or ""):
+        token = token.lower()
+        if token in _POLICY_KEYWORDS or token.isdigit():
+            continue
+        attrs.add(POLICY_ATTRIBUTE_ALIASES.get(token, token))
+    return sorted(attrs)
+
+
+def normalize_attributes(attributes):
+    """Waters11 ids for a user's attributes; unknown ones are hashed into 1..50."""
+    return [ATTRIBUTE_IDS.get(a, str(abs(hash(a)) % 50 + 1)) for a in attributes]
+
+
+def normalize_policy(policy):
+    """Policy string with attribute names replaced by Waters11 ids."""
+    if not policy or not policy.strip():
+        raise ValueError("Policy cannot be empty")
+    normalized = policy.strip()
+    for key, value in POLICY_TERM_IDS.items():
+        normalized = normalized.replace(key, value)
+    return normalized
+
+
+# ---------- Attribute bits ----------
+_bits = {}
+_bits_lock = threading.Lock()
+
+
+def _bit(attr_id):
+    bit = _bits.get(attr_id)
+    if bit is None:
+        with _bits_lock:
+            bit = _bits.setdefault(attr_id, 1 << len(_bits))
+    return bit
+
+
+_MAPPED_IDS = frozenset(ATTRIBUTE_IDS.values())
+
+
+def attribute_mask(attributes):
+    """Bitmask of a user's attributes, or None if any of them is unmapped (hashed in the key)."""
+    mask = 0
+    for attr in attributes or ():
+        attr_id = ATTRIBUTE_IDS.get(attr)
+        if attr_id is None:
+            return None
+        mask |= _bit(attr_id)
+    return mask
+
+
+# ---------- Compilation ----------
+class CompiledPolicy:
+    __slots__ = ("policy", "clauses")
+
+    def __init__(self, policy, clauses):
+        self.policy = policy
+        self.clauses = clauses
+
+    def satisfied_by(self, mask):
+        for clause in self.clauses:
+            if clause & mask == clause:
+                return True
+        return False
+
+
+def _parse(tokens, pos=0, depth=0):
+    """(dnf, pos) for the expression starting at tokens[pos]; raises ValueError."""
+    terms, op = [], None
+    while True:
+        if pos >= len(tokens):
+            raise ValueError("unexpected end of policy")
+        tok = tokens[pos]
+        if tok == "(":
+            dnf, pos = _parse(tokens, pos + 1, depth + 1)
+            if pos >= len(tokens) or tokens[pos] != ")":
+                raise ValueError("unbalanced parentheses")
+            pos += 1
+        elif tok == ")" or tok.lower() in ("and", "or"):
+            raise ValueError(f"unexpected {tok!r}")
+        else:
+            # a leftover name or a foreign id may match a hashed attribute of some key
+            if tok not in _MAPPED_IDS:
+                raise ValueError(f"unmapped attribute {tok!r}")
+            dnf = [_bit(tok)]
+            pos += 1
+        terms.append(dnf)
+        if pos >= len(tokens) or tokens[pos] == ")":
+            if tokens[pos:pos + 1] == [")"] and depth == 0:
+                raise ValueError("unbalanced parentheses")
+            break
+        nxt = tokens[pos].lower()
+        if nxt not in ("and", "or") or (op and nxt != op):
+            # mixed operators need explicit parentheses to be unambiguous
+            raise ValueError("ambiguous policy")
+        op, pos = nxt, pos + 1
+    if op == "or":
+        result = sorted({c for dnf in terms for c in dnf})
+    else:
+        result = [0]
+        for dnf in terms:
+            result = sorted({a | b for a in result for b in dnf})
+            if len(result) > MAX_CLAUSES:
+                raise ValueError("policy too large to compile")
+    if len(result) > MAX_CLAUSES:
+        raise ValueError("policy too large to compile")
+    return result, pos
+
+
+def compile_policy(policy):
+    """CompiledPolicy for an ABE policy string, or None if it can't be compiled exactly."""
+    try:
+        tokens = _SYNTAX.findall(normalize_policy(policy))
+        clauses, pos = _parse(tokens)
+    except ValueError:
+        return None
+    if pos != len(tokens):
+        return None
+    # drop clauses implied by a smaller one (a or (a and b) == a)
+    clauses = [c for c in clauses if not any(o != c and o & c == o for o in clauses)]
+    return CompiledPolicy(policy, tuple(clauses))
+
+
+class PolicyCache:
+    """LRU of compiled policies keyed by policy string."""
+
+    def __init__(self, size=POLICY_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._compiled = OrderedDict()
+
+    def get(self, policy):
+        with self._lock:
+            if policy in self._compiled:
+                self.hits += 1
+                self._compiled.move_to_end(policy)
+                return self._compiled[policy]
+            self.misses += 1
+        compiled = compile_policy(policy)
+        with self._lock:
+            self._compiled[policy] = compiled
+            if len(self._compiled) > self.size:
+                self._compiled.popitem(last=False)
+        return compiled
+
+    def check(self, policy, mask):
+        """True / False if the policy is (not) satisfied by mask, None if unknown (either may be)."""
+        if mask is None:
+            return None
+        compiled = self.get(policy)
+        return None if compiled is None else compiled.satisfied_by(mask)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._compiled), "capacity": self.size, "hits": self.hits, "misses": self.misses,
+                    "uncompilable": sum(1 for c in self._compiled.values() if c is None)}
@@ -32,3 +32,48 @@ class S3Component:
         except ClientError as e:
             print("S3 delete error:", e)
             return False
+
+    def put_bytes(self, s3_key, data):
+        try:
+            self.s3.put_object(Bucket=self.bucket, Key=s3_key, Body=data)
+            return True
+        except ClientError as e:
+            print("S3 put error:", e)
+            return False
+
+    def get_bytes(self, s3_key):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=s3_key)["Body"].read()
+        except ClientError as e:
+            print("S3 get error:", e)
+            return None
+
+    def stat_object(self, s3_key):
+        """(size, last_modified_epoch) of an object, or None if it doesn't exist."""
+        try:
+            head = self.s3.head_object(Bucket=self.bucket, Key=s3_key)
+            return head["ContentLength"], head["LastModified"].timestamp()
+        except ClientError:
+            return None
+
+    def presign_get(self, s3_key, expires_in=300):
+        """Short-lived GET URL so clients can fetch ciphertext straight from S3."""
+        try:
+            return self.s3.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": self.bucket, "Key": s3_key},
+                ExpiresIn=int(expires_in),
+            )
+        except ClientError as e:
+            print("S3 presign error:", e)
+            return None
+
+    def list_objects(self, prefix="", page_size=1000):
+        """Yield pages of (key, size, last_modified_epoch) tuples."""
+        paginator = self.s3.get_paginator("list_objects_v2")
+        try:
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix,
+                                           PaginationConfig={"PageSize": page_size}):
+                yield [(o["Key"], o["Size"], o["LastModified"].timestamp()) for o in page.get("Contents", [])]
+        except ClientError as e:
+            print("S3 list error:", e)
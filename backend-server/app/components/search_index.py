@@ -0,0 +1,228 @@
+# backend/components/search_index.py
+"""
+In-memory inverted index for file search.
+
+Documents are file records, tokenized from display_name / orig_filename,
+tags, uploader and policy attributes, each field with its own weight. Every
+term keeps two postings structures:
+
+- doc -> weight, for O(1) membership checks while intersecting, and
+- a list sorted by (weight, created, doc), so the best matches for a single
+  term (or a merge of prefix expansions) stream out newest-first without
+  scoring every posting.
+
+Query tokens also match as prefixes (via a sorted term list); a multi-token
+query streams its most selective token in rank order, checks the others by
+lookup and stops once no remaining document can enter the requested page.
+The index is updated incrementally per record; build() indexes many records
+at once with one sort per touched term instead.
+"""
+
+import bisect
+import heapq
+import re
+import threading
+
+from .policy_compiler import policy_attributes
+
+FIELD_WEIGHTS = {"name": 3.0, "tags": 2.0, "uploader": 1.5, "policy": 1.0}
+PREFIX_FACTOR = 0.6
+MIN_PREFIX = 2
+MAX_EXPANSIONS = 32
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _TOKEN.findall((text or "").lower())
+
+
+def document_tokens(rec):
+    """token -> weight for one file record (best field wins)."""
+    fields = {
+        "name": " ".join([rec.get("display_name") or "", rec.get("orig_filename") or ""]),
+        "tags": " ".join(rec.get("tags") or ()),
+        "uploader": rec.get("uploader") or "",
+        "policy": " ".join(policy_attributes(rec.get("policy"))),
+    }
+    tokens = {}
+    for field, text in fields.items():
+        weight = FIELD_WEIGHTS[field]
+        for token in tokenize(text):
+            if weight > tokens.get(token, 0):
+                tokens[token] = weight
+    return tokens
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._terms = []        # sorted, for prefix expansion
+        self._weights = {}      # term -> {doc: weight}
+        self._ranked = {}       # term -> sorted [(weight, created, doc)]
+        self._doc_num = {}      # file id -> doc
+        self._doc_ids = []      # doc -> file id (None once removed)
+        self._doc_info = {}     # doc -> (created, {term: weight})
+
+    def __len__(self):
+        return len(self._doc_info)
+
+    def add(self, rec):
+        """Index (or re-index) one file record."""
+        with self._lock:
+            self.remove(rec["id"])
+            doc = self._doc_num.get(rec["id"])
+            if doc is None:
+                doc = len(self._doc_ids)
+                self._doc_ids.append(rec["id"])
+                self._doc_num[rec["id"]] = doc
+            created = rec.get("created") or ""
+            tokens = document_tokens(rec)
+            self._doc_info[doc] = (created, tokens)
+            for term, weight in tokens.items():
+                postings = self._weights.get(term)
+                if postings is None:
+                    postings = self._weights[term] = {}
+                    self._ranked[term] = []
+                    bisect.insort(self._terms, term)
+                postings[doc] = weight
+                bisect.insort(self._ranked[term], (weight, created, doc))
+
+    def remove(self, fid):
+        with self._lock:
+            doc = self._doc_num.get(fid)
+            info = self._doc_info.pop(doc, None) if doc is not None else None
+            if not info:
+                return
+            created, tokens = info
+            for term, weight in tokens.items():
+                del self._weights[term][doc]
+                ranked = self._ranked[term]
+                i = bisect.bisect_left(ranked, (weight, created, doc))
+                if i < len(ranked) and ranked[i][2] == doc:
+                    del ranked[i]
+                if not self._weights[term]:
+                    del self._weights[term]
+                    del self._ranked[term]
+                    del self._terms[bisect.bisect_left(self._terms, term)]
+
+    def build(self, records):
+        """
+        Index (or re-index) many records in bulk: postings are appended, then
+        every touched term is filtered and sorted once, so the cost doesn't
+        depend on how full the index already is.
+        """
+        with self._lock:
+            stale = {}  # term -> docs whose old posting must go
+            added = {}  # term -> new (weight, created, doc) postings
+            for rec in {rec["id"]: rec for rec in records}.values():
+                doc = self._doc_num.get(rec["id"])
+                if doc is None:
+                    doc = len(self._doc_ids)
+                    self._doc_ids.append(rec["id"])
+                    self._doc_num[rec["id"]] = doc
+                else:
+                    info = self._doc_info.pop(doc, None)
+                    for term in (info[1] if info else ()):
+                        stale.setdefault(term, set()).add(doc)
+                        del self._weights[term][doc]
+                created = rec.get("created") or ""
+                tokens = document_tokens(rec)
+                self._doc_info[doc] = (created, tokens)
+                for term, weight in tokens.items():
+                    self._weights.setdefault(term, {})[doc] = weight
+                    added.setdefault(term, []).append((weight, created, doc))
+            for term in stale.keys() | added.keys():
+                if not self._weights[term]:
+                    del self._weights[term]
+                    del self._ranked[term]
+                    continue
+                ranked = self._ranked.get(term, [])
+                gone = stale.get(term)
+                if gone:
+                    ranked = [p for p in ranked if p[2] not in gone]
+                ranked.extend(added.get(term, ()))
+                ranked.sort()
+                self._ranked[term] = ranked
+            if len(self._terms) != len(self._weights) or added.keys() - stale.keys():
+                self._terms = sorted(self._weights)
+
+    def _expand(self, token):
+        """[(term, factor)]: the exact term plus up to MAX_EXPANSIONS prefix matches."""
+        out = [(token, 1.0)] if token in self._weights else []
+        if len(token) < MIN_PREFIX:
+            return out
+        i = bisect.bisect_right(self._terms, token)
+        while i < len(self._terms) and len(out) < MAX_EXPANSIONS and self._terms[i].startswith(token):
+            out.append((self._terms[i], PREFIX_FACTOR))
+            i += 1
+        return out
+
+    def _token_score(self, doc, expansions):
+        return max((self._weights[t].get(doc, 0) * f for t, f in expansions), default=0)
+
+    def search(self, query, offset=0, limit=20):
+        """
+        Ranked matches for query. Returns ([(file_id, score)], has_more).
+        Every query token must match (exactly or as a prefix).
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return [], False
+        with self._lock:
+            expanded = [self._expand(t) for t in tokens]
+            if any(not e for e in expanded):
+                return [], False
+            want = offset + limit + 1
+            if len(expanded) == 1:
+                hits = self._stream_top(expanded[0], want)
+            else:
+                hits = self._intersect(expanded, want)
+            page = [(self._doc_ids[doc], round(score, 3)) for score, _, doc in hits[offset:offset + limit]]
+            return page, len(hits) > offset + limit
+
+    def _stream(self, term, factor):
+        """(score, created, doc) for one term, best first."""
+        for weight, created, doc in reversed(self._ranked[term]):
+            yield weight * factor, created, doc
+
+    def _stream_top(self, expansions, want):
+        # each term's ranked list scaled by a constant factor stays sorted, so a
+        # merge yields the best (score, created) first; stop after `want` docs
+        streams = [self._stream(t, f) for t, f in expansions]
+        hits, seen = [], set()
+        for score, created, doc in heapq.merge(*streams, reverse=True):
+            if doc in seen:
+                continue
+            seen.add(doc)
+            hits.append((score, created, doc))
+            if len(hits) >= want:
+                break
+        return hits
+
+    def _intersect(self, expanded, want):
+        # drive with the token whose postings are smallest; check the rest by lookup
+        expanded = sorted(expanded, key=lambda e: sum(len(self._weights[t]) for t, _ in e))
+        driver, rest = expanded[0], expanded[1:]
+        best_rest = sum(max(FIELD_WEIGHTS.values()) * max(f for _, f in e) for e in rest)
+        streams = [self._stream(t, f) for t, f in driver]
+        top, seen = [], set()  # min-heap of the best `want` hits
+        for score, created, doc in heapq.merge(*streams, reverse=True):
+            # later docs score at most (score + best_rest) and are no newer
+            if len(top) >= want and top[0][:2] >= (score + best_rest, created):
+                break
+            if doc in seen:
+                continue
+            seen.add(doc)
+            for expansions in rest:
+                s = self._token_score(doc, expansions)
+                if not s:
+                    break
+                score += s
+            else:
+                hit = (score, created, doc)
+                if len(top) < want:
+                    heapq.heappush(top, hit)
+                elif hit > top[0]:
+                    heapq.heapreplace(top, hit)
+        return sorted(top, reverse=True)
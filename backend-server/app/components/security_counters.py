@@ -0,0 +1,170 @@
+# backend/components/security_counters.py
+"""
+Rolling security counters: events per user, IP, location and action over
+sliding windows (EVENT_COUNTER_WINDOWS seconds, default 5 min / 1 h / 24 h),
+kept in memory so "failed logins for X in the last hour" or the top offenders
+never scan the log.
+
+Each window is a ring of WINDOW_BUCKETS time buckets with a running total, so
+recording an event and reading a count are O(1) (stale buckets are zeroed
+lazily, each once). Every event is counted under its own action and under
+"*" (any action), and anomalies also under "anomaly". Counters live in
+each process, but the server feeds them from the followed event log, so
+every worker counts every worker's events.
+"""
+
+import heapq
+import os
+import threading
+import time
+
+from .event_logger import parse_ts
+
+EVENT_COUNTER_WINDOWS = [int(w) for w in os.environ.get("EVENT_COUNTER_WINDOWS", "300,3600,86400").split(",") if w]
+EVENT_COUNTER_MAX_KEYS = int(os.environ.get("EVENT_COUNTER_MAX_KEYS", "100000"))
+WINDOW_BUCKETS = 60
+DIMENSIONS = ("user", "ip", "location", "action")
+ANY_ACTION = "*"
+ANOMALY = "anomaly"
+
+
+class SlidingWindow:
+    """Event count over the last `span` seconds, in WINDOW_BUCKETS buckets."""
+
+    __slots__ = ("width", "counts", "last", "total")
+
+    def __init__(self, span):
+        self.width = max(1.0, span / WINDOW_BUCKETS)
+        self.counts = [0] * WINDOW_BUCKETS
+        self.last = None
+        self.total = 0
+
+    def _advance(self, bucket):
+        """Move the window's end to bucket, zeroing the buckets that fall out."""
+        if self.last is not None and bucket <= self.last:
+            return
+        if self.last is None or bucket - self.last >= WINDOW_BUCKETS:
+            self.counts = [0] * WINDOW_BUCKETS
+            self.total = 0
+        else:
+            # zero buckets last+1..bucket: one slice, or two where the ring wraps
+            n = bucket - self.last
+            start = (self.last + 1) % WINDOW_BUCKETS
+            head = min(n, WINDOW_BUCKETS - start)
+            self.total -= sum(self.counts[start:start + head]) + sum(self.counts[:n - head])
+            self.counts[start:start + head] = [0] * head
+            self.counts[:n - head] = [0] * (n - head)
+        self.last = bucket
+
+    def add(self, at, n=1):
+        bucket = int(at // self.width)
+        if bucket != self.last:
+            self._advance(bucket)
+        # an event stamped a little earlier than the newest one still counts while in the window
+        if self.last - bucket < WINDOW_BUCKETS:
+            self.counts[bucket % WINDOW_BUCKETS] += n
+            self.total += n
+
+    def count(self, now):
+        self._advance(int(now // self.width))
+        return self.total
+
+
+class SecurityCounters:
+    def __init__(self, windows=EVENT_COUNTER_WINDOWS, max_keys=EVENT_COUNTER_MAX_KEYS):
+        self.windows = sorted(windows)
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._tables = {}  # (dimension, action) -> {value: [SlidingWindow per window]}
+        self._keys = 0
+        self._next_evict = 0.0
+        self.untracked = 0  # events not counted for a new key while the table was full
+
+    @staticmethod
+    def _values(event):
+        details = event.get("details") if isinstance(event.get("details"), dict) else {}
+        return (("user", event.get("user")), ("ip", details.get("ip")),
+                ("location", details.get("location")), ("action", event.get("action")))
+
+    def _bump(self, dimension, action, value, now):
+        table = self._tables.setdefault((dimension, action), {})
+        windows = table.get(value)
+        if windows is None:
+            if self._keys >= self.max_keys:
+                if now >= self._next_evict:
+                    self._evict(now)
+                    # nothing expires sooner than one bucket of the shortest window
+                    self._next_evict = now + self.windows[0] / WINDOW_BUCKETS
+                if self._keys >= self.max_keys:
+                    self.untracked += 1
+                    return
+            windows = table[value] = [SlidingWindow(span) for span in self.windows]
+            self._keys += 1
+        for window in windows:
+            window.add(now)
+
+    def _evict(self, now):
+        # keys whose longest window has emptied hold no information
+        for table in self._tables.values():
+            idle = [value for value, windows in table.items() if windows[-1].count(now) == 0]
+            for value in idle:
+                del table[value]
+            self._keys -= len(idle)
+
+    def record(self, event, now=None):
+        """Count one event (a dict with user / action / details / is_anomaly) at now (default: its timestamp)."""
+        if now is None:
+            now = parse_ts(event.get("timestamp")) or time.time()
+        action = event.get("action")
+        with self._lock:
+            for dimension, value in self._values(event):
+                if value is None:
+                    continue
+                value = str(value)
+                if dimension == "action":
+                    self._bump(dimension, ANY_ACTION, value, now)
+                    continue
+                self._bump(dimension, ANY_ACTION, value, now)
+                if action is not None:
+                    self._bump(dimension, action, value, now)
+                if event.get("is_anomaly"):
+                    self._bump(dimension, ANOMALY, value, now)
+
+    def record_many(self, events):
+        for event in events:
+            self.record(event)
+
+    def _window_index(self, window):
+        if window is None:
+            return 0
+        if window not in self.windows:
+            raise ValueError(f"window must be one of {self.windows}")
+        return self.windows.index(window)
+
+    def counts(self, dimension, value, now=None):
+        """{window: {action: count}} for one user / ip / location / action (non-zero counts only)."""
+        now = now or time.time()
+        out = {span: {} for span in self.windows}
+        with self._lock:
+            for (dim, action), table in self._tables.items():
+                windows = table.get(str(value)) if dim == dimension else None
+                if windows is None:
+                    continue
+                for span, window in zip(self.windows, windows):
+                    n = window.count(now)
+                    if n:
+                        out[span][action] = n
+        return out
+
+    def top(self, dimension, action=ANY_ACTION, window=None, k=10, now=None):
+        """The k values of a dimension with the most events (of action) in window: [(value, count)]."""
+        now = now or time.time()
+        i = self._window_index(window)
+        with self._lock:
+            table = self._tables.get((dimension, action), {})
+            ranked = ((value, windows[i].count(now)) for value, windows in table.items())
+            return [(value, n) for value, n in heapq.nlargest(k, ranked, key=lambda item: item[1]) if n]
+
+    def stats(self):
+        with self._lock:
+            return {"keys": self._keys, "max_keys": self.max_keys, "windows": self.windows, "untracked": self.untracked}
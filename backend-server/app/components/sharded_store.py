@@ -0,0 +1,485 @@
+# backend/components/sharded_store.py
+"""
+File metadata partitioned across local shards by consistent hashing.
+
+Each shard is its own SQLiteMetadataStore under <root>/<shard>/. A file id
+maps to a shard through a hash ring with virtual nodes, so lookups and
+writes touch exactly one shard. Listings scatter the query to every shard and
+merge the newest-first results on (created, id), which is also the cursor,
+so pagination works unchanged.
+
+Adding a shard moves only the ~1/N of records the new ring assigns to it.
+The move runs in the background: until it finishes, lookups fall back to the
+previous ring's owner, and each record is copied and then removed from its
+old shard under a per-record lock shared with writers in every worker
+process (striped: a threading lock plus an flock on locks/<stripe>.lock).
+The shard layout (current and, while rebalancing, previous members) is kept
+in shards.json so an interrupted rebalance resumes on restart.
+
+Worker processes share shards.json: routed writes hold the layout lock shared
+and pick up a replaced layout before routing, layout changes hold it
+exclusive, so no process keeps writing with a ring another one has retired.
+Only one process runs a rebalance (rebalance.lock).
+
+Files written before sharding was enabled are moved out of the primary store
+into the shards on first start.
+
+Users and the dedupe chunk catalog stay in the primary store.
+"""
+
+import bisect
+import hashlib
+import heapq
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .metadata_store import SQLiteMetadataStore
+
+VNODES = 160
+SHARD_DB = "metadata.db"
+REBALANCE_PAGE = 500
+LOCK_STRIPES = 64
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+def _order(rec):
+    return (rec.get("created") or "", rec["id"])
+
+
+class HashRing:
+    def __init__(self, shards, vnodes=VNODES):
+        self.shards = list(shards)
+        points = sorted((_hash(f"{shard}#{i}"), shard) for shard in self.shards for i in range(vnodes))
+        self._points = [p for p, _ in points]
+        self._owners = [s for _, s in points]
+
+    def owner(self, key):
+        i = bisect.bisect(self._points, _hash(key))
+        return self._owners[i % len(self._owners)]
+
+
+def _flock(f, mode):
+    """flock f with fcntl.<mode> (no-op where fcntl is unavailable)."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), getattr(fcntl, mode))
+
+
+class _LayoutLock:
+    """
+    Readers-writer lock on the shard layout, across threads and processes.
+    flock is per open file, so this process's readers share one shared flock
+    and a writer takes an exclusive one on a second handle. A writer first
+    takes <path>.intent exclusively and new readers in every process wait that
+    out, so readers that keep overlapping in one process can't starve it.
+    """
+
+    def __init__(self, path):
+        self._shared_file = open(path, "a")
+        self._exclusive_file = open(path, "a")
+        self._gate_file = open(path + ".intent", "a")
+        self._intent_file = open(path + ".intent", "a")
+        self._gate = threading.Lock()
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+
+    @contextmanager
+    def shared(self):
+        with self._gate:
+            _flock(self._gate_file, "LOCK_SH")
+            _flock(self._gate_file, "LOCK_UN")
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            self._readers += 1
+            if self._readers == 1:
+                _flock(self._shared_file, "LOCK_SH")
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    _flock(self._shared_file, "LOCK_UN")
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            self._writing = True  # holds off new readers in this process
+            while self._readers:
+                self._cond.wait()
+        try:
+            _flock(self._intent_file, "LOCK_EX")
+            try:
+                _flock(self._exclusive_file, "LOCK_EX")
+                try:
+                    yield
+                finally:
+                    _flock(self._exclusive_file, "LOCK_UN")
+            finally:
+                _flock(self._intent_file, "LOCK_UN")
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class _RecordLocks:
+    """Striped per-record locks, exclusive across threads and worker processes."""
+
+    def __init__(self, folder, stripes=LOCK_STRIPES):
+        os.makedirs(folder, exist_ok=True)
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        # flock excludes other processes, the threading lock this one's threads
+        self._files = [open(os.path.join(folder, f"{i:02d}.lock"), "a") for i in range(stripes)]
+
+    @contextmanager
+    def hold(self, fid):
+        i = _hash(fid) % len(self._locks)
+        with self._locks[i]:
+            _flock(self._files[i], "LOCK_EX")
+            try:
+                yield
+            finally:
+                _flock(self._files[i], "LOCK_UN")
+
+
+class ShardedFileStore:
+    def __init__(self, primary, root_dir, shard_count=4, vnodes=VNODES):
+        self.primary = primary
+        self.root = os.path.abspath(root_dir)
+        self.layout_path = os.path.join(self.root, "shards.json")
+        self.vnodes = vnodes
+        self._reload_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="shard-scatter")
+        self._rebalancer = None
+        self.rebalance_status = {"running": False, "moved": 0}
+        os.makedirs(self.root, exist_ok=True)
+        self._layout = _LayoutLock(os.path.join(self.root, "shards.lock"))
+        self._records = _RecordLocks(os.path.join(self.root, "locks"))
+        self._rebalance_lockfile = open(os.path.join(self.root, "rebalance.lock"), "a")
+        self.shards = {}
+        self._stamp = None
+
+        with self._layout.exclusive():
+            if not os.path.exists(self.layout_path):
+                self._write_layout({"shards": [f"shard-{i:02d}" for i in range(max(1, int(shard_count)))],
+                                    "previous": None})
+            self._reload_layout()
+            self._import_primary()
+        if self.previous:
+            print("Resuming interrupted shard rebalance")
+            self._start_rebalance()
+
+    # ---------- Layout ----------
+    def _layout_stamp(self):
+        st = os.stat(self.layout_path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _reload_layout(self):
+        """Adopt shards.json as it is on disk (another process may have changed it)."""
+        with self._reload_lock:
+            stamp = self._layout_stamp()
+            with open(self.layout_path, "r") as f:
+                layout = json.load(f)
+            for name in layout["shards"]:
+                if name not in self.shards:
+                    self.shards[name] = self._open_shard(name)
+            self.ring = HashRing(layout["shards"], self.vnodes)
+            self.previous = HashRing(layout["previous"], self.vnodes) if layout.get("previous") else None
+            self._stamp = stamp
+
+    def _sync_layout(self):
+        # shards.json is replaced (new inode) on every change: one stat per routed call
+        if self._layout_stamp() != self._stamp:
+            self._reload_layout()
+
+    def _write_layout(self, layout):
+        tmp = self.layout_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(layout, f)
+        os.replace(tmp, self.layout_path)
+
+    def _save_layout(self):
+        self._write_layout({"shards": self.ring.shards,
+                            "previous": self.previous.shards if self.previous else None})
+        self._stamp = self._layout_stamp()
+
+    def _import_primary(self):
+        """Move file records left in the primary store (written before sharding was enabled) into the shards."""
+        moved = 0
+        while True:
+            page = self.primary.query_files(limit=REBALANCE_PAGE, include_crypto=True)
+            if not page:
+                break
+            # a crash between the copy and the delete re-imports the page: keep the shard's copy
+            self._put_files([rec for rec in page if self.get_file(rec["id"]) is None])
+            for rec in page:
+                self.primary.delete_file(rec["id"])
+            moved += len(page)
+        if moved:
+            print(f"Moved {moved} file records from the primary store into {len(self.shards)} shards")
+
+    def _open_shard(self, name):
+        folder = os.path.join(self.root, name)
+        os.makedirs(folder, exist_ok=True)
+        return SQLiteMetadataStore(os.path.join(folder, SHARD_DB), import_from=None)
+
+    # ---------- Routing ----------
+    def _lock(self, fid):
+        return self._records.hold(fid)
+
+    def shard_for(self, fid):
+        self._sync_layout()
+        return self.ring.owner(fid)
+
+    def _old_owner(self, fid):
+        """Previous-ring owner while a rebalance is moving fid, else None."""
+        previous = self.previous
+        if previous is None:
+            return None
+        old = previous.owner(fid)
+        return old if old != self.ring.owner(fid) else None
+
+    def _holder(self, fid):
+        """Shard store currently holding fid (new owner first, then old)."""
+        store = self.shards[self.ring.owner(fid)]
+        old = self._old_owner(fid)
+        if old and store.get_file(fid) is None and self.shards[old].get_file(fid) is not None:
+            return self.shards[old]
+        return store
+
+    def _scatter(self, fn):
+        self._sync_layout()
+        return list(self._pool.map(fn, list(self.shards.values())))
+
+    # ---------- Files ----------
+    def put_file(self, fid, record):
+        with self._layout.shared(), self._lock(fid):
+            self._sync_layout()
+            self.shards[self.ring.owner(fid)].put_file(fid, record)
+            old = self._old_owner(fid)
+            if old:
+                self.shards[old].delete_file(fid)
+
+    def put_files(self, records):
+        """Insert or replace many records, one batch per shard."""
+        with self._layout.shared():
+            self._sync_layout()
+            self._put_files(records)
+
+    def _put_files(self, records):
+        groups = {}
+        for rec in records:
+            groups.setdefault(self.ring.owner(rec["id"]), []).append(rec)
+        for name, recs in groups.items():
+            self.shards[name].put_files(recs)
+        for rec in records:
+            old = self._old_owner(rec["id"])
+            if old:
+                self.shards[old].delete_file(rec["id"])
+
+    def update_file(self, fid, fields, expect=None):
+        with self._layout.shared(), self._lock(fid):
+            self._sync_layout()
+            return self._holder(fid).update_file(fid, fields, expect=expect)
+
+    def set_context_policy(self, fid, policy):
+        with self._layout.shared(), self._lock(fid):
+            self._sync_layout()
+            return self._holder(fid).set_context_policy(fid, policy)
+
+    def delete_file(self, fid):
+        with self._layout.shared(), self._lock(fid):
+            self._sync_layout()
+            deleted = self.shards[self.ring.owner(fid)].delete_file(fid)
+            old = self._old_owner(fid)
+            if old:
+                deleted = self.shards[old].delete_file(fid) or deleted
+            return deleted
+
+    def get_file(self, fid):
+        self._sync_layout()
+        store = self.shards[self.ring.owner(fid)]
+        rec = store.get_file(fid)
+        if rec is None:
+            old = self._old_owner(fid)
+            if old:
+                # re-check the new owner in case the record moved between the two reads
+                rec = self.shards[old].get_file(fid) or store.get_file(fid)
+        return rec
+
+    def list_files(self):
+        merged = {}
+        for rows in self._scatter(lambda st: st.list_files()):
+            for rec in rows:
+                merged.setdefault(rec["id"], rec)
+        return sorted(merged.values(), key=_order)
+
+    def list_context_policies(self):
+        policies = {}
+        for found in self._scatter(lambda st: st.list_context_policies()):
+            policies.update(found)
+        return policies
+
+    def list_policies(self):
+        policies = set()
+        for found in self._scatter(lambda st: st.list_policies()):
+            policies.update(found)
+        return sorted(policies)
+
+    def query_files(self, uploader=None, created_from=None, created_to=None, name_prefix=None,
+                    attributes=(), after=None, limit=50, include_crypto=False, policies=None):
+        """Scatter the query to every shard and merge the newest-first pages."""
+        pages = self._scatter(lambda st: st.query_files(
+            uploader=uploader, created_from=created_from, created_to=created_to, name_prefix=name_prefix,
+            attributes=attributes, after=after, limit=limit, include_crypto=include_crypto, policies=policies))
+        rows, seen = [], set()
+        for rec in heapq.merge(*pages, key=_order, reverse=True):
+            # a record being moved can briefly exist on two shards
+            if rec["id"] in seen:
+                continue
+            seen.add(rec["id"])
+            rows.append(rec)
+            if len(rows) >= int(limit):
+                break
+        return rows
+
+    def file_index_stats(self):
+        total = {"files": 0, "uploaders": {}, "attributes": {}, "shards": {}}
+        for name, stats in zip(self.shards, self._scatter(lambda st: st.file_index_stats())):
+            total["files"] += stats["files"]
+            total["shards"][name] = stats["files"]
+            for group in ("uploaders", "attributes"):
+                for k, n in stats[group].items():
+                    total[group][k] = total[group].get(k, 0) + n
+        return total
+
+    def changes_since(self, seq):
+        """Per-shard change feeds combined; seq / head are {shard: seq} dicts."""
+        self._sync_layout()
+        heads, changes = {}, []
+        for name, st in list(self.shards.items()):
+            head, found = st.changes_since(seq.get(name) if seq else None)
+            heads[name] = head
+            if found is None:
+                changes = None
+            elif changes is not None:
+                changes.extend(found)
+        return heads, changes
+
+    # ---------- Dedupe chunks (primary store) ----------
+    def has_chunk(self, chunk_id):
+        return self.primary.has_chunk(chunk_id)
+
+    def add_chunks(self, chunk_ids, new_chunks=None):
+        self.primary.add_chunks(chunk_ids, new_chunks)
+
+    def drop_chunks(self, chunk_ids):
+        self.primary.drop_chunks(chunk_ids)
+
+    def touch_chunks(self, chunk_ids, at):
+        self.primary.touch_chunks(chunk_ids, at)
+
+    def chunk_last_seen(self, chunk_id):
+        return self.primary.chunk_last_seen(chunk_id)
+
+    # ---------- Rebalance ----------
+    def add_shard(self, name=None):
+        """Add a shard and start moving its share of records to it in the background."""
+        with self._layout.exclusive():
+            self._sync_layout()
+            if self.previous is not None:
+                raise ValueError("a rebalance is already in progress")
+            name = name or f"shard-{len(self.shards):02d}"
+            if name in self.shards:
+                raise ValueError(f"shard {name} already exists")
+            self.shards[name] = self._open_shard(name)
+            self.previous = self.ring
+            self.ring = HashRing(self.previous.shards + [name], self.vnodes)
+            self._save_layout()
+        self._start_rebalance()
+        return name
+
+    def _start_rebalance(self):
+        self.rebalance_status = {"running": True, "moved": 0, "started": time.time()}
+        self._rebalancer = threading.Thread(target=self._rebalance, name="shard-rebalance", daemon=True)
+        self._rebalancer.start()
+
+    def _move(self, src_name, rec):
+        fid = rec["id"]
+        dest = self.ring.owner(fid)
+        if dest == src_name:
+            return False
+        src = self.shards[src_name]
+        with self._lock(fid):
+            current = src.get_file(fid)
+            if current is None:
+                return False
+            if self.shards[dest].get_file(fid) is None:
+                self.shards[dest].put_file(fid, current)
+            src.delete_file(fid)
+        return True
+
+    def _rebalance(self):
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._rebalance_lockfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # another worker is already moving the records
+                self.rebalance_status = {"running": False, "moved": 0, "elsewhere": True}
+                return
+        try:
+            for name in self.previous.shards:
+                after = None
+                while True:
+                    page = self.shards[name].query_files(after=after, limit=REBALANCE_PAGE)
+                    if not page:
+                        break
+                    for rec in page:
+                        if self._move(name, rec):
+                            self.rebalance_status["moved"] += 1
+                    after = _order(page[-1])
+            with self._layout.exclusive():
+                self.previous = None
+                self._save_layout()
+        except Exception as e:
+            print("Shard rebalance failed:", e)
+            self.rebalance_status["error"] = str(e)
+        finally:
+            self.rebalance_status["running"] = False
+            self.rebalance_status["finished"] = time.time()
+            _flock(self._rebalance_lockfile, "LOCK_UN")
+
+    def wait_rebalance(self, timeout=None):
+        if self._rebalancer:
+            self._rebalancer.join(timeout)
+
+    def status(self):
+        self._sync_layout()
+        return {
+            "shards": self.ring.shards,
+            "rebalancing_from": self.previous.shards if self.previous else None,
+            "rebalance": dict(self.rebalance_status),
+        }
+
+    def close(self):
+        self.wait_rebalance()
+        self._pool.shutdown()
+        for st in self.shards.values():
+            st.close()
@@ -0,0 +1,218 @@
+# backend/components/upload_session.py
+"""
+Resumable chunked uploads.
+
+A client opens a session, PUTs numbered parts (any order, in parallel),
+asks which parts are still missing, and finalizes with the Merkle root of
+the part hashes. Each part is encrypted and forwarded to storage through the
+ChunkStore as soon as it arrives, so nothing is buffered beyond one part and
+an interrupted transfer resumes from the parts already received.
+
+Session state lives on disk (one small JSON file per received part), so
+parallel part writers never rewrite shared state and sessions survive a
+server restart. Only part hashes are persisted; chunk keys are re-derived
+from them at finalize time.
+
+Finalizing is two-phase: finalize() verifies the parts and claims the
+session, and only complete(), called once the file is registered, catalogs
+its chunks and drops the session. If anything in between fails,
+release() frees the claim and the client can finalize again.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from .chunk_store import merkle_root
+
+SESSION_TTL = 24 * 3600
+MAX_PART_SIZE = 64 * 1024 * 1024
+MAX_PARTS = 100000
+# a finalize claim older than this is taken to belong to a crashed request
+FINALIZE_TIMEOUT = 600
+
+
+class UploadSessionError(Exception):
+    pass
+
+
+class UploadSessionManager:
+    def __init__(self, chunk_store, sessions_dir, ttl=SESSION_TTL):
+        self.chunk_store = chunk_store
+        self.sessions_dir = os.path.abspath(sessions_dir)
+        self.ttl = ttl
+        self._finalize_lock = threading.Lock()
+        os.makedirs(self.sessions_dir, exist_ok=True)
+
+    def _dir(self, sid):
+        try:
+            sid = str(uuid.UUID(sid))
+        except (ValueError, TypeError, AttributeError):
+            raise UploadSessionError("unknown session")
+        return os.path.join(self.sessions_dir, sid)
+
+    @staticmethod
+    def _write_json(path, obj):
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(obj, f)
+        os.replace(tmp, path)
+
+    def _load(self, sid):
+        path = os.path.join(self._dir(sid), "session.json")
+        if not os.path.exists(path):
+            raise UploadSessionError("unknown session")
+        with open(path, "r") as f:
+            session = json.load(f)
+        if session["expires"] < time.time():
+            raise UploadSessionError("session expired")
+        return session
+
+    def create(self, username, policy, filename, total_parts, options=None):
+        total_parts = int(total_parts)
+        if not 0 < total_parts <= MAX_PARTS:
+            raise UploadSessionError(f"total_parts must be between 1 and {MAX_PARTS}")
+        sid = str(uuid.uuid4())
+        os.makedirs(self._dir(sid))
+        session = {
+            "id": sid,
+            "username": username,
+            "policy": policy,
+            "filename": filename,
+            "total_parts": total_parts,
+            "options": options or {},
+            "created": time.time(),
+            "expires": time.time() + self.ttl,
+        }
+        self._write_json(os.path.join(self._dir(sid), "session.json"), session)
+        return session
+
+    def put_part(self, sid, index, data):
+        """Encrypt + store one part (idempotent per index). Returns its SHA-256 hex."""
+        session = self._load(sid)
+        index = int(index)
+        if not 0 <= index < session["total_parts"]:
+            raise UploadSessionError("part index out of range")
+        if not data or len(data) > MAX_PART_SIZE:
+            raise UploadSessionError(f"part must be 1..{MAX_PART_SIZE} bytes")
+        entry, stored = self.chunk_store.put_chunk(data, session["policy"])
+        record = {
+            "chunk_id": entry[0],
+            "size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "stored": stored,
+        }
+        self._write_json(os.path.join(self._dir(sid), f"part_{index}.json"), record)
+        return record["sha256"]
+
+    def received(self, sid):
+        session = self._load(sid)
+        parts = sorted(
+            int(name[5:-5]) for name in os.listdir(self._dir(sid))
+            if name.startswith("part_") and name.endswith(".json")
+        )
+        have = set(parts)
+        return session, parts, [i for i in range(session["total_parts"]) if i not in have]
+
+    def status(self, sid):
+        session, parts, missing = self.received(sid)
+        return {
+            "session_id": sid,
+            "total_parts": session["total_parts"],
+            "received": parts,
+            "missing": missing,
+            "expires": session["expires"],
+        }
+
+    def _claim(self, sid):
+        path = os.path.join(self._dir(sid), "finalizing")
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if time.time() - os.path.getmtime(path) < FINALIZE_TIMEOUT:
+                raise UploadSessionError("session is already being finalized")
+            os.utime(path)  # stale claim from a crashed request: take it over
+            return
+        os.close(fd)
+
+    def finalize(self, sid, expected_root):
+        """
+        Verify all parts and the client's Merkle root, claim the session and
+        return (session, manifest, stats). The session is kept until
+        complete(); release() it if the file can't be registered.
+        """
+        with self._finalize_lock:
+            session, parts, missing = self.received(sid)
+            if missing:
+                raise UploadSessionError(f"{len(missing)} parts missing")
+            records = []
+            for i in range(session["total_parts"]):
+                with open(os.path.join(self._dir(sid), f"part_{i}.json"), "r") as f:
+                    records.append(json.load(f))
+            digests = [bytes.fromhex(r["sha256"]) for r in records]
+            root = merkle_root(digests)
+            if root != expected_root:
+                raise UploadSessionError("merkle root mismatch")
+            self._claim(sid)
+
+            entries = []
+            new_chunks = {}
+            for rec, digest in zip(records, digests):
+                chunk_id, key = self.chunk_store.chunk_entry_for_digest(digest, session["policy"])
+                entries.append([chunk_id, rec["size"], key.hex()])
+                if rec["stored"]:
+                    new_chunks[chunk_id] = rec["stored"]
+            manifest = {
+                "version": 1,
+                "size": sum(r["size"] for r in records),
+                "merkle_root": root,
+                "chunks": entries,
+            }
+        session["new_chunks"] = new_chunks
+        stats = {
+            "size": manifest["size"],
+            "chunks": len(entries),
+            "new_chunks": len(new_chunks),
+            "stored_bytes": sum(new_chunks.values()),
+        }
+        return session, manifest, stats
+
+    def complete(self, session, manifest):
+        """The finalized file is registered: catalog its chunks and drop the session."""
+        self.chunk_store.index.add_chunks([e[0] for e in manifest["chunks"]], session["new_chunks"])
+        shutil.rmtree(self._dir(session["id"]), ignore_errors=True)
+
+    def release(self, sid):
+        """Undo a finalize claim after a failure, so the client can finalize again."""
+        try:
+            os.remove(os.path.join(self._dir(sid), "finalizing"))
+        except (OSError, UploadSessionError):
+            pass
+
+    def abort(self, sid):
+        self._load(sid)
+        shutil.rmtree(self._dir(sid), ignore_errors=True)
+
+    def purge_expired(self):
+        """Drop expired sessions; returns how many were removed."""
+        removed = 0
+        now = time.time()
+        for sid in os.listdir(self.sessions_dir):
+            path = os.path.join(self.sessions_dir, sid, "session.json")
+            try:
+                with open(path, "r") as f:
+                    expired = json.load(f)["expires"] < now
+            except (OSError, ValueError, KeyError):
+                # no readable session.json: a create() still writing it, unless it is older than a session lives
+                try:
+                    expired = now - os.path.getmtime(os.path.join(self.sessions_dir, sid)) > self.ttl
+                except OSError:
+                    expired = False
+            if expired:
+                shutil.rmtree(os.path.join(self.sessions_dir, sid), ignore_errors=True)
+                removed += 1
+        return removed
@@ -1,51 +1,61 @@
 # backend/components/user_component.py
-import json
-import os
 import uuid
 from datetime import datetime
 
-DB_PATH = "db.json"
-
-def load_db():
-    if not os.path.exists(DB_PATH):
-        with open(DB_PATH, "w") as f:
-            json.dump({"users": {}, "files": {}}, f)
-    with open(DB_PATH, "r") as f:
-        return json.load(f)
-
-def save_db(db):
-    with open(DB_PATH, "w") as f:
-        json.dump(db, f, indent=2)
+from .metadata_store import open_metadata_store
+from .keystore import KeyStore
 
 class UserComponent:
-    def __init__(self):
-        self.db = load_db()
+    def __init__(self, store=None, keystore=None):
+        self.store = store or open_metadata_store()
+        # ABE secret keys live in their own binary file; user records keep a reference
+        self.keystore = keystore or KeyStore()
 
     def register_user(self, username, attrs, location):
-        if username in self.db["users"]:
-            return False, "User exists"
         # Each user will have an id and will store attributes and (placeholder) abe private key
         uid = str(uuid.uuid4())
-        self.db["users"][username] = {
+        record = {
             "id": uid,
             "attributes": attrs,
             "location": location,
             "created": datetime.utcnow().isoformat(),
-            # user SK must be created via CryptoComponent generate_user_key; placeholder
-            "abe_sk": None,
+            # user SK must be created via CryptoComponent generate_user_key; offset in the keystore
+            "abe_sk_ref": None,
         }
-        save_db(self.db)
-        return True, self.db["users"][username]
+        if not self.store.create_user(username, record):
+            return False, "User exists"
+        return True, record
 
     def set_user_abe_sk(self, username, sk_b64):
-        if username not in self.db["users"]:
+        user = self.store.get_user(username)
+        if not user:
             return False
-        self.db["users"][username]["abe_sk"] = sk_b64
-        save_db(self.db)
-        return True
+        ref = self.keystore.put(user["id"], sk_b64)
+        return self.store.update_user(username, {"abe_sk_ref": ref, "abe_sk": None})
+
+    def get_user_abe_sk(self, username):
+        """The user's base64 Waters11 key, read from the keystore on demand (None if unset)."""
+        user = self.store.get_user(username)
+        if not user:
+            return None
+        if user.get("abe_sk_ref") is not None:
+            return self.keystore.get(user["abe_sk_ref"], user["id"])
+        return user.get("abe_sk")
+
+    def migrate_legacy_keys(self):
+        """Move keys still embedded in user records into the keystore. Returns how many moved."""
+        moved = 0
+        # every worker runs this at startup: one at a time, each re-reading the records under the lock
+        with self.keystore.locked():
+            for username in self.store.list_usernames():
+                user = self.store.get_user(username)
+                if user and user.get("abe_sk"):
+                    self.set_user_abe_sk(username, user["abe_sk"])
+                    moved += 1
+        return moved
 
     def get_user(self, username):
-        return self.db["users"].get(username)
+        return self.store.get_user(username)
 
     def list_users(self):
-        return list(self.db["users"].keys())
+        return self.store.list_usernames()
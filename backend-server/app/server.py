@@ -1,37 +1,165 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, abort
 from flask_cors import CORS # Import CORS
 import os
 import uuid
 import json
-
-from components.event_logger import log_event, get_events
+import threading
+import time
+from datetime import datetime, timezone
+
+from components.event_logger import (log_event, get_events, query_events, aggregate_events, events_since,
+                                     event_log, event_writer, follow_events, is_anomaly)
+from components.event_hub import EventHub, sse_frame
+from components.security_counters import SecurityCounters, DIMENSIONS, ANY_ACTION
 from components.crypto_component import CryptoComponent
 from components.s3_component import S3Component
+from components.local_storage_component import LocalStorageComponent
 from components.context_component import ContextComponent
+from components.context_policy import validate_policy
 from components.fl_component import FLComponent
 from components.user_component import UserComponent
-from components.file_component import FileComponent
+from components.keystore import KeyStoreError
+from components.file_component import FileComponent, LIST_FIELDS
+from components.metadata_store import open_metadata_store
+from components.sharded_store import ShardedFileStore
+from components.search_index import SearchIndex
+from components.metrics import Metrics
+from components.chunk_store import ChunkStore
+from components.migration import MigrationEngine
+from components.garbage_collector import GarbageCollector, ENCRYPTED_PREFIX
+from components.upload_session import UploadSessionManager, UploadSessionError, MAX_PART_SIZE
+from config import STORAGE_DIR
 
 app = Flask(__name__)
 CORS(app)
 # Configure S3
 S3_BUCKET = "file-storage-00414"
 S3_REGION = "eu-central-1"
+# Store uploads as deduplicated content-defined chunks (set DEDUP_UPLOADS=0 for single-object uploads)
+DEDUP_UPLOADS = os.environ.get("DEDUP_UPLOADS", "1") == "1"
+# "s3" or "local" (disk stand-in under STORAGE_DIR, served via signed /storage URLs)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "s3")
+# Lifetime of presigned ciphertext URLs handed out by direct downloads
+DIRECT_URL_TTL = int(os.environ.get("DIRECT_URL_TTL", "300"))
+# Seconds between background garbage-collection runs (0 disables the background thread)
+GC_INTERVAL = int(os.environ.get("GC_INTERVAL", "3600"))
+# Partition file metadata across this many local shards (0 keeps files in the main store)
+METADATA_SHARDS = int(os.environ.get("METADATA_SHARDS", "0"))
+METADATA_SHARD_DIR = os.environ.get("METADATA_SHARD_DIR", "shards")
+# Live event stream: keepalive comment interval (s) and client reconnect delay (ms)
+EVENT_STREAM_HEARTBEAT = float(os.environ.get("EVENT_STREAM_HEARTBEAT", "15"))
+EVENT_STREAM_RETRY_MS = int(os.environ.get("EVENT_STREAM_RETRY_MS", "3000"))
 
 # Components (now using Waters11)
 crypto = CryptoComponent()
-s3c = S3Component(S3_BUCKET, region_name=S3_REGION)
+if STORAGE_BACKEND == "local":
+    s3c = LocalStorageComponent(STORAGE_DIR)
+else:
+    s3c = S3Component(S3_BUCKET, region_name=S3_REGION)
 context_comp = ContextComponent()
 fl_comp = FLComponent()
+metrics = Metrics()
+# Live security events for /api/events/stream and rolling per-user / IP / location
+# counters, both fed from the followed log tail so every worker's events reach them;
+# the counters start from the log's last window, up to where following began
+event_hub = EventHub()
+security_counters = SecurityCounters()
+
+def _on_events_followed(events):
+    event_hub.publish(events)
+    security_counters.record_many(events)
+
+_followed_from = follow_events(_on_events_followed)
+security_counters.record_many(event_log().scan(since=time.time() - max(security_counters.windows),
+                                               before=_followed_from + 1))
 # fl_comp.client_train_and_report({
 #     "location": {"chennai": 10, "mumbai": 5},
 #     "device": {"laptop1": 8, "phone1": 3}
 # })
-user_comp = UserComponent()
-file_comp = FileComponent()
+# One metadata store shared by both components (single writer, group commit)
+metadata_store = open_metadata_store()
+user_comp = UserComponent(metadata_store)
+if METADATA_SHARDS > 0:
+    file_store = ShardedFileStore(metadata_store, METADATA_SHARD_DIR, METADATA_SHARDS)
+else:
+    file_store = metadata_store
+file_comp = FileComponent(file_store)
+moved_keys = user_comp.migrate_legacy_keys()
+if moved_keys:
+    print(f"Moved {moved_keys} ABE keys from user records into the keystore")
+
+# Full-text search over the catalog, kept current by the change feed below
+search_index = SearchIndex()
+SEARCH_FIELDS = ("id", "display_name", "orig_filename", "uploader", "policy", "created", "tags")
+
+def rebuild_search_index():
+    """Index every file record in one bulk build, then swap it in for the live index."""
+    global search_index
+    fresh = SearchIndex()
+    fresh.build(file_comp.iter_files(SEARCH_FIELDS))
+    search_index = fresh
+
+# Other worker processes write to the same store; follow its change feed so
+# this process's in-memory views (context policies, search index) stay current.
+_view_lock = threading.Lock()
+_view_rebuilding = False
+_view_seq = file_store.changes_since(None)[0]
+loaded_policies = context_comp.load(file_store.list_context_policies())
+if loaded_policies:
+    print(f"Loaded {loaded_policies} context policies from the metadata store")
+rebuild_search_index()
+
+@app.before_request
+def sync_metadata_views():
+    global _view_seq, _view_rebuilding
+    with _view_lock:
+        if _view_rebuilding:
+            return  # another request is rebuilding the views; serve the current ones meanwhile
+        head, changes = file_store.changes_since(_view_seq)
+        if changes is None:
+            _view_rebuilding = True
+        else:
+            for section, fid in changes:
+                if section != "files":
+                    continue
+                rec = file_comp.get_file(fid)
+                if rec and rec.get("context_policy"):
+                    context_comp.add_policy(fid, rec["context_policy"])
+                else:
+                    context_comp.remove_policy(fid)
+                if rec:
+                    search_index.add(rec)
+                else:
+                    search_index.remove(fid)
+            _view_seq = head
+            return
+    # the change feed no longer reaches our position: rebuild outside the lock
+    # (changes after head are replayed next time; applying them twice is harmless)
+    try:
+        context_comp.load(file_store.list_context_policies())
+        rebuild_search_index()
+        with _view_lock:
+            _view_seq = head
+    finally:
+        _view_rebuilding = False
+
+
+chunk_store = ChunkStore(s3c, file_comp)
 
 UPLOAD_TEMP_DIR = "uploads"
 os.makedirs(UPLOAD_TEMP_DIR, exist_ok=True)
+MIGRATION_CHECKPOINT = os.path.join(UPLOAD_TEMP_DIR, "migration_checkpoint.json")
+upload_sessions = UploadSessionManager(chunk_store, os.path.join(UPLOAD_TEMP_DIR, "sessions"))
+gc = GarbageCollector(
+    file_comp, s3c,
+    temp_rules=[(crypto.keys_folder, ("dec_*",)), (UPLOAD_TEMP_DIR, ("dl_*.enc", "mig_*", "*-*-*-*-*_*"))],
+    upload_sessions=upload_sessions,
+    lock_path=os.path.join(UPLOAD_TEMP_DIR, "gc.lock"),
+    migration_checkpoint=MIGRATION_CHECKPOINT,
+    chunk_lock=chunk_store.lock,
+)
+if GC_INTERVAL > 0:
+    gc.start(GC_INTERVAL)
 
 # ---------------- Register ----------------
 @app.route("/register", methods=["POST"])
@@ -61,19 +189,96 @@ def register():
 
     return jsonify({"success": True, "user": res, "abe_sk": abe_sk_b64})
 
+# request context fields /list_files takes as query params (other routes take a JSON context)
+CONTEXT_QUERY_FIELDS = ("location", "device", "device_id", "department", "role")
+
+def _request_context(claimed):
+    """
+    The context access policies are checked against: the client's claimed
+    fields (device normalized to device_id) plus the connection's IP, which
+    cidr rules match rather than a claimed address.
+    """
+    context = dict(claimed or {})
+    if "device" in context and "device_id" not in context:
+        context["device_id"] = context["device"]
+    context["ip"] = request.remote_addr
+    return context
+
+def _client_details(context=None, **details):
+    """Event details plus the client's IP and claimed location (for the security counters)."""
+    details["ip"] = request.remote_addr
+    if context and context.get("location"):
+        details["location"] = context["location"]
+    return details
+
 # ---------------- Login (for CLI compat) ----------------
 @app.route("/login", methods=["POST"])
 def login():
     j = request.json
     username = j.get("username")
     user = user_comp.get_user(username)
+    claimed = j.get("context") or {}
     if not user:
-        log_event(username, "LOGIN_FAIL", {"reason": "unknown user"})
+        log_event(username, "LOGIN_FAIL", _client_details(claimed, reason="unknown user"))
         return jsonify({"ok": False, "error": "unknown user"}), 404
-    log_event(username, "LOGIN_SUCCESS")
-    return jsonify({"ok": True, "user": user})
+    # the claimed location, else the one the user registered with
+    location = claimed.get("location") or user.get("location")
+    log_event(username, "LOGIN_SUCCESS", _client_details({"location": location}))
+    # records are keyed by username, not id; hand it back for username-keyed calls such as /list_files
+    return jsonify({"ok": True, "user": {**user, "username": username}})
 
 # ---------------- Upload ----------------
+def parse_tags(value):
+    """Tags from a comma-separated string or a JSON list."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [str(t).strip() for t in value if str(t).strip()]
+
+CONTEXT_POLICY_FIELDS = ("context_policy", "allowed_locations", "required_device", "required_department", "time_window")
+
+def parse_context_policy(fields):
+    """
+    The context policy described by upload form fields (JSON strings / CSV),
+    or None. Raises ValueError for unreadable JSON or a rule that won't compile,
+    so a file is never stored with a policy that silently fails to apply.
+    """
+    context_policy_json = fields.get("context_policy")
+    allowed_locations = fields.get("allowed_locations")
+    required_device = fields.get("required_device")
+    required_department = fields.get("required_department")
+    time_window_json = fields.get("time_window")
+
+    if context_policy_json:
+        try:
+            cp = json.loads(context_policy_json)
+        except ValueError as e:
+            raise ValueError(f"invalid context_policy JSON: {e}")
+    else:
+        cp = {}
+        if allowed_locations:
+            cp["allowed_locations"] = [x.strip() for x in allowed_locations.split(",") if x.strip()]
+        if required_device:
+            cp["allowed_devices"] = [required_device]
+        if time_window_json:
+            try:
+                cp["time_window"] = json.loads(time_window_json)
+            except ValueError as e:
+                raise ValueError(f"invalid time_window JSON: {e}")
+    if required_department and isinstance(cp, dict):
+        department = {"in": {"field": "department", "values": [x.strip() for x in required_department.split(",") if x.strip()]}}
+        cp["rule"] = {"all": [cp["rule"], department]} if "rule" in cp else department
+    validate_policy(cp)
+    return cp or None
+
+def apply_context_policy(fid, fields):
+    """Apply the context policy described by upload form fields (validated by parse_context_policy)."""
+    cp = parse_context_policy(fields)
+    if cp:
+        context_comp.add_policy(fid, cp)
+        file_comp.set_context_policy(fid, cp)
+
 @app.route("/upload", methods=["POST"])
 def upload():
     if 'file' not in request.files:
@@ -88,83 +293,262 @@ def upload():
     if not policy:
         return jsonify({"success": False, "error": "policy is required"}), 400
 
-    # Context policy fields
-    context_policy_json = request.form.get("context_policy")
-    allowed_locations = request.form.get("allowed_locations")
-    required_device = request.form.get("required_device")
-    required_department = request.form.get("required_department")
-    time_window_json = request.form.get("time_window")
+    try:
+        parse_context_policy(request.form)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
 
     fname = f.filename
     local_path = os.path.join(UPLOAD_TEMP_DIR, f"{uuid.uuid4()}_{fname}")
     f.save(local_path)
 
-    # Encrypt file with Waters11 CP-ABE
-    try:
-        crypto.load_master_keys()
-        meta = crypto.encrypt_file_hybrid(local_path, policy)
-    except Exception as e:
-        print(f"Waters11 encryption failed: {e}")
-        return jsonify({"success": False, "error": f"encryption failed: {str(e)}"}), 500
+    dedup_stats = None
+    if DEDUP_UPLOADS:
+        # Chunk + convergent-encrypt under the policy scope; only unseen chunks reach S3
+        try:
+            manifest, dedup_stats = chunk_store.store_file(local_path, policy)
+            crypto.load_master_keys()
+            meta = crypto.encrypt_manifest_hybrid(manifest, fname, policy)
+        except Exception as e:
+            print(f"Dedup upload failed: {e}")
+            return jsonify({"success": False, "error": f"encryption failed: {str(e)}"}), 500
+        s3_key = None
+    else:
+        # Encrypt file with Waters11 CP-ABE
+        try:
+            crypto.load_master_keys()
+            meta = crypto.encrypt_file_hybrid(local_path, policy)
+        except Exception as e:
+            print(f"Waters11 encryption failed: {e}")
+            return jsonify({"success": False, "error": f"encryption failed: {str(e)}"}), 500
 
-    # ✅ BACK TO S3 UPLOAD (using real credentials)
-    s3_key = f"enc/{uuid.uuid4()}_{fname}.enc"
-    if not s3c.upload_file(meta["enc_file_path"], s3_key):
-        return jsonify({"success": False, "error": "s3 upload failed"}), 500
+        # ✅ BACK TO S3 UPLOAD (using real credentials)
+        s3_key = f"{ENCRYPTED_PREFIX}{uuid.uuid4()}_{fname}.enc"
+        if not s3c.upload_file(meta["enc_file_path"], s3_key):
+            return jsonify({"success": False, "error": "s3 upload failed"}), 500
 
     # Register in database
-    fid = file_comp.register_encrypted_file(username, meta, s3_key=s3_key)
+    fid = file_comp.register_encrypted_file(username, meta, s3_key=s3_key, tags=parse_tags(request.form.get("tags")))
 
     # Handle context policies
-    applied_policy = None
-    if context_policy_json:
-        try:
-            cp = json.loads(context_policy_json)
-            applied_policy = cp
-            context_comp.add_policy(fid, cp)
-            file_comp.set_context_policy(fid, cp)
-        except Exception as e:
-            print("Invalid context policy:", e)
-
-    if not applied_policy:
-        cp = {}
-        if allowed_locations:
-            cp["allowed_locations"] = [x.strip() for x in allowed_locations.split(",") if x.strip()]
-        if required_device:
-            cp["allowed_devices"] = [required_device]
-        if time_window_json:
-            try:
-                tw = json.loads(time_window_json)
-                cp["time_window"] = tw
-            except Exception as e:
-                print("Invalid time_window JSON:", e)
-
-        if cp:
-            context_comp.add_policy(fid, cp)
-            file_comp.set_context_policy(fid, cp)
+    apply_context_policy(fid, request.form)
 
     # Clean up local encrypted file after S3 upload
     try:
-        os.remove(meta["enc_file_path"])
+        if meta.get("enc_file_path"):
+            os.remove(meta["enc_file_path"])
         os.remove(local_path)  # Also remove original temp file
     except Exception:
         pass
 
-    log_event(username, "UPLOAD_SUCCESS", {"file_id": fid, "s3_key": s3_key})
-    return jsonify({"success": True, "file_id": fid, "s3_key": s3_key})
+    log_event(username, "UPLOAD_SUCCESS", {"file_id": fid, "s3_key": s3_key, "dedup": dedup_stats})
+    return jsonify({"success": True, "file_id": fid, "s3_key": s3_key, "dedup": dedup_stats})
+
+
+# ---------------- Resumable upload ----------------
+@app.route("/upload/session", methods=["POST"])
+def create_upload_session():
+    j = request.json or {}
+    username = j.get("username") or j.get("owner")
+    policy = j.get("policy")
+    filename = j.get("filename")
+    if not username or not policy or not filename:
+        return jsonify({"success": False, "error": "username, policy and filename are required"}), 400
+    if not user_comp.get_user(username):
+        return jsonify({"success": False, "error": "unknown user"}), 404
+
+    # keep context policy fields in the same string form /upload receives them
+    options = {}
+    for key in CONTEXT_POLICY_FIELDS:
+        if j.get(key) is not None:
+            options[key] = j[key] if isinstance(j[key], str) else json.dumps(j[key])
+    try:
+        parse_context_policy(options)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if j.get("tags"):
+        options["tags"] = ",".join(parse_tags(j["tags"]))
+    try:
+        session = upload_sessions.create(username, policy, filename, j.get("total_parts"), options)
+    except (UploadSessionError, TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except OSError as e:
+        print(f"Upload session create failed: {e}")
+        return jsonify({"success": False, "error": "session storage unavailable, retry"}), 503
+    return jsonify({"success": True, "session_id": session["id"], "total_parts": session["total_parts"],
+                    "max_part_size": MAX_PART_SIZE, "expires": session["expires"]})
+
+@app.route("/upload/session/<sid>/part/<int:index>", methods=["PUT"])
+def put_upload_part(sid, index):
+    try:
+        digest = upload_sessions.put_part(sid, index, request.get_data())
+    except UploadSessionError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"Part upload failed: {e}")
+        return jsonify({"success": False, "error": "part storage failed"}), 500
+    return jsonify({"success": True, "index": index, "sha256": digest})
+
+@app.route("/upload/session/<sid>", methods=["GET"])
+def upload_session_status(sid):
+    try:
+        return jsonify({"success": True, **upload_sessions.status(sid)})
+    except UploadSessionError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+
+@app.route("/upload/session/<sid>", methods=["DELETE"])
+def abort_upload_session(sid):
+    try:
+        upload_sessions.abort(sid)
+    except UploadSessionError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+    return jsonify({"success": True})
+
+@app.route("/upload/session/<sid>/finalize", methods=["POST"])
+def finalize_upload_session(sid):
+    j = request.json or {}
+    try:
+        session, manifest, stats = upload_sessions.finalize(sid, j.get("merkle_root"))
+    except UploadSessionError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    try:
+        crypto.load_master_keys()
+        meta = crypto.encrypt_manifest_hybrid(manifest, session["filename"], session["policy"])
+    except Exception as e:
+        print(f"Waters11 encryption failed: {e}")
+        upload_sessions.release(sid)
+        return jsonify({"success": False, "error": f"encryption failed: {str(e)}"}), 500
+
+    username = session["username"]
+    try:
+        fid = file_comp.register_encrypted_file(username, meta, tags=parse_tags(session["options"].get("tags")))
+        apply_context_policy(fid, session["options"])
+    except Exception as e:
+        print(f"Registering resumable upload failed: {e}")
+        upload_sessions.release(sid)
+        return jsonify({"success": False, "error": "file registration failed"}), 500
+    # only now is the upload safe to forget: catalog its chunks and drop the session
+    upload_sessions.complete(session, manifest)
+
+    log_event(username, "UPLOAD_SUCCESS", {"file_id": fid, "resumable": True, "dedup": stats})
+    return jsonify({"success": True, "file_id": fid, "dedup": stats})
 
 
 # ---------------- List ----------------
 @app.route("/list_files", methods=["GET"])
 def list_files():
-    return jsonify({"ok": True, "files": file_comp.list_files()})
+    """
+    Paginated listing, newest first. Query params: uploader, attribute
+    (comma-separated policy attributes, all required), created_from,
+    created_to, name_prefix, limit, cursor (next_cursor of the previous page)
+    and fields (comma-separated projection). With username, only files whose
+    ABE policy that user's attributes satisfy are listed. With any of the
+    CONTEXT_QUERY_FIELDS (location, device_id, department, ...), each file is
+    marked context_allowed for that request context.
+    """
+    args = request.args
+    fields = [f for f in args.get("fields", "").split(",") if f] or None
+    accessible_to = None
+    if args.get("username"):
+        user = user_comp.get_user(args["username"])
+        if not user:
+            return jsonify({"ok": False, "error": "unknown user"}), 404
+        accessible_to = user.get("attributes") or []
+    try:
+        files, next_cursor = file_comp.query_files(
+            uploader=args.get("uploader") or None,
+            attributes=[a for a in args.get("attribute", "").split(",") if a],
+            created_from=args.get("created_from") or None,
+            created_to=args.get("created_to") or None,
+            name_prefix=args.get("name_prefix") or None,
+            cursor=args.get("cursor") or None,
+            limit=args.get("limit", 50),
+            fields=fields,
+            accessible_to=accessible_to,
+        )
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    claimed = {k: args[k] for k in CONTEXT_QUERY_FIELDS if args.get(k)}
+    if claimed:
+        context = _request_context(claimed)
+        allowed = context_comp.check_access_many([f["id"] for f in files if "id" in f], context)
+        for f in files:
+            f["context_allowed"] = f.get("id") in allowed
+    return jsonify({"ok": True, "files": files, "next_cursor": next_cursor})
+
+@app.route("/files/accessible", methods=["POST"])
+def accessible_files():
+    """
+    Which of file_ids the request context may open under their context
+    policies, evaluated in one batch. Body: {file_ids: [...], context: {...}}.
+    """
+    j = request.json or {}
+    file_ids = j.get("file_ids")
+    if not isinstance(file_ids, list):
+        return jsonify({"ok": False, "error": "file_ids must be a list"}), 400
+    context = _request_context(j.get("context"))
+    allowed = context_comp.check_access_many([str(f) for f in file_ids], context)
+    return jsonify({"ok": True, "allowed": [f for f in file_ids if str(f) in allowed],
+                    "denied": [f for f in file_ids if str(f) not in allowed]})
 
 # Alias for CLI
 @app.route("/list", methods=["GET"])
 def list_files_alias():
     return list_files()
 
+# ---------------- Search ----------------
+@app.route("/search", methods=["GET"])
+def search_files():
+    """
+    Ranked search over file names, tags, uploader and policy attributes.
+    Query params: q, limit (max 100), offset (next_offset of the previous page).
+    """
+    q = request.args.get("q", "")
+    try:
+        limit = max(1, min(int(request.args.get("limit", 20)), 100))
+        offset = max(0, int(request.args.get("offset", 0)))
+    except ValueError:
+        return jsonify({"ok": False, "error": "limit and offset must be integers"}), 400
+    hits, has_more = search_index.search(q, offset=offset, limit=limit)
+    results = []
+    for fid, score in hits:
+        rec = file_comp.get_file(fid)
+        if rec:
+            results.append({**{k: rec[k] for k in LIST_FIELDS if k in rec}, "score": score})
+    return jsonify({"ok": True, "results": results, "next_offset": offset + limit if has_more else None})
+
 # ---------------- Download ----------------
+def _presigned_url(key):
+    url = s3c.presign_get(key, DIRECT_URL_TTL)
+    if url and url.startswith("/"):
+        # local backend hands out server-relative URLs
+        url = request.host_url.rstrip("/") + url
+    return url
+
+def direct_download_ticket(fmeta, abe_sk_b64):
+    """
+    Unwrap the content key(s) with the user's ABE key and return presigned
+    ciphertext URL(s) instead of streaming the file through this process.
+    Ciphertext layout (single object and every chunk): nonce(16) | tag(16) | AES-GCM ct.
+    """
+    crypto.load_master_keys()
+    ticket = {"success": True, "mode": "direct", "filename": fmeta["orig_filename"], "expires_in": DIRECT_URL_TTL}
+    if fmeta.get("format") == "cdc":
+        manifest = crypto.decrypt_manifest_hybrid(fmeta, abe_sk_b64)
+        ticket["format"] = "cdc"
+        ticket["sha256"] = manifest["sha256"]
+        ticket["size"] = manifest["size"]
+        ticket["chunks"] = [
+            {"url": _presigned_url(chunk_store.object_key(cid)), "size": size, "key": key_hex}
+            for cid, size, key_hex in manifest["chunks"]
+        ]
+    else:
+        ticket["format"] = "single"
+        ticket["key"] = crypto.unwrap_file_key(fmeta, abe_sk_b64).hex()
+        ticket["url"] = _presigned_url(fmeta["s3_key"])
+    return ticket
+
 @app.route("/download", methods=["POST"])
 def download():
     j = request.json
@@ -179,13 +563,20 @@ def download():
     fmeta = file_comp.get_file(fid)
     if not fmeta:
         return jsonify({"success": False, "error": "unknown file"}), 404
+    metrics.inc("download.requests")
 
-    # Normalize device key
-    if "device" in context and "device_id" not in context:
-        context["device_id"] = context["device"]
+    # ABE policy gate: the user's key was minted from their registered attributes,
+    # so an unsatisfiable policy is rejected here, before any storage read or pairing
+    if file_comp.can_decrypt(user.get("attributes") or [], fmeta) is False:
+        metrics.inc("download.policy_rejected")
+        log_event(username, "DOWNLOAD_DENIED_POLICY", _client_details(context, file_id=fid))
+        return jsonify({"success": False, "error": "attributes do not satisfy file policy"}), 403
+
+    context = _request_context(context)
 
     # Context-aware access control
     if not context_comp.check_access(fid, context):
+        metrics.inc("download.context_denied")
         return jsonify({"success": False, "error": "context policy denied"}), 403
 
     # FL anomaly check
@@ -198,10 +589,46 @@ def download():
         threshold = fl_comp.model.get("global_threshold", 0.6)
     #threshold = 1.5  # Temporarily disable FL checks
     if score >= threshold:
-        log_event(username, "DOWNLOAD_FLAGGED", {"file_id": fid, "score": score})
+        metrics.inc("download.flagged")
+        log_event(username, "DOWNLOAD_FLAGGED", _client_details(context, file_id=fid, score=score))
         return jsonify({"success": False, "error": "access flagged", "score": score}), 403
 
 
+    try:
+        abe_sk_b64 = user_comp.get_user_abe_sk(username)
+    except KeyStoreError as e:
+        print(f"Keystore read failed for {username}: {e}")
+        abe_sk_b64 = None
+    if not abe_sk_b64:
+        return jsonify({"success": False, "error": "user has no Waters11 abe key"}), 500
+
+    if j.get("mode") == "direct":
+        if fmeta.get("format") != "cdc" and not fmeta.get("s3_key"):
+            return jsonify({"success": False, "error": "file not in s3"}), 500
+        try:
+            ticket = direct_download_ticket(fmeta, abe_sk_b64)
+        except Exception as e:
+            metrics.inc("download.decrypt_failed")
+            return jsonify({"success": False, "error": f"Waters11 decryption failed: {e}"}), 500
+        log_event(username, "DOWNLOAD_SUCCESS", _client_details(context, file_id=fid, mode="direct"))
+        return jsonify(ticket)
+
+    if fmeta.get("format") == "cdc":
+        # Deduplicated file: unwrap the manifest, then fetch + decrypt its chunks
+        dec_path = None
+        try:
+            crypto.load_master_keys()
+            manifest = crypto.decrypt_manifest_hybrid(fmeta, abe_sk_b64)
+            dec_path = os.path.join(crypto.keys_folder, f"dec_{uuid.uuid4()}_{os.path.basename(fmeta['orig_filename'])}")
+            chunk_store.restore_file(manifest, dec_path)
+        except Exception as e:
+            if dec_path and os.path.exists(dec_path):
+                os.remove(dec_path)
+            metrics.inc("download.decrypt_failed")
+            return jsonify({"success": False, "error": f"Waters11 decryption failed: {e}"}), 500
+        log_event(username, "DOWNLOAD_SUCCESS", _client_details(context, file_id=fid))
+        return send_file(dec_path, as_attachment=True, download_name=fmeta["orig_filename"])
+
     # ✅ BACK TO S3 DOWNLOAD
     s3_key = fmeta.get("s3_key")
     if not s3_key:
@@ -220,35 +647,259 @@ def download():
         "policy": fmeta["policy"],
     }
 
-    abe_sk_b64 = user.get("abe_sk")
-    if not abe_sk_b64:
-        return jsonify({"success": False, "error": "user has no Waters11 abe key"}), 500
-
     try:
         crypto.load_master_keys()
         dec_path = crypto.decrypt_file_hybrid(encrypted_meta, abe_sk_b64)
     except Exception as e:
+        metrics.inc("download.decrypt_failed")
         return jsonify({"success": False, "error": f"Waters11 decryption failed: {e}"}), 500
+    finally:
+        # Clean up temporary downloaded file (also on failure)
+        try:
+            os.remove(local_tmp)
+        except Exception:
+            pass
+    log_event(username, "DOWNLOAD_SUCCESS", _client_details(context, file_id=fid))
+    return send_file(dec_path, as_attachment=True, download_name=fmeta["orig_filename"])
 
-    # Clean up temporary downloaded file
+# ---------------- Admin: ciphertext format migration ----------------
+migration = None
+
+@app.route("/admin/migrations", methods=["POST"])
+def start_migration():
+    global migration
+    j = request.json or {}
+    if migration and migration.status["running"]:
+        return jsonify({"success": False, "error": "migration already running", "progress": migration.progress()}), 409
+    crypto.load_master_keys()
+    migration = MigrationEngine(
+        file_comp, s3c, crypto, chunk_store,
+        checkpoint_path=MIGRATION_CHECKPOINT,
+        work_dir=UPLOAD_TEMP_DIR,
+        max_workers=j.get("max_workers", 4),
+        bytes_per_sec=j.get("bytes_per_sec"),
+    )
+    migration.start()
+    return jsonify({"success": True, "progress": migration.progress()}), 202
+
+@app.route("/admin/migrations", methods=["GET"])
+def migration_status():
+    if not migration:
+        return jsonify({"success": True, "progress": None})
+    return jsonify({"success": True, "progress": migration.progress()})
+
+@app.route("/admin/migrations", methods=["DELETE"])
+def stop_migration():
+    if migration:
+        migration.stop()
+    return jsonify({"success": True})
+
+# ---------------- Admin: garbage collection ----------------
+@app.route("/admin/gc", methods=["POST"])
+def run_gc():
+    j = request.json or {}
+    report = gc.run_once(dry_run=bool(j.get("dry_run")))
+    if report is None:
+        return jsonify({"success": False, "error": "gc already running"}), 409
+    log_event("system", "GC_RUN", {"reclaimed_bytes": report["reclaimed_bytes"], "dry_run": report["dry_run"]})
+    return jsonify({"success": True, "report": report})
+
+@app.route("/admin/gc", methods=["GET"])
+def gc_report():
+    return jsonify({"success": True, "report": gc.last_report})
+
+# ---------------- Admin: file index ----------------
+@app.route("/admin/files/stats", methods=["GET"])
+def file_index_stats():
+    return jsonify({"success": True, "stats": file_comp.index_stats()})
+
+# ---------------- Admin: metrics ----------------
+@app.route("/admin/metrics", methods=["GET"])
+def metrics_report():
+    return jsonify({"success": True, "metrics": metrics.snapshot(), "policy_cache": file_comp.policies.stats(),
+                    "event_writer": event_writer().stats(), "event_stream": event_hub.stats(),
+                    "security_counters": security_counters.stats()})
+
+# ---------------- Admin: metadata shards ----------------
+@app.route("/admin/shards", methods=["GET"])
+def shard_status():
+    if not isinstance(file_store, ShardedFileStore):
+        return jsonify({"success": False, "error": "file metadata is not sharded"}), 400
+    return jsonify({"success": True, "status": file_store.status()})
+
+@app.route("/admin/shards", methods=["POST"])
+def add_shard():
+    if not isinstance(file_store, ShardedFileStore):
+        return jsonify({"success": False, "error": "file metadata is not sharded"}), 400
+    j = request.json or {}
     try:
-        os.remove(local_tmp)
-    except Exception:
+        name = file_store.add_shard(j.get("name"))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 409
+    log_event("system", "SHARD_ADDED", {"shard": name})
+    return jsonify({"success": True, "shard": name, "status": file_store.status()}), 202
+
+# ---------------- Local storage (signed URLs) ----------------
+@app.route("/storage/<path:key>", methods=["GET"])
+def storage_object(key):
+    if STORAGE_BACKEND != "local":
+        abort(404)
+    if not s3c.verify_signature(key, request.args.get("expires"), request.args.get("sig")):
+        abort(403)
+    path = s3c.local_path(key)
+    if not path:
+        abort(404)
+    return send_file(path, mimetype="application/octet-stream", conditional=True)
+
+EVENT_FILTERS = ("user", "action", "file_id")
+EVENT_GROUPS = ("user", "action", "file_id", "hour", "day")
+
+def _event_time(value):
+    """Epoch seconds from an ISO-8601 timestamp (UTC if naive) or a number."""
+    try:
+        return float(value)
+    except ValueError:
         pass
-    log_event(username, "DOWNLOAD_SUCCESS", {"file_id": fid})
-    return send_file(dec_path, as_attachment=True, download_name=fmeta["orig_filename"])
+    ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+def _event_query(args):
+    """(filters, since, until) from query params; comma-separated values match any."""
+    filters = {}
+    for name in EVENT_FILTERS:
+        if args.get(name):
+            filters[name] = [v.strip() for v in args[name].split(",") if v.strip()]
+    since = _event_time(args["since"]) if args.get("since") else None
+    until = _event_time(args["until"]) if args.get("until") else None
+    return filters, since, until
+
+def _tag_anomalies(events):
+    # events are tagged when written; only ones logged before that need the rule here
+    for event in events:
+        if 'is_anomaly' not in event:
+            event['is_anomaly'] = is_anomaly(event)
+    return events
 
 @app.route("/api/events", methods=["GET"])
 def list_events():
-    events = get_events()
-    # We can also add anomaly detection information here
-    for event in events:
-        # Simple rule: failed logins are anomalies
-        if event['action'] == 'LOGIN_FAIL' or event['action'] == 'DOWNLOAD_FLAGGED':
-            event['is_anomaly'] = True
-        else:
-            event['is_anomaly'] = False
-    return jsonify({"success": True, "events": events})
+    """
+    Newest events first. Query params: limit (max 500), before (next_before of
+    the previous page), and optional filters user / action / file_id (comma
+    separated for several values) and since / until (ISO-8601 or epoch seconds).
+    """
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 500))
+        before = int(request.args["before"]) if request.args.get("before") else None
+    except ValueError:
+        return jsonify({"success": False, "error": "limit and before must be integers"}), 400
+    try:
+        filters, since, until = _event_query(request.args)
+    except ValueError:
+        return jsonify({"success": False, "error": "since and until must be ISO-8601 or epoch seconds"}), 400
+    if filters or since is not None or until is not None:
+        events = query_events(filters, since, until, limit, before)
+    else:
+        events = get_events(limit, before)
+    _tag_anomalies(events)
+    next_before = events[-1]["id"] if len(events) == limit else None
+    return jsonify({"success": True, "events": events, "next_before": next_before})
+
+@app.route("/api/events/aggregate", methods=["GET"])
+def aggregate_event_counts():
+    """
+    Event counts grouped server-side. Query params: group_by (comma separated:
+    user, action, file_id, hour, day or details.<key>), limit (max groups,
+    default 100), plus the /api/events filters. e.g.
+    ?action=LOGIN_FAIL&group_by=hour,details.location&since=2024-06-01
+    """
+    group_by = [g.strip() for g in request.args.get("group_by", "action").split(",") if g.strip()]
+    bad = [g for g in group_by if g not in EVENT_GROUPS and not g.startswith("details.")]
+    if not group_by or bad:
+        return jsonify({"success": False, "error": f"cannot group by {', '.join(bad) or 'nothing'}"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", 100)), 10000))
+        filters, since, until = _event_query(request.args)
+    except ValueError:
+        return jsonify({"success": False, "error": "invalid limit, since or until"}), 400
+    groups = aggregate_events(group_by, filters, since, until, max_groups=limit)
+    return jsonify({"success": True, "group_by": group_by, "groups": groups})
+
+@app.route("/api/events/counters", methods=["GET"])
+def event_counters():
+    """
+    Rolling event counts for one subject: ?dim=user|ip|location|action&value=...
+    Returns {window seconds: {action: count}} ("*" = any action, "anomaly" = anomalies).
+    """
+    dim, value = request.args.get("dim", "user"), request.args.get("value")
+    if dim not in DIMENSIONS or not value:
+        return jsonify({"success": False, "error": f"dim must be one of {', '.join(DIMENSIONS)} and value is required"}), 400
+    return jsonify({"success": True, "dim": dim, "value": value, "counts": security_counters.counts(dim, value)})
+
+@app.route("/api/events/top", methods=["GET"])
+def event_top_offenders():
+    """
+    Top-K values of a dimension by rolling event count. Query params: dim
+    (default user), action (default "*"; e.g. LOGIN_FAIL or anomaly), window
+    (seconds, one of the configured windows; default the shortest), k (max 100).
+    """
+    dim, action = request.args.get("dim", "user"), request.args.get("action", ANY_ACTION)
+    if dim not in DIMENSIONS:
+        return jsonify({"success": False, "error": f"dim must be one of {', '.join(DIMENSIONS)}"}), 400
+    try:
+        window = int(request.args["window"]) if request.args.get("window") else security_counters.windows[0]
+        k = max(1, min(int(request.args.get("k", 10)), 100))
+        top = security_counters.top(dim, action, window, k)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, "dim": dim, "action": action, "window": window,
+                    "top": [{"value": value, "count": n} for value, n in top]})
+
+@app.route("/api/events/stream", methods=["GET"])
+def stream_events():
+    """
+    Server-sent events: each new event as a message with its id. Reconnects
+    resume after Last-Event-ID (header, or ?last_event_id=); if that is too old
+    to replay, a "reset" event tells the client to reload /api/events.
+    """
+    try:
+        raw = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+        last_id = int(raw) if raw else None
+    except ValueError:
+        last_id = None
+    # subscribe before reading the backlog so nothing written in between is missed
+    sub = event_hub.subscribe()
+    if sub is None:
+        return jsonify({"success": False, "error": "too many event stream subscribers"}), 503
+    backlog = events_since(last_id) if last_id is not None else []
+
+    def generate():
+        sent = last_id or 0
+        try:
+            yield f"retry: {EVENT_STREAM_RETRY_MS}\n\n"
+            if backlog is None:
+                yield sse_frame({}, "reset")
+            else:
+                for event in _tag_anomalies(backlog):
+                    yield sse_frame(event)
+                    sent = event["id"]
+            while True:
+                frames = sub.get(EVENT_STREAM_HEARTBEAT)
+                if frames is None:
+                    yield sse_frame({}, "dropped")  # fell behind; the client reconnects and resumes
+                    return
+                if not frames:
+                    yield ": keepalive\n\n"
+                for event_id, frame in frames:
+                    if event_id > sent:
+                        yield frame
+                        sent = event_id
+        finally:
+            event_hub.unsubscribe(sub)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
     
 # ✅ ADD THIS CRITICAL CODE TO START THE SERVER
 if __name__ == "__main__":
@@ -1,12 +1,14 @@
 import React, { useState, useEffect } from 'react';
 import apiClient from './api';
 
+const MAX_EVENTS = 200;
+
 function Dashboard() {
   const [events, setEvents] = useState([]);
   const [isLoading, setIsLoading] = useState(true);
 
   useEffect(() => {
-    apiClient.getEvents()
+    const load = () => apiClient.getEvents()
       .then(response => {
         setEvents(response.data.events);
         setIsLoading(false);
@@ -15,6 +17,18 @@ function Dashboard() {
         console.error("Error fetching events:", error);
         setIsLoading(false);
       });
+    load();
+
+    // new events are pushed by the server instead of polled
+    const stream = apiClient.streamEvents();
+    stream.onmessage = (message) => {
+      const event = JSON.parse(message.data);
+      setEvents(current => current.some(e => e.id === event.id)
+        ? current
+        : [event, ...current].slice(0, MAX_EVENTS));
+    };
+    stream.addEventListener('reset', load);
+    return () => stream.close();
   }, []);
 
   if (isLoading) {
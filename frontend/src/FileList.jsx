@@ -1,22 +1,26 @@
 import React, { useState, useEffect } from 'react';
 import apiClient from './api';
 
+const PAGE_SIZE = 50;
+
 function FileList({ user }) {
   const [files, setFiles] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [error, setError] = useState(null);
 
-  useEffect(() => {
-    const getFiles = async () => {
-      try {
-        const response = await apiClient.listFiles();
-        setFiles(response.data.files);
-      } catch (err) {
-        setError('Could not fetch files.');
-        console.error(err);
-      }
-    };
+  const getFiles = async (cursor) => {
+    try {
+      const response = await apiClient.listFiles({ username: user.username, limit: PAGE_SIZE, cursor: cursor || undefined });
+      setFiles((prev) => (cursor ? [...prev, ...response.data.files] : response.data.files));
+      setNextCursor(response.data.next_cursor);
+    } catch (err) {
+      setError('Could not fetch files.');
+      console.error(err);
+    }
+  };
 
-    getFiles();
+  useEffect(() => {
+    getFiles(null);
   }, []);
 
   const handleDownload = async (file) => {
@@ -68,6 +72,9 @@ function FileList({ user }) {
           ))}
         </ul>
       )}
+      {nextCursor && (
+        <button onClick={() => getFiles(nextCursor)}>Load more</button>
+      )}
     </div>
   );
 }
@@ -3,12 +3,35 @@ import axios from 'axios';
 // The base URL of your Flask backend
 const API_URL = 'http://127.0.0.1:5000';
 
+const hexToBytes = (hex) => new Uint8Array(hex.match(/../g).map((b) => parseInt(b, 16)));
+
+// Stored objects are nonce(16) | tag(16) | AES-GCM ciphertext; WebCrypto wants ct | tag.
+const decryptObject = async (buffer, keyHex) => {
+    const bytes = new Uint8Array(buffer);
+    const nonce = bytes.slice(0, 16);
+    const tag = bytes.slice(16, 32);
+    const body = new Uint8Array(bytes.length - 16);
+    body.set(bytes.slice(32));
+    body.set(tag, bytes.length - 32);
+    const key = await crypto.subtle.importKey('raw', hexToBytes(keyHex), 'AES-GCM', false, ['decrypt']);
+    return crypto.subtle.decrypt({ name: 'AES-GCM', iv: nonce }, key, body);
+};
+
 const apiClient = {
   /**
-   * Fetches the list of files from the server.
+   * Fetches one page of files from the server.
+   * params: { username, limit, cursor, uploader, name_prefix, created_from, created_to, fields }
+   * With username, only files that user's attributes can decrypt are listed.
+   */
+    listFiles: (params = {}) => {
+        return axios.get(`${API_URL}/list_files`, { params });
+    },
+
+  /**
+   * Ranked search over file names, tags, uploader and policy attributes.
    */
-    listFiles: () => {
-        return axios.get(`${API_URL}/list_files`);
+    searchFiles: (q, offset = 0, limit = 20) => {
+        return axios.get(`${API_URL}/search`, { params: { q, offset, limit } });
     },
 
   /**
@@ -31,6 +54,28 @@ const apiClient = {
         });
     },
 
+  /**
+   * Direct download: the server only checks access and returns presigned
+   * ciphertext URL(s) plus content key(s); bytes are fetched and decrypted here.
+   */
+    downloadFileDirect: async (username, fileId, context) => {
+        const { data: ticket } = await axios.post(`${API_URL}/download`, {
+            username,
+            file_id: fileId,
+            context,
+            mode: 'direct',
+        });
+        const parts = ticket.format === 'cdc'
+            ? ticket.chunks
+            : [{ url: ticket.url, key: ticket.key }];
+        const plain = [];
+        for (const part of parts) {
+            const res = await axios.get(part.url, { responseType: 'arraybuffer' });
+            plain.push(await decryptObject(res.data, part.key));
+        }
+        return { filename: ticket.filename, blob: new Blob(plain) };
+    },
+
     uploadFile: (file, username, policy) => {
         const formData = new FormData();
         formData.append('file', file);
@@ -39,8 +84,28 @@ const apiClient = {
         return axios.post(`${API_URL}/upload`, formData);
     },
 
-    getEvents: () => {
-        return axios.get(`${API_URL}/api/events`);
+  /**
+   * Security events, newest first.
+   * params: { limit, before, user, action, file_id, since, until }
+   */
+    getEvents: (params = {}) => {
+        return axios.get(`${API_URL}/api/events`, { params });
+    },
+
+  /**
+   * Live security events (server-sent events). The browser reconnects on its
+   * own and resumes after the last event id it saw; listen for 'reset' to
+   * reload the list when the gap was too large to replay.
+   */
+    streamEvents: () => {
+        return new EventSource(`${API_URL}/api/events/stream`);
+    },
+
+  /**
+   * Event counts grouped server-side, e.g. { action: 'LOGIN_FAIL', group_by: 'hour,details.location' }.
+   */
+    aggregateEvents: (params = {}) => {
+        return axios.get(`${API_URL}/api/events/aggregate`, { params });
     },
 };
 